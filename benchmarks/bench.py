@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""Hermetic benchmark of the provisioning scripts against fake package managers
+
+Each scenario runs a script's main() in a fresh process with stub rpm,
+dnf, flatpak, systemctl, git, curl and sudo executables first on PATH,
+a sandboxed home directory and an in-process stand-in for the download
+hosts. Nothing needs root, network access or a Fedora system.
+
+    python3 benchmarks/bench.py --output bench.json
+    python3 benchmarks/bench.py --compare bench.json --output new.json
+"""
+
+import argparse
+import getpass
+import grp
+import importlib.util
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import urllib.response
+from email.message import Message
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+SHIM = BENCH_DIR / 'shim.py'
+
+SCRIPTS = ['fedora-install.py', 'fedora-shell.py', 'install_sunshine.py']
+SCENARIOS = ['cold', 'noop', 'partial']
+
+STUBS = ['sudo', 'rpm', 'dnf', 'flatpak', 'systemctl', 'git', 'curl', 'groupadd', 'usermod',
+         'chsh', 'install', 'ln', 'getcap', 'setcap', 'cmake', 'make', 'ninja', 'ccache', 'rpmbuild',
+         'systemd-analyze']
+
+# Seconds per invocation, plus per package for package-manager transactions
+LATENCY = {'default': 0.01, 'rpm': 0.05, 'dnf': 2.0, 'flatpak': 1.5, 'systemctl': 0.1,
+           'git': 0.5, 'curl': 0.3, 'cmake': 1.0, 'make': 3.0, 'download': 0.2}
+PER_PACKAGE = {'dnf': 0.05, 'flatpak': 0.3}
+
+RPMS = [
+    '1password', 'docker-ce', 'docker-ce-cli', 'containerd.io', 'docker-buildx-plugin',
+    'docker-compose-plugin', 'mullvad-vpn', 'timeshift', 'gh', 'akmod-nvidia',
+    'nvidia-container-toolkit', 'dnf-plugins-core', 'rpmfusion-free-release',
+    'rpmfusion-nonfree-release', 'zsh', 'boost-devel', 'cmake', 'gcc', 'gcc-c++',
+    'libcap-devel', 'libcurl-devel', 'libdrm-devel', 'libevdev-devel', 'npm',
+    'openssl-devel', 'opus-devel', 'rpm-build', 'wget', 'which',
+]
+FLATPAKS = ['com.bitwarden.desktop', 'com.discordapp.Discord', 'md.obsidian.Obsidian',
+            'com.github.zocker_160.SyncThingy', 'com.vscodium.codium', 'dev.vencord.Vesktop']
+
+# Packages dnf only resolves once the scripts have added their repositories
+THIRD_PARTY_RPMS = ['docker-ce', 'docker-ce-cli', 'containerd.io', 'docker-buildx-plugin', 'docker-compose-plugin',
+                    'mullvad-vpn', 'akmod-nvidia', 'nvidia-container-toolkit']
+
+# Commands that appear on PATH once the package providing them is installed
+PROVIDES = {'zsh': ['zsh'], 'docker-ce': ['docker'], 'sunshine': ['sunshine']}
+
+
+def scenario_state(scenario, scale):
+    """Initial stub state for a scenario"""
+    if scenario == 'cold':
+        rpms, flatpaks = [], []
+    elif scenario == 'noop':
+        rpms, flatpaks = RPMS + ['sunshine'], FLATPAKS
+    else:
+        rpms, flatpaks = RPMS[::2], FLATPAKS[::2]
+    return {
+        'user': getpass.getuser(),
+        'fedora': '41',
+        'rpms': sorted(rpms),
+        'flatpaks': sorted(flatpaks),
+        'remotes': ['flathub'] if flatpaks else [],
+        'services_active': ['sunshine.service', 'docker'] if scenario == 'noop' else [],
+        'latency': {name: value * scale for name, value in LATENCY.items()},
+        'per_package': {name: value * scale for name, value in PER_PACKAGE.items()},
+        'provides': PROVIDES,
+        'third_party': THIRD_PARTY_RPMS,
+    }
+
+
+def prepare_sandbox(sandbox, scenario, scale):
+    """Create the stub bin directory, home directory and state file"""
+    bin_dir = sandbox / 'bin'
+    home = sandbox / 'home'
+    bin_dir.mkdir()
+    home.mkdir()
+    for name in STUBS:
+        (bin_dir / name).symlink_to(SHIM)
+
+    state = scenario_state(scenario, scale)
+    for package in state['rpms']:
+        for binary in PROVIDES.get(package, []):
+            (bin_dir / binary).symlink_to(SHIM)
+    if scenario == 'noop':
+        (bin_dir / 'docker-compose').symlink_to(SHIM)
+        (home / '.oh-my-zsh').mkdir()
+        (home / 'git' / 'fedora_config' / 'powerlevel10k').mkdir(parents=True)
+        (home / '.zshrc').write_text("source powerlevel10k.zsh-theme\nnewgrp docker\n")
+    (sandbox / 'state.json').write_text(json.dumps(state))
+    (sandbox / 'log.jsonl').touch()
+
+
+class GroupMembers:
+    """Stands in for the grp module where the user is already in every group the scripts add it to"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def getgrnam(self, name):
+        return grp.struct_group((name, 'x', 0, [self.user]))
+
+
+class FakeUpstream(urllib.request.BaseHandler):
+    """Answers every HTTP(S) request locally so downloads stay hermetic"""
+
+    handler_order = 100
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def _open(self, request):
+        time.sleep(self.latency)
+        url = request.full_url
+        if request.get_header('If-none-match') == '"bench"':
+            raise urllib.error.HTTPError(url, 304, 'Not Modified', Message(), None)
+        if 'api.github.com' in url:
+            body = json.dumps({'tag_name': 'v2.29.7'}).encode()
+        else:
+            body = b'\0' * 4096
+        headers = Message()
+        headers['ETag'] = '"bench"'
+        response = urllib.response.addinfourl(io.BytesIO(body), headers, url, 200)
+        response.msg = 'OK'
+        return response
+
+    http_open = _open
+    https_open = _open
+
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_')[:-3], REPO_DIR / name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_one(script, sandbox):
+    """Run one script inside a prepared sandbox and write result.json (child process)"""
+    sandbox = Path(sandbox)
+    state = json.loads((sandbox / 'state.json').read_text())
+    os.environ.update({
+        'PATH': f"{sandbox / 'bin'}:{os.environ['PATH']}",
+        'BENCH_BIN': str(sandbox / 'bin'),
+        'BENCH_STATE': str(sandbox / 'state.json'),
+        'BENCH_LOG': str(sandbox / 'log.jsonl'),
+    })
+    sys.path.insert(0, str(REPO_DIR))
+    urllib.request.install_opener(urllib.request.build_opener(FakeUpstream(state['latency']['download'])))
+
+    from provisioning import package_state
+    from provisioning.docker_daemon import docker_daemon, merge_config, render_config
+    from provisioning.host_facts import host
+    from provisioning.repo_metadata import metadata
+    from provisioning.runner import tracer
+
+    started = time.time()
+    module = load_script(script)
+    host.override(user=state['user'], home=str(sandbox / 'home'))
+    if hasattr(module, 'SERVICE_FILE_PATH'):
+        module.SERVICE_FILE_PATH = str(sandbox / 'sunshine.service')
+    if hasattr(module, 'SUNSHINE_BINARY'):
+        module.SUNSHINE_BINARY = str(sandbox / 'bin' / 'sunshine')
+    metadata.cache_globs = [str(sandbox / 'dnf-cache' / '*' / 'repomd.xml')]
+    docker_daemon.path = sandbox / 'docker' / 'daemon.json'
+    # The stub rpm holds the package state, never the host's RPM database
+    package_state.BACKENDS = ['rpm-cli']
+
+    argv = ['--journal', str(sandbox / 'journal.json')]
+    if script == 'fedora-install.py':
+        argv += ['--download-cache', str(sandbox / 'downloads')]
+    else:
+        argv += ['--git-cache', str(sandbox / 'git')]
+    if script == 'install_sunshine.py':
+        argv += ['--venv-cache', str(sandbox / 'venvs')]
+    if script != 'fedora-shell.py':
+        # Never touch the host's /etc/dnf/dnf.conf
+        argv += ['--dnf-profile', 'off']
+    if 'sunshine.service' in state['services_active'] and hasattr(module, 'sunshine_unit'):
+        # A fully provisioned machine already runs the current unit
+        Path(module.SERVICE_FILE_PATH).write_text(module.sunshine_unit(module.parse_args(argv)))
+    if 'docker' in state['services_active'] and hasattr(module, 'docker_settings'):
+        # Its Docker already runs with the current daemon.json
+        settings = module.docker_settings(module.parse_args(argv))
+        docker_daemon.path.parent.mkdir()
+        docker_daemon.path.write_text(render_config(merge_config({}, settings)))
+        # The sandbox cannot add the user to the host's docker group
+        module.grp = GroupMembers(state['user'])
+    if module.main(module.parse_args(argv)) is False:
+        sys.exit(1)
+    wall = time.time() - started
+
+    length, chain = tracer.critical_path()
+    result = {
+        'wall_seconds': round(wall, 3),
+        'process_spawns': len(tracer.commands),
+        'critical_path_seconds': round(length, 3),
+        'critical_path': chain,
+    }
+    (sandbox / 'result.json').write_text(json.dumps(result))
+
+
+def run_scenario(script, scenario, scale, keep=False):
+    """Run a script/scenario pair in a fresh process and collect its metrics"""
+    sandbox = Path(tempfile.mkdtemp(prefix=f"bench-{scenario}-"))
+    prepare_sandbox(sandbox, scenario, scale)
+    child = subprocess.run([sys.executable, __file__, '--run-one', script, str(sandbox)],
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    result = {'script': script, 'scenario': scenario, 'exit_code': child.returncode}
+    if (sandbox / 'result.json').exists():
+        result.update(json.loads((sandbox / 'result.json').read_text()))
+    with open(sandbox / 'log.jsonl') as f:
+        result['stub_invocations'] = sum(1 for _ in f)
+    if child.returncode != 0:
+        result['output_tail'] = child.stdout.decode(errors='replace').splitlines()[-20:]
+    if keep:
+        result['sandbox'] = str(sandbox)
+    else:
+        shutil.rmtree(sandbox)
+    return result
+
+
+def git_revision():
+    result = subprocess.run(['git', '-C', str(REPO_DIR), 'rev-parse', '--short', 'HEAD'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return result.stdout.decode().strip() or None
+
+
+def print_results(results, baseline=None):
+    """Print a table of the results, with deltas against a baseline run"""
+    previous = {}
+    if baseline:
+        previous = {(r['script'], r['scenario']): r for r in baseline['results']}
+    print(f"\n{'script':<22} {'scenario':<8} {'wall':>8} {'spawns':>7} {'critical':>9}")
+    for result in results:
+        line = (f"{result['script']:<22} {result['scenario']:<8} "
+                f"{result.get('wall_seconds', float('nan')):>7.2f}s {result.get('process_spawns', 0):>7} "
+                f"{result.get('critical_path_seconds', float('nan')):>8.2f}s")
+        old = previous.get((result['script'], result['scenario']))
+        if old and old.get('wall_seconds') and 'wall_seconds' in result:
+            change = (result['wall_seconds'] - old['wall_seconds']) / old['wall_seconds'] * 100
+            line += f"   wall {change:+.0f}%  spawns {result.get('process_spawns', 0) - old.get('process_spawns', 0):+d}"
+        if result['exit_code'] != 0:
+            line += "   FAILED"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the provisioning scripts against stub tools")
+    parser.add_argument('--run-one', nargs=2, metavar=('SCRIPT', 'SANDBOX'), help=argparse.SUPPRESS)
+    parser.add_argument('--scripts', nargs='+', default=SCRIPTS, choices=SCRIPTS)
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="multiply every stub latency, 0 measures pure script overhead")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the sandboxes for inspection")
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(*args.run_one)
+        return 0
+
+    results = []
+    for script in args.scripts:
+        for scenario in args.scenarios:
+            print(f"Running {script} ({scenario})...")
+            results.append(run_scenario(script, scenario, args.latency_scale, args.keep))
+
+    report = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'latency_scale': args.latency_scale,
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if any(r['exit_code'] != 0 for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
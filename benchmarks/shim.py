@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Stand-in for rpm, dnf, flatpak, systemctl, git, curl, sudo and friends
+
+The benchmark harness links this file under each command name in the
+directory named by BENCH_BIN, which it places first on PATH. Installed
+packages, Flatpak apps and per-command latencies live in the JSON state
+file named by BENCH_STATE, and every invocation is appended to the log
+named by BENCH_LOG.
+"""
+
+import fcntl
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+STATE_PATH = os.environ['BENCH_STATE']
+LOG_PATH = os.environ['BENCH_LOG']
+BIN_DIR = os.environ['BENCH_BIN']
+
+
+@contextmanager
+def locked_state():
+    """Load the shared state under an exclusive lock and save it afterwards"""
+    with open(STATE_PATH + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(STATE_PATH) as f:
+            state = json.load(f)
+        yield state
+        with open(STATE_PATH, 'w') as f:
+            json.dump(state, f)
+
+
+def read_state():
+    with locked_state() as state:
+        return state
+
+
+def log(name, args):
+    with open(LOG_PATH, 'a') as f:
+        f.write(json.dumps({'cmd': name, 'argv': args, 'time': time.time()}) + '\n')
+
+
+def delay(state, name, units=0, fixed=True):
+    latency = state['latency'].get(name, state['latency'].get('default', 0.0)) if fixed else 0.0
+    latency += units * state.get('per_package', {}).get(name, 0.0)
+    if latency:
+        time.sleep(latency)
+
+
+def download(state, name, units):
+    """Pay the download half of units packages, one downloading command at a time like a shared link"""
+    if not units:
+        return
+    with open(STATE_PATH + '.net', 'w') as link:
+        fcntl.flock(link, fcntl.LOCK_EX)
+        delay(state, name, units / 2, fixed=False)
+
+
+def provide_binaries(state, packages):
+    """Create shims for the commands an installed package would provide"""
+    for package in packages:
+        for binary in state.get('provides', {}).get(package, []):
+            target = os.path.join(BIN_DIR, binary)
+            if not os.path.exists(target):
+                os.symlink(os.path.realpath(__file__), target)
+
+
+def package_name(target):
+    """Package name for a dnf target that may be a URL or a local RPM path"""
+    base = os.path.basename(target)
+    if not base.endswith('.rpm') and '/' not in target:
+        return target
+    match = re.match(r'(.+?)-(latest|release|\d)', base)
+    return match.group(1) + ('-release' if match and match.group(2) == 'release' else '') if match else base
+
+
+def positional(args):
+    return [a for a in args if not a.startswith('-')]
+
+
+def do_sudo(args):
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option in ('-u', '-g') and args:
+            args.pop(0)
+    if args:
+        os.execvp(args[0], args)
+    return 0
+
+
+def query_format(qf, name):
+    """Expand an rpm --qf format for a stub package"""
+    tags = {'NAME': name, 'ARCH': 'x86_64', 'VERSION': '1.0', 'RELEASE': '1'}
+    return re.sub(r'%\{(\w+)\}', lambda m: tags.get(m.group(1), ''), qf).replace('\\n', '\n')
+
+
+def do_rpm(state, args):
+    if '-qa' in args:
+        qf = args[args.index('--qf') + 1] if '--qf' in args else '%{NAME}\\n'
+        print(''.join(query_format(qf, name) for name in state['rpms']), end='')
+    elif '-E' in args:
+        print(state.get('fedora', '41'))
+    elif '-q' in args:
+        names = [n for n in positional(args) if not n.startswith('%')]
+        missing = [n for n in names if n not in state['rpms']]
+        if '--qf' in args:
+            print('\n'.join(f"{n}-1.0-1" for n in names if n not in missing))
+        for name in missing:
+            print(f"package {name} is not installed")
+        return 1 if missing else 0
+    return 0
+
+
+def do_dnf(state, args):
+    words = positional(args)
+    command = words[0] if words else ''
+    targets = words[1:]
+    if command in ('install', 'groupinstall'):
+        names = [package_name(t) for t in targets]
+        # Half of a package's cost is its download, paid on the shared link unless it is cached
+        delay(state, 'dnf')
+        if '--downloadonly' in args:
+            # Only packages of the repositories configured so far can be resolved
+            available = [n for n in names if state.get('repos_added') or n not in state.get('third_party', [])]
+            download(state, 'dnf', len(available))
+            with locked_state() as current:
+                current['dnf_cache'] = sorted(set(current.get('dnf_cache', [])) | set(available))
+            return 0
+        download(state, 'dnf', len([n for n in names if n not in state.get('dnf_cache', [])]))
+        delay(state, 'dnf', len(names) / 2, fixed=False)
+        with locked_state() as current:
+            current['rpms'] = sorted(set(current['rpms']) | set(names))
+            provide_binaries(current, names)
+    elif command == 'remove':
+        delay(state, 'dnf', len(targets))
+        with locked_state() as current:
+            current['rpms'] = [p for p in current['rpms'] if p not in targets]
+    elif command == 'config-manager':
+        delay(state, 'dnf')
+        with locked_state() as current:
+            current['repos_added'] = True
+    elif command == 'repoquery':
+        delay(state, 'dnf')
+        print('\n'.join(f"{t}-1.0-1" for t in targets if not t.startswith('%')))
+    elif command == 'list':
+        print('\n'.join(f"{name}.x86_64  1.0-1  @fedora" for name in state['rpms']))
+    else:
+        delay(state, 'dnf')
+    return 0
+
+
+def do_flatpak(state, args):
+    words = positional(args)
+    command = words[0] if words else ''
+    if command == 'list':
+        print('\n'.join(state['flatpaks']))
+    elif command == 'remotes':
+        print('\n'.join(state.get('remotes', [])))
+    elif command == 'remote-add':
+        with locked_state() as current:
+            current.setdefault('remotes', []).append(words[1])
+    elif command == 'install':
+        apps = [w for w in words[1:] if w not in state.get('remotes', [])]
+        # Like dnf, half of an app's cost is the pull
+        delay(state, 'flatpak')
+        download(state, 'flatpak', len(apps))
+        delay(state, 'flatpak', len(apps) / 2, fixed=False)
+        with locked_state() as current:
+            current['flatpaks'] = sorted(set(current['flatpaks']) | set(apps))
+    return 0
+
+
+def do_systemctl(state, args):
+    words = positional(args)
+    if words and words[0] == 'is-active':
+        active = words[1] in state.get('services_active', [])
+        print('active' if active else 'inactive')
+        return 0 if active else 3
+    return 0
+
+
+def do_git(state, args):
+    repo = '.'
+    while args and args[0] in ('-C', '-c'):
+        option, value = args[:2]
+        args = args[2:]
+        if option == '-C':
+            repo = value
+    words = positional(args)
+    command = words[0] if words else ''
+    if command == 'clone':
+        os.makedirs(words[-1], exist_ok=True)
+    elif command == 'init':
+        target = words[-1] if len(words) > 1 else repo
+        git_dir = target if '--bare' in args else os.path.join(target, '.git')
+        os.makedirs(os.path.join(git_dir, 'objects', 'info'), exist_ok=True)
+        open(os.path.join(git_dir, 'HEAD'), 'w').close()
+    elif command == 'fetch':
+        open(os.path.join(repo, '.bench-fetched'), 'w').close()
+    elif command == 'rev-parse':
+        if '--verify' in args and not os.path.exists(os.path.join(repo, '.bench-fetched')):
+            return 1
+        print('0' * 40)
+    elif command == 'remote' and words[1:2] == ['get-url']:
+        return 0 if os.path.exists(os.path.join(repo, '.git', 'config')) else 2
+    return 0
+
+
+def do_make(state, args):
+    if 'install' in args:
+        provide_binaries(state, ['sunshine'])
+    return 0
+
+
+def do_cmake(state, args):
+    if '--build' in args:
+        delay(state, 'make')
+    elif '--install' in args:
+        if os.environ.get('DESTDIR'):
+            target = os.path.join(os.environ['DESTDIR'], 'usr', 'local', 'bin')
+            os.makedirs(target, exist_ok=True)
+            with open(os.path.join(target, 'sunshine'), 'w') as f:
+                f.write('sunshine')
+        else:
+            provide_binaries(state, ['sunshine'])
+    return 0
+
+
+def do_rpmbuild(state, args):
+    """Write an empty package named the way the spec and --define options ask"""
+    defines = dict(args[i + 1].split(' ', 1) for i, arg in enumerate(args) if arg == '--define')
+    with open(args[-1]) as f:
+        spec = dict(re.findall(r'^(Name|Version|Release): (.+)$', f.read(), re.MULTILINE))
+    release = spec['Release'].replace('%{?dist}', f".fc{state.get('fedora', '41')}")
+    os.makedirs(defines['_rpmdir'], exist_ok=True)
+    open(os.path.join(defines['_rpmdir'], f"{spec['Name']}-{spec['Version']}-{release}.x86_64.rpm"), 'w').close()
+    return 0
+
+
+def main():
+    name = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    log(name, args)
+    if name == 'sudo':
+        return do_sudo(args)
+
+    state = read_state()
+    handlers = {'rpm': do_rpm, 'dnf': do_dnf, 'flatpak': do_flatpak, 'systemctl': do_systemctl,
+                'git': do_git, 'make': do_make, 'cmake': do_cmake,
+                'rpmbuild': do_rpmbuild}
+    if name not in ('dnf', 'flatpak'):
+        delay(state, name)
+    handler = handlers.get(name)
+    return handler(state, args) if handler else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
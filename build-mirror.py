@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib.util
+import sys
+from pathlib import Path
+
+from provisioning.download_cache import DEFAULT_CACHE_DIR, DownloadError, downloads
+from provisioning.flatpak_batch import ensure_flathub_repo, install_flathub_apps
+from provisioning.host_facts import host
+from provisioning.lan_mirror import MirrorBuilder, MirrorError
+from provisioning.runner import finish_run, step
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# Installed by fedora-install.py from a URL rather than from a repository
+URL_PACKAGES = ['1password']
+
+# Packages the scripts install on demand besides their declared lists
+EXTRA_PACKAGES = ['dnf-plugins-core', 'zsh']
+
+DEVELOPMENT_GROUP = 'Development Tools'
+
+def load_script(name):
+    """Import one of the provisioning scripts for its package lists"""
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_')[:-3], REPO_DIR / name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Download every package and artifact the provisioning scripts install into a LAN mirror")
+    parser.add_argument('destination', help="mirror directory, created or updated in place")
+    parser.add_argument('--releasever', help="Fedora release to mirror (default: this machine's)")
+    parser.add_argument('--no-flatpak', action='store_true',
+                        help="leave the Flathub apps out of the mirror")
+    parser.add_argument('--download-cache', default=DEFAULT_CACHE_DIR,
+                        help="directory of the download cache")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace-event JSON of every step and command")
+    return parser.parse_args(argv)
+
+def main(args):
+    """Build or update the mirror"""
+    if args.releasever:
+        host.override(fedora_release=args.releasever)
+    downloads.root = Path(args.download_cache)
+    fedora_install = load_script('fedora-install.py')
+    install_sunshine = load_script('install_sunshine.py')
+
+    packages = [p for p in fedora_install.RPM_PACKAGES if p not in URL_PACKAGES]
+    packages += [p for p in install_sunshine.SUNSHINE_DEPENDENCIES + EXTRA_PACKAGES if p not in packages]
+
+    builder = MirrorBuilder(args.destination, downloads, host.fedora_release, host.machine)
+    try:
+        with step('repositories'):
+            # Artifacts installed from a URL are served from files/ as they are
+            onepassword = builder.add_file(fedora_install.ONEPASSWORD_RPM_URL)
+            builder.add_file(fedora_install.DOCKER_COMPOSE_RELEASE_URL)
+            version, _ = fedora_install.fetch_docker_compose()
+            builder.add_file(fedora_install.docker_compose_url(version))
+            reposdir = builder.reposdir(fedora_install.repo_file_urls(), fedora_install.rpmfusion_release_urls())
+            builder.add_gpgkeys(reposdir)
+        with step('packages'):
+            groups = {DEVELOPMENT_GROUP: builder.group(DEVELOPMENT_GROUP, reposdir)}
+            # The RPMs of URL_PACKAGES are not in any repository, but what they require is
+            requirements = [p for p in builder.rpm_requirements(onepassword, reposdir) if p not in packages]
+            builder.download_packages(packages + requirements + groups[DEVELOPMENT_GROUP], reposdir)
+            builder.write_metadata(groups)
+        if not args.no_flatpak:
+            with step('flatpak'):
+                # Only installed refs can be exported, with the runtimes they use
+                ensure_flathub_repo()
+                if not install_flathub_apps(fedora_install.FLATHUB_APPS):
+                    raise MirrorError("Could not install the Flathub apps to export them")
+                builder.export_flatpaks(list(fedora_install.FLATHUB_APPS))
+        builder.write_index()
+    except (MirrorError, DownloadError) as e:
+        print(e)
+        return False
+
+    print(f"Mirror written to {builder.root}. Serve it over HTTP or mount it, then run")
+    print(f"  fedora-install.py --mirror <URL or path>   and   install_sunshine.py --mirror <URL or path>")
+    return True
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace)
+    sys.exit(0 if succeeded else 1)
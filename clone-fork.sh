@@ -10,8 +10,8 @@ if git remote -v | grep -q "freddieweir" &> /dev/null; then
     echo "Remote freddieweir already exists. Skipping..."
 else
     echo "Adding remote freddieweir..."
-    git remote add freddieweir Git@github.com:freddieweir/$REPO_NAME.git
-    if [ $? -ne 0 ]; then
+    git remote add freddieweir git@github.com:freddieweir/$REPO_NAME.git
+    if [ $? -eq 0 ]; then
         echo "Successfully added remote freddieweir."
     else
         echo "Failed to add remote freddieweir. Please check the error."
@@ -22,7 +22,7 @@ fi
 # Configure the default push remote
 echo "Setting default push remote to freddieweir..."
 git config remote.pushDefault freddieweir
-if [ $? -ne 0 ]; then
+if [ $? -eq 0 ]; then
     echo "Successfully set default push remote."
 else
     echo "Failed to set default push remote. Please check the error."
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+
+from provisioning.docker_daemon import (DAEMON_JSON, DaemonConfigError, DockerDaemon, managed_settings,
+                                        needs_restart, nvidia_runtime_installed, render_config)
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Merge the managed settings into Docker's daemon.json")
+    parser.add_argument('--config', default=DAEMON_JSON,
+                        help="daemon.json to merge into; point it at a sample to try the merge offline")
+    parser.add_argument('--data-root', metavar='DIR',
+                        help="where Docker stores images and containers (default: keep the current one)")
+    nvidia = parser.add_mutually_exclusive_group()
+    nvidia.add_argument('--nvidia', action='store_true', default=None,
+                        help="register the nvidia runtime (default: when nvidia-container-runtime is installed)")
+    nvidia.add_argument('--no-nvidia', action='store_false', dest='nvidia')
+    parser.add_argument('--print', action='store_true',
+                        help="print the merged file and what Docker would need, without changing anything")
+    return parser.parse_args(argv)
+
+def main(args):
+    """Show or apply the merged configuration"""
+    nvidia = nvidia_runtime_installed() if args.nvidia is None else args.nvidia
+    settings = managed_settings(args.data_root, nvidia=nvidia)
+    daemon = DockerDaemon(args.config)
+    try:
+        if not args.print:
+            daemon.apply(settings)
+            return True
+        _, merged, keys = daemon.plan(settings)
+    except DaemonConfigError as e:
+        print(e)
+        return False
+    print(render_config(merged), end='')
+    action = 'restart' if needs_restart(keys) else 'reload' if keys else 'none'
+    print(json.dumps({'changed': keys, 'action': action}), file=sys.stderr)
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main(parse_args()) else 1)
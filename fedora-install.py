@@ -1,28 +1,74 @@
 #!/usr/bin/env python3
 
+import argparse
+import grp
+import json
 import os
-import subprocess
 import shutil
 import sys
-import pwd
 from pathlib import Path
 
-# Capture the original user running the script
-ORIGINAL_USER = subprocess.check_output(['logname']).decode().strip()
-
-def is_installed(package):
-    """Check if a package is installed via RPM or Flatpak"""
-    rpm_check = subprocess.run(['rpm', '-q', package], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    flatpak_check = subprocess.run(['flatpak', 'list'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return rpm_check.returncode == 0 or package in flatpak_check.stdout.decode()
+from provisioning.dnf_plan import DnfPlan
+from provisioning.dnf_profile import DEFAULT_PARALLEL_DOWNLOADS, PROFILE_MODES, run_profile
+from provisioning.docker_daemon import (DaemonConfigError, docker_active, docker_daemon, managed_settings,
+                                        nvidia_runtime_installed)
+from provisioning.download_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DownloadError, downloads
+from provisioning.flatpak_batch import ensure_flathub_repo, install_flathub_apps
+from provisioning.host_facts import host
+from provisioning.journal import StepJournal, default_journal_path, path_state, rpmdb_state
+from provisioning.lan_mirror import LanMirror, MirrorError
+from provisioning.package_state import is_installed
+from provisioning.prefetch import DEFAULT_MIN_FREE_BYTES, DEFAULT_PREFETCH_JOBS, prefetcher
+from provisioning.repo_metadata import DEFAULT_METADATA_TTL, metadata
+from provisioning.run_history import default_history_path, record_run
+from provisioning.runner import finish_run, run
+from provisioning.scheduler import DEFAULT_JOBS, Step, run_steps
+
+# RPM packages the dnf transaction provides
+RPM_PACKAGES = [
+    '1password', 'docker-ce', 'docker-ce-cli', 'containerd.io', 'docker-buildx-plugin',
+    'docker-compose-plugin', 'mullvad-vpn', 'timeshift', 'gh', 'akmod-nvidia',
+    'nvidia-container-toolkit',
+]
+
+# Applications installed from Flathub in one transaction
+FLATHUB_APPS = {
+    'com.bitwarden.desktop': "Bitwarden",
+    'com.discordapp.Discord': "Discord",
+    'md.obsidian.Obsidian': "Obsidian",
+    'com.github.zocker_160.SyncThingy': "SyncThingy",
+    'com.vscodium.codium': "VSCodium",
+    'dev.vencord.Vesktop': "Vesktop",
+}
+
+ONEPASSWORD_RPM_URL = 'https://downloads.1password.com/linux/rpm/stable/x86_64/1password-latest.rpm'
+DOCKER_COMPOSE_RELEASE_URL = 'https://api.github.com/repos/docker/compose/releases/latest'
+DOCKER_REPO_URL = 'https://download.docker.com/linux/fedora/docker-ce.repo'
+MULLVAD_REPO_URL = 'https://repository.mullvad.net/rpm/stable/mullvad.repo'
+
+# LAN mirror given with --mirror, which replaces every upstream download
+mirror = None
+
+def mirrored(url):
+    """The LAN mirror's copy of an upstream URL, or the URL itself without a mirror"""
+    return mirror.url(url) if mirror else url
+
+def cached_artifact(url, revalidate=True):
+    """Local path of a cached download, or the URL itself if it cannot be cached"""
+    url = mirrored(url)
+    try:
+        return str(downloads.fetch(url, revalidate=revalidate))
+    except DownloadError as e:
+        print(f"{e}, falling back to {url}")
+        return url
 
 def create_directories():
     """Create required directories if they don't exist"""
     dirs = [
-        f"/home/{ORIGINAL_USER}/scripts/",
-        f"/home/{ORIGINAL_USER}/git/",
-        f"/home/{ORIGINAL_USER}/git/fedora_config/",
-        f"/home/{ORIGINAL_USER}/Documents/Obsidian/"
+        f"{host.home}/scripts/",
+        f"{host.home}/git/",
+        f"{host.home}/git/fedora_config/",
+        f"{host.home}/Documents/Obsidian/"
     ]
     
     for dir_path in dirs:
@@ -32,48 +78,75 @@ def create_directories():
         else:
             print(f"Directory {dir_path} already exists, skipping...")
 
-def install_docker():
-    """Install Docker using the official Docker repository"""
+def install_docker(plan):
+    """Queue Docker from the official Docker repository"""
     if shutil.which('docker'):
         print("Docker is already installed, skipping Docker installation.")
         return
         
-    print("Installing Docker using the official Docker repository...")
-    
-    # Remove any old versions (using dnf remove -y with a single transaction)
-    subprocess.run(['sudo', 'dnf', 'remove', '-y', 
-                   'docker', 'docker-client', 'docker-client-latest', 
-                   'docker-common', 'docker-latest', 'docker-latest-logrotate',
-                   'docker-logrotate', 'docker-engine'])
-
-    # Set up repository
-    subprocess.run(['sudo', 'dnf', '-y', 'install', 'dnf-plugins-core'])
+    print("Queueing Docker from the official Docker repository...")
     
-    # Use dnf config-manager correctly (fixed syntax)
-    subprocess.run(['sudo', 'dnf', 'config-manager', 
-                   '--add-repo=https://download.docker.com/linux/fedora/docker-ce.repo'])
+    # Remove any old versions in the plan's removal transaction
+    plan.remove('docker', 'docker-client', 'docker-client-latest',
+                'docker-common', 'docker-latest', 'docker-latest-logrotate',
+                'docker-logrotate', 'docker-engine')
 
-    # Install Docker Engine (first update dnf to refresh repos)
-    subprocess.run(['sudo', 'dnf', '-y', 'update'])
+    # Set up repository, metadata is refreshed once the plan has added every repo
+    plan.add_repo_file(mirrored(DOCKER_REPO_URL))
     
     # Create docker group before installation
-    subprocess.run(['sudo', 'groupadd', '-f', 'docker'])
+    plan.run_before('create docker group', create_docker_group)
     
-    # Install Docker packages
-    subprocess.run(['sudo', 'dnf', '-y', 'install', 
-                   'docker-ce', 'docker-ce-cli', 'containerd.io',
-                   'docker-buildx-plugin', 'docker-compose-plugin'])
+    plan.install('docker-ce', 'docker-ce-cli', 'containerd.io',
+                 'docker-buildx-plugin', 'docker-compose-plugin')
+
+def create_docker_group():
+    """Create the docker group ahead of the package scriptlets"""
+    run(['sudo', 'groupadd', '-f', 'docker'])
+
+def docker_service_ready():
+    """Whether Docker is enabled and the user is in the docker group"""
+    try:
+        members = grp.getgrnam('docker').gr_mem
+    except KeyError:
+        return False
+    if host.user not in members:
+        return False
+    return run(['systemctl', 'is-enabled', '--quiet', 'docker'], capture=True).returncode == 0
+
+def setup_docker_service():
+    """Enable Docker and add the user to the docker group"""
+    if not shutil.which('docker'):
+        print("Docker is not installed, skipping service setup.")
+        return
+    if docker_service_ready():
+        print("Docker is already enabled and the user is in the docker group, skipping...")
+        return
 
-    # Start and enable Docker
-    subprocess.run(['sudo', 'systemctl', 'start', 'docker'])
-    subprocess.run(['sudo', 'systemctl', 'enable', 'docker'])
+    # Started by the docker-daemon step, once daemon.json is in place
+    if run(['sudo', 'systemctl', 'enable', 'docker']).returncode != 0:
+        return False
 
     # Add user to docker group
-    subprocess.run(['sudo', 'usermod', '-aG', 'docker', ORIGINAL_USER])
-    print(f"User {ORIGINAL_USER} has been added to the docker group.")
+    if run(['sudo', 'usermod', '-aG', 'docker', host.user]).returncode != 0:
+        return False
+    print(f"User {host.user} has been added to the docker group.")
 
     print("Docker has been installed and configured successfully.")
 
+def docker_compose_url(version):
+    return f"https://github.com/docker/compose/releases/download/{version}/docker-compose-{host.system}-{host.machine}"
+
+def fetch_docker_compose():
+    """Latest Docker Compose version and the cached path of its binary"""
+    # Get latest version, revalidated against the cached release metadata
+    release = downloads.fetch(mirrored(DOCKER_COMPOSE_RELEASE_URL))
+    with open(release) as f:
+        version = json.load(f)['tag_name']
+
+    # Download through the cache, release assets never change for a version
+    return version, downloads.fetch(mirrored(docker_compose_url(version)), revalidate=False)
+
 def install_docker_compose():
     """Install Docker Compose"""
     if shutil.which('docker-compose'):
@@ -81,256 +154,255 @@ def install_docker_compose():
         return
 
     print("Installing Docker Compose...")
-    
-    # Get latest version
-    version_cmd = "curl -s https://api.github.com/repos/docker/compose/releases/latest | grep -Po '\"tag_name\": \"\\K[^\"]+'"
-    version = subprocess.check_output(version_cmd, shell=True).decode().strip()
-    
-    # System info
-    system = subprocess.check_output(['uname', '-s']).decode().strip()
-    machine = subprocess.check_output(['uname', '-m']).decode().strip()
-    
-    # Download and install
-    url = f"https://github.com/docker/compose/releases/download/{version}/docker-compose-{system}-{machine}"
-    subprocess.run(['sudo', 'curl', '-L', url, '-o', '/usr/local/bin/docker-compose'])
-    subprocess.run(['sudo', 'chmod', '+x', '/usr/local/bin/docker-compose'])
+    version, binary = fetch_docker_compose()
+    run(['sudo', 'install', '-m', '0755', str(binary), '/usr/local/bin/docker-compose'])
     
     # Create symlink
     if not os.path.exists('/usr/bin/docker-compose'):
-        subprocess.run(['sudo', 'ln', '-s', '/usr/local/bin/docker-compose', '/usr/bin/docker-compose'])
+        run(['sudo', 'ln', '-s', '/usr/local/bin/docker-compose', '/usr/bin/docker-compose'])
 
     print(f"Docker Compose version {version} has been installed.")
 
-def set_default_shell_to_zsh():
-    """Set Zsh as the default shell"""
-    if not shutil.which('zsh'):
-        print("Zsh is not installed. Installing Zsh...")
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'zsh'])
-
-    # Check current shell
-    current_shell = pwd.getpwnam(ORIGINAL_USER).pw_shell
-    zsh_path = shutil.which('zsh')
-    
-    if current_shell != zsh_path:
-        print(f"Setting Zsh as the default shell for {ORIGINAL_USER}...")
-        subprocess.run(['sudo', 'chsh', '-s', zsh_path, ORIGINAL_USER])
-        print(f"Zsh has been set as the default shell for {ORIGINAL_USER}.")
-    else:
-        print(f"Zsh is already the default shell for {ORIGINAL_USER}.")
-
-    # Configure .zshrc
-    zshrc_path = Path(f"/home/{ORIGINAL_USER}/.zshrc")
-    if zshrc_path.exists():
-        with open(zshrc_path, 'r') as f:
-            content = f.read()
-        if 'newgrp docker' not in content:
-            with open(zshrc_path, 'a') as f:
-                f.write('\nif ! groups | grep -q "\\bdocker\\b"; then exec newgrp docker; fi\n')
-            print("Configured Zsh to automatically switch to the docker group.")
-
-def install_powerlevel10k():
-    """Install Powerlevel10k theme for Zsh"""
-    p10k_dir = Path(f"/home/{ORIGINAL_USER}/git/fedora_config/powerlevel10k")
-    zshrc_path = Path(f"/home/{ORIGINAL_USER}/.zshrc")
-
-    if p10k_dir.exists() and zshrc_path.exists():
-        with open(zshrc_path, 'r') as f:
-            if 'powerlevel10k' in f.read():
-                print("Powerlevel10k is already installed and configured, skipping...")
-                return
-
-    print("Installing Powerlevel10k...")
-    if p10k_dir.exists():
-        shutil.rmtree(p10k_dir)
-    
-    subprocess.run(['sudo', '-u', ORIGINAL_USER, 'git', 'clone', '--depth=1',
-                   'https://github.com/romkatv/powerlevel10k.git', str(p10k_dir)])
-    
-    with open(zshrc_path, 'a') as f:
-        f.write('\nsource ~/git/fedora_config/powerlevel10k/powerlevel10k.zsh-theme\n')
-    
-    print("Powerlevel10k has been installed and added to your Zsh configuration.")
-
-def ensure_flathub_repo():
-    """Ensure Flathub repository is added"""
-    result = subprocess.run(['flatpak', 'remotes'], stdout=subprocess.PIPE)
-    if 'flathub' not in result.stdout.decode():
-        print("Flathub repository not found. Adding Flathub repository...")
-        subprocess.run(['flatpak', 'remote-add', '--if-not-exists', 'flathub',
-                       'https://dl.flathub.org/repo/flathub.flatpakrepo'])
-    else:
-        print("Flathub repository is already added, skipping...")
-
-def install_1password():
-    """Install 1Password"""
+def install_1password(plan):
+    """Queue 1Password"""
     if not is_installed("1password"):
-        print("Installing 1Password...")
-        subprocess.run(['sudo', 'dnf', 'install', '-y',
-                       'https://downloads.1password.com/linux/rpm/stable/x86_64/1password-latest.rpm'])
+        print("Queueing 1Password...")
+        plan.install(cached_artifact(ONEPASSWORD_RPM_URL))
     else:
         print("1Password is already installed, skipping...")
 
-def install_bitwarden():
-    """Install Bitwarden"""
-    if not is_installed("com.bitwarden.desktop"):
-        ensure_flathub_repo()
-        print("Installing Bitwarden...")
-        subprocess.run(['flatpak', 'install', '-y', 'flathub', 'com.bitwarden.desktop'])
-    else:
-        print("Bitwarden is already installed, skipping...")
-
-def install_discord():
-    """Install Discord"""
-    if not is_installed("com.discordapp.Discord"):
-        ensure_flathub_repo()
-        print("Installing Discord...")
-        subprocess.run(['flatpak', 'install', '-y', 'flathub', 'com.discordapp.Discord'])
-    else:
-        print("Discord is already installed, skipping...")
-
-def install_mullvad():
-    """Install Mullvad VPN"""
+def install_mullvad(plan):
+    """Queue Mullvad VPN"""
     if not is_installed("mullvad-vpn"):
-        print("Installing Mullvad VPN...")
-        subprocess.run(['sudo', 'dnf', 'config-manager', '--add-repo',
-                       'https://repository.mullvad.net/rpm/stable/mullvad.repo'])
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'mullvad-vpn'])
+        print("Queueing Mullvad VPN...")
+        plan.add_repo_file(mirrored(MULLVAD_REPO_URL))
+        plan.install('mullvad-vpn')
     else:
         print("Mullvad VPN is already installed, skipping...")
 
-def install_obsidian():
-    """Install Obsidian"""
-    if not is_installed("md.obsidian.Obsidian"):
-        ensure_flathub_repo()
-        print("Installing Obsidian...")
-        subprocess.run(['flatpak', 'install', '-y', 'flathub', 'md.obsidian.Obsidian'])
-    else:
-        print("Obsidian is already installed, skipping...")
-
-def install_timeshift():
-    """Install Timeshift"""
+def install_timeshift(plan):
+    """Queue Timeshift"""
     if not is_installed("timeshift"):
-        print("Installing Timeshift...")
-        subprocess.run(['sudo', 'dnf', 'update', '-y'])
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'timeshift'])
+        print("Queueing Timeshift...")
+        plan.install('timeshift')
     else:
         print("Timeshift is already installed, skipping...")
 
-def install_syncthingy():
-    """Install SyncThingy"""
-    if not is_installed("com.github.zocker_160.SyncThingy"):
-        ensure_flathub_repo()
-        print("Installing SyncThingy...")
-        subprocess.run(['flatpak', 'install', '-y', 'flathub', 'com.github.zocker_160.SyncThingy'])
-    else:
-        print("SyncThingy is already installed, skipping...")
-
-def install_vesktop():
-    """Install Vesktop"""
-    if not is_installed("dev.vencord.Vesktop"):
-        print("Installing Vesktop from Flathub...")
-        subprocess.run(['flatpak', 'install', '-y', 'flathub', 'dev.vencord.Vesktop'])
-    else:
-        print("Vesktop is already installed, skipping...")
-
-def install_vscodium():
-    """Install VSCodium"""
-    if not is_installed("com.vscodium.codium"):
-        ensure_flathub_repo()
-        print("Installing VSCodium...")
-        subprocess.run(['flatpak', 'install', '-y', 'flathub', 'com.vscodium.codium'])
-    else:
-        print("VSCodium is already installed, skipping...")
-
-def install_gh_cli():
-    """Install GitHub CLI"""
+def install_gh_cli(plan):
+    """Queue GitHub CLI"""
     if not is_installed("gh"):
-        print("Installing GitHub CLI...")
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'gh'])
+        print("Queueing GitHub CLI...")
+        plan.install('gh')
     else:
         print("GitHub CLI is already installed, skipping...")
 
-def install_nvidia_drivers():
-    """Install NVIDIA Drivers"""
-    if not is_installed("akmod-nvidia"):
-        print("Enabling RPM Fusion repositories for NVIDIA drivers...")
-        fedora_version = subprocess.check_output(['rpm', '-E', '%fedora']).decode().strip()
-        
-        subprocess.run(['sudo', 'dnf', 'install', '-y',
-                       f'https://download1.rpmfusion.org/free/fedora/rpmfusion-free-release-{fedora_version}.noarch.rpm',
-                       f'https://download1.rpmfusion.org/nonfree/fedora/rpmfusion-nonfree-release-{fedora_version}.noarch.rpm'])
+def rpmfusion_release_urls():
+    """Release RPMs of the free and nonfree RPM Fusion repositories for this Fedora release"""
+    fedora_version = host.fedora_release
+    return [f'https://download1.rpmfusion.org/{kind}/fedora/rpmfusion-{kind}-release-{fedora_version}.noarch.rpm'
+            for kind in ('free', 'nonfree')]
+
+def cuda_repo_url():
+    fedora_version = host.fedora_release
+    return f'https://developer.download.nvidia.com/compute/cuda/repos/fedora{fedora_version}/x86_64/cuda-fedora{fedora_version}.repo'
 
-        print("Installing NVIDIA drivers...")
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'akmod-nvidia'])
+def repo_file_urls():
+    """.repo files the install steps add"""
+    return [DOCKER_REPO_URL, MULLVAD_REPO_URL, cuda_repo_url()]
+
+def install_nvidia_drivers(plan):
+    """Queue NVIDIA Drivers"""
+    if not is_installed("akmod-nvidia"):
+        print("Queueing RPM Fusion repositories and NVIDIA drivers...")
+        plan.add_repo_rpm(*(cached_artifact(url) for url in rpmfusion_release_urls()))
+        plan.install('akmod-nvidia')
     else:
         print("NVIDIA drivers are already installed, skipping...")
 
-def resolve_nvidia_toolkit_conflicts():
+def resolve_nvidia_toolkit_conflicts(plan):
     """Resolve NVIDIA Container Toolkit conflicts"""
     if is_installed("golang-github-nvidia-container-toolkit"):
-        print("Removing conflicting Fedora package: golang-github-nvidia-container-toolkit...")
-        subprocess.run(['sudo', 'dnf', 'remove', '-y', 'golang-github-nvidia-container-toolkit'])
+        print("Queueing removal of conflicting Fedora package: golang-github-nvidia-container-toolkit...")
+        plan.remove('golang-github-nvidia-container-toolkit')
 
-def install_nvidia_container_toolkit():
-    """Install NVIDIA Container Toolkit"""
-    resolve_nvidia_toolkit_conflicts()
+def install_nvidia_container_toolkit(plan):
+    """Queue NVIDIA Container Toolkit"""
+    resolve_nvidia_toolkit_conflicts(plan)
 
     if not is_installed("nvidia-container-toolkit"):
-        print("Adding NVIDIA Container Toolkit repository...")
-        fedora_version = subprocess.check_output(['rpm', '-E', '%fedora']).decode().strip()
-        
-        subprocess.run(['sudo', 'dnf', 'config-manager', '--add-repo',
-                       f'https://developer.download.nvidia.com/compute/cuda/repos/fedora{fedora_version}/x86_64/cuda-fedora{fedora_version}.repo'])
-
-        print("Installing NVIDIA Container Toolkit...")
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'nvidia-container-toolkit'])
-
-        print("Restarting Docker to apply NVIDIA Container Toolkit...")
-        subprocess.run(['sudo', 'systemctl', 'restart', 'docker'])
+        print("Queueing NVIDIA Container Toolkit repository and package...")
+        plan.add_repo_file(mirrored(cuda_repo_url()))
+        plan.install('nvidia-container-toolkit')
     else:
         print("NVIDIA Container Toolkit is already installed, skipping...")
 
-def check_and_install_oh_my_zsh():
-    """Check and install Oh My Zsh"""
-    if not shutil.which('zsh'):
-        print("Zsh is not installed. You can install it using:")
-        print("sudo dnf install -y zsh")
-        return
-
-    omz_dir = Path(f"/home/{ORIGINAL_USER}/.oh-my-zsh")
-    if not omz_dir.exists():
-        print("Oh My Zsh is not installed. Installing Oh My Zsh...")
-        install_cmd = 'sh -c "$(curl -fsSL https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh)" "" --unattended'
-        subprocess.run(['sudo', '-u', ORIGINAL_USER, 'sh', '-c', install_cmd])
-    else:
-        print("Oh My Zsh is already installed, skipping...")
+def docker_settings(args):
+    """daemon.json settings, with the nvidia runtime once the NVIDIA Container Toolkit is installed"""
+    return managed_settings(args.docker_data_root, nvidia=nvidia_runtime_installed())
 
-def main():
-    """Main function to run all installations"""
-    create_directories()
-    ensure_flathub_repo()
-    install_1password()
-    install_bitwarden()
-    install_discord()
-    install_docker()
-    install_docker_compose()
-    install_mullvad()
-    install_obsidian()
-    install_timeshift()
-    install_syncthingy()
-    install_vscodium()
-    install_gh_cli()
-    install_vesktop()
+def configure_docker_daemon(args):
+    """Merge the managed settings into daemon.json, restarting Docker only for changes that need it"""
+    if not shutil.which('docker'):
+        print("Docker is not installed, skipping daemon configuration.")
+        return
+    try:
+        docker_daemon.apply(docker_settings(args))
+    except DaemonConfigError as e:
+        print(e)
+        return False
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Provision a Fedora workstation")
+    parser.add_argument('--metadata-ttl', type=int, default=DEFAULT_METADATA_TTL,
+                        help="skip the metadata refresh when the dnf cache is younger than this many seconds")
+    parser.add_argument('--dnf-profile', choices=PROFILE_MODES, default='apply',
+                        help="tune dnf.conf for the run and restore it afterwards (apply), leave it tuned (keep) or leave it alone (off)")
+    parser.add_argument('--parallel-downloads', type=int, default=DEFAULT_PARALLEL_DOWNLOADS,
+                        help="max_parallel_downloads of the dnf profile")
+    parser.add_argument('--dnf-cache-dir',
+                        help="package cache directory of the dnf profile, kept between runs")
+    parser.add_argument('--upgrade', action='store_true',
+                        help="run a full system upgrade after the repositories are added")
+    parser.add_argument('--offline', action='store_true',
+                        help="only use artifacts already in the download cache")
+    parser.add_argument('--mirror', metavar='PATH_OR_URL',
+                        help="install everything from a LAN mirror written by build-mirror.py")
+    parser.add_argument('--docker-data-root', metavar='DIR',
+                        help="where Docker stores images and containers (default: keep the current one)")
+    parser.add_argument('--download-cache', default=DEFAULT_CACHE_DIR,
+                        help="directory of the download cache")
+    parser.add_argument('--download-cache-size', type=int, default=DEFAULT_MAX_BYTES,
+                        help="evict cached downloads beyond this many bytes")
+    parser.add_argument('--prefetch-jobs', type=int, default=DEFAULT_PREFETCH_JOBS,
+                        help="downloads to run ahead of the steps installing them at once, 0 disables prefetching")
+    parser.add_argument('--prefetch-min-free', type=int, default=DEFAULT_MIN_FREE_BYTES,
+                        help="skip prefetching onto filesystems with less than this many bytes free")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help="maximum number of steps to run concurrently")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace-event JSON of every step and command")
+    parser.add_argument('--summary-json', metavar='FILE',
+                        help="write the outcome and duration of every step as JSON")
+    parser.add_argument('--history', metavar='FILE', default=str(default_history_path()),
+                        help="SQLite database the step timings of every run are added to, an empty string disables it")
+    parser.add_argument('--facts-ttl', type=int, default=0,
+                        help="reuse OS release and kernel facts gathered by earlier runs for this many seconds")
+    parser.add_argument('--journal', default=str(default_journal_path('fedora-install')),
+                        help="file recording completed steps between runs")
+    parser.add_argument('--verify', action='store_true',
+                        help="probe and run every step even if the journal says it is complete")
+    return parser.parse_args(argv)
+
+def queue_rpm_targets(plan, args):
+    """Collect every RPM target so dnf resolves and installs them together"""
+    if args.upgrade:
+        plan.request_upgrade()
+    install_1password(plan)
+    install_docker(plan)
+    install_mullvad(plan)
+    install_timeshift(plan)
+    install_gh_cli(plan)
 
     # Install NVIDIA components
-    install_nvidia_drivers()
-    install_nvidia_container_toolkit()
+    install_nvidia_drivers(plan)
+    install_nvidia_container_toolkit(plan)
+
+def prefetch_artifacts():
+    """Download the artifacts of install steps that still have work to do"""
+    jobs = []
+    # The RPM Fusion release RPMs come first, the dnf repository setup waits for them
+    if not is_installed('akmod-nvidia'):
+        urls = [mirrored(url) for url in rpmfusion_release_urls()]
+        jobs += [(url, downloads.root, lambda url=url: downloads.fetch(url)) for url in urls]
+    if not is_installed('1password'):
+        url = mirrored(ONEPASSWORD_RPM_URL)
+        jobs.append((url, downloads.root, lambda: downloads.fetch(url)))
+    if not shutil.which('docker-compose'):
+        jobs.append(('docker-compose', downloads.root, fetch_docker_compose))
+    prefetcher.gather(jobs)
+
+def flatpak_state():
+    """Flathub remote configuration and deployed apps, read without running flatpak"""
+    return [path_state('/var/lib/flatpak/repo/config'),
+            *(path_state(f'/var/lib/flatpak/app/{app_id}') for app_id in sorted(FLATHUB_APPS))]
+
+def flathub_configured():
+    try:
+        with open('/var/lib/flatpak/repo/config') as f:
+            return '[remote "flathub"]' in f.read()
+    except OSError:
+        return False
+
+def main(args=None):
+    """Main function to run all installations"""
+    global mirror
+    if args is None:
+        args = parse_args([])
+    host.cache_path = default_journal_path('host-facts')
+    host.ttl = args.facts_ttl
+    metadata.ttl = args.metadata_ttl
+    if args.dnf_cache_dir:
+        metadata.cache_globs = [f"{args.dnf_cache_dir}/*/repodata/repomd.xml"]
+    downloads.root = Path(args.download_cache)
+    downloads.max_bytes = args.download_cache_size
+    downloads.offline = args.offline
+    prefetcher.configure(args.prefetch_jobs, args.prefetch_min_free)
+    if args.mirror:
+        try:
+            mirror = LanMirror(args.mirror)
+            mirror.enable()
+        except MirrorError as e:
+            print(e)
+            return False
+
+    # The plan is only built when the transaction step actually runs, so an
+    # unchanged system is never probed
+    plan = DnfPlan(args.dnf_cache_dir)
+
+    def dnf_transaction():
+        queue_rpm_targets(plan, args)
+        return plan.execute()
+
+    # Without --upgrade the transaction is complete while the rpmdb is unchanged
+    rpm_fingerprint = None if args.upgrade else lambda: [RPM_PACKAGES, rpmdb_state()]
+
+    # Independent steps run concurrently, package-manager steps hold a lock.
+    # The artifact prefetch starts downloads at once, so they arrive while
+    # the dnf repository setup runs
+    steps = [
+        Step('artifact-prefetch', prefetch_artifacts),
+        Step('directories', create_directories),
+        Step('flathub-remote', ensure_flathub_repo, locks=['flatpak'],
+             fingerprint=lambda: [args.mirror, flatpak_state()], validate=flathub_configured),
+        Step('flatpak-apps', lambda: install_flathub_apps(FLATHUB_APPS),
+             deps=['flathub-remote'], locks=['flatpak'], fingerprint=flatpak_state),
+        Step('dnf-transaction', dnf_transaction, locks=['dnf'], fingerprint=rpm_fingerprint),
+        Step('docker-compose', install_docker_compose),
+        Step('docker', setup_docker_service, deps=['dnf-transaction'],
+             fingerprint=lambda: [host.user, rpmdb_state()], validate=docker_service_ready),
+        # Also registers the nvidia runtime, so the toolkit needs no restart of its own
+        Step('docker-daemon', lambda: configure_docker_daemon(args), deps=['docker'],
+             fingerprint=lambda: [docker_settings(args), path_state(docker_daemon.path), rpmdb_state()],
+             validate=lambda: not shutil.which('docker') or docker_active()),
+    ]
+    journal = StepJournal(args.journal) if args.journal else None
+    with run_profile(args.dnf_profile, args.parallel_downloads, args.dnf_cache_dir):
+        succeeded = run_steps(steps, jobs=args.jobs, journal=journal, verify=args.verify)
 
     print("All selected applications, directories, and configurations have been processed.")
     print("Please log out and log back in for group changes to take effect.")
+    return succeeded
 
 if __name__ == "__main__":
     if os.geteuid() != 0:
         print("This script must be run as root (with sudo)")
         sys.exit(1)
-    main()
\ No newline at end of file
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace, args.summary_json)
+        if args.history:
+            record_run(args.history, __file__)
+    sys.exit(0 if succeeded else 1)
\ No newline at end of file
@@ -1,46 +1,46 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
-import subprocess
 import shutil
 import sys
 import pwd
 from pathlib import Path
 
-# Capture the original user running the script
-ORIGINAL_USER = subprocess.check_output(['logname']).decode().strip()
+from provisioning.git_cache import default_mirror_dir, git_mirrors
+from provisioning.host_facts import host
+from provisioning.journal import StepJournal, default_journal_path, path_state
+from provisioning.run_history import default_history_path, record_run
+from provisioning.runner import finish_run, run, step
+from provisioning.scheduler import DEFAULT_JOBS, Step, run_steps
+from provisioning.zsh_perf import (measure_startup, optimize_zshrc, print_comparison, update_blocks,
+                                   zcompile_startup_files, zprof)
+
+OH_MY_ZSH_URL = 'https://github.com/ohmyzsh/ohmyzsh.git'
+POWERLEVEL10K_URL = 'https://github.com/romkatv/powerlevel10k.git'
+POWERLEVEL10K_SOURCE = 'source ~/git/fedora_config/powerlevel10k/powerlevel10k.zsh-theme'
 
 def set_default_shell_to_zsh():
     """Set Zsh as the default shell"""
     if not shutil.which('zsh'):
         print("Zsh is not installed. Installing Zsh...")
-        subprocess.run(['sudo', 'dnf', 'install', '-y', 'zsh'])
+        run(['sudo', 'dnf', 'install', '-y', 'zsh'])
 
     # Check current shell
-    current_shell = pwd.getpwnam(ORIGINAL_USER).pw_shell
+    current_shell = pwd.getpwnam(host.user).pw_shell
     zsh_path = shutil.which('zsh')
     
     if current_shell != zsh_path:
-        print(f"Setting Zsh as the default shell for {ORIGINAL_USER}...")
-        subprocess.run(['sudo', 'chsh', '-s', zsh_path, ORIGINAL_USER])
-        print(f"Zsh has been set as the default shell for {ORIGINAL_USER}.")
+        print(f"Setting Zsh as the default shell for {host.user}...")
+        run(['sudo', 'chsh', '-s', zsh_path, host.user])
+        print(f"Zsh has been set as the default shell for {host.user}.")
     else:
-        print(f"Zsh is already the default shell for {ORIGINAL_USER}.")
-
-    # Configure .zshrc
-    zshrc_path = Path(f"/home/{ORIGINAL_USER}/.zshrc")
-    if zshrc_path.exists():
-        with open(zshrc_path, 'r') as f:
-            content = f.read()
-        if 'newgrp docker' not in content:
-            with open(zshrc_path, 'a') as f:
-                f.write('\nif ! groups | grep -q "\\bdocker\\b"; then exec newgrp docker; fi\n')
-            print("Configured Zsh to automatically switch to the docker group.")
+        print(f"Zsh is already the default shell for {host.user}.")
 
 def install_powerlevel10k():
     """Install Powerlevel10k theme for Zsh"""
-    p10k_dir = Path(f"/home/{ORIGINAL_USER}/git/fedora_config/powerlevel10k")
-    zshrc_path = Path(f"/home/{ORIGINAL_USER}/.zshrc")
+    p10k_dir = Path(f"{host.home}/git/fedora_config/powerlevel10k")
+    zshrc_path = Path(f"{host.home}/.zshrc")
 
     if p10k_dir.exists() and zshrc_path.exists():
         with open(zshrc_path, 'r') as f:
@@ -49,14 +49,10 @@ def install_powerlevel10k():
                 return
 
     print("Installing Powerlevel10k...")
-    if p10k_dir.exists():
-        shutil.rmtree(p10k_dir)
-    
-    subprocess.run(['sudo', '-u', ORIGINAL_USER, 'git', 'clone', '--depth=1',
-                   'https://github.com/romkatv/powerlevel10k.git', str(p10k_dir)])
-    
-    with open(zshrc_path, 'a') as f:
-        f.write('\nsource ~/git/fedora_config/powerlevel10k/powerlevel10k.zsh-theme\n')
+    # An existing checkout is updated in place from the shared mirror
+    git_mirrors.checkout(POWERLEVEL10K_URL, p10k_dir, 'refs/heads/master', user=host.user)
+
+    update_blocks(zshrc_path, {'powerlevel10k': POWERLEVEL10K_SOURCE}, strip=[POWERLEVEL10K_SOURCE])
     
     print("Powerlevel10k has been installed and added to your Zsh configuration.")
 
@@ -67,25 +63,111 @@ def check_and_install_oh_my_zsh():
         print("sudo dnf install -y zsh")
         return
 
-    omz_dir = Path(f"/home/{ORIGINAL_USER}/.oh-my-zsh")
+    omz_dir = Path(f"{host.home}/.oh-my-zsh")
     if not omz_dir.exists():
         print("Oh My Zsh is not installed. Installing Oh My Zsh...")
+        # The installer clones from the local mirror, trusting it although root owns it
+        mirror = git_mirrors.update(OH_MY_ZSH_URL, 'refs/heads/master')
         install_cmd = 'sh -c "$(curl -fsSL https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh)" "" --unattended'
-        subprocess.run(['sudo', '-u', ORIGINAL_USER, 'sh', '-c', install_cmd])
+        run(['sudo', '-u', host.user, 'env', f"REMOTE=file://{mirror}",
+             'GIT_CONFIG_COUNT=1', 'GIT_CONFIG_KEY_0=safe.directory', f"GIT_CONFIG_VALUE_0={mirror}",
+             'sh', '-c', install_cmd])
+        if (omz_dir / '.git').exists():
+            run(['sudo', '-u', host.user, 'git', '-C', str(omz_dir), 'remote', 'set-url', 'origin', OH_MY_ZSH_URL])
     else:
         print("Oh My Zsh is already installed, skipping...")
 
-def main():
+def optimize_shell(runs, cold_runs):
+    """Profile zsh startup, write the optimized configuration and profile it again"""
+    zshrc_path = Path(f"{host.home}/.zshrc")
+    if not shutil.which('zsh') or not zshrc_path.exists():
+        print("Zsh is not configured yet, run this script without --optimize first.")
+        return False
+
+    # Launch the shells as the user whose startup files are measured
+    user = host.user
+    print(f"Measuring zsh startup over {cold_runs} cold and {runs} warm launches...")
+    before = measure_startup(user, host.home, runs, cold_runs)
+    print("Slowest startup functions before optimizing:")
+    print(zprof(user, host.home))
+
+    lazy = optimize_zshrc(zshrc_path, POWERLEVEL10K_SOURCE)
+    if lazy:
+        print(f"Plugins now loaded on first use: {', '.join(lazy)}")
+    if not zcompile_startup_files(user, host.home):
+        print("Could not compile the zsh startup files, continuing without them.")
+
+    after = measure_startup(user, host.home, runs, cold_runs)
+    print("Slowest startup functions after optimizing:")
+    print(zprof(user, host.home))
+    print_comparison(before, after)
+    return True
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Configure the Zsh shell environment")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help="maximum number of steps to run concurrently")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace-event JSON of every step and command")
+    parser.add_argument('--summary-json', metavar='FILE',
+                        help="write the outcome and duration of every step as JSON")
+    parser.add_argument('--history', metavar='FILE', default=str(default_history_path()),
+                        help="SQLite database the step timings of every run are added to, an empty string disables it")
+    parser.add_argument('--facts-ttl', type=int, default=0,
+                        help="reuse OS release and kernel facts gathered by earlier runs for this many seconds")
+    parser.add_argument('--journal', default=str(default_journal_path('fedora-shell')),
+                        help="file recording completed steps between runs")
+    parser.add_argument('--verify', action='store_true',
+                        help="probe and run every step even if the journal says it is complete")
+    parser.add_argument('--optimize', action='store_true',
+                        help="profile zsh startup, write an optimized .zshrc and show before and after times")
+    parser.add_argument('--runs', type=int, default=10,
+                        help="warm zsh launches to time in --optimize mode")
+    parser.add_argument('--cold-runs', type=int, default=3,
+                        help="zsh launches after dropping the page cache to time in --optimize mode")
+    parser.add_argument('--git-cache', default=str(default_mirror_dir()),
+                        help="directory of the bare git mirrors clones borrow objects from")
+    return parser.parse_args(argv)
+
+def main(args=None):
     """Main function to configure shell environment"""
-    check_and_install_oh_my_zsh()
-    set_default_shell_to_zsh()
-    install_powerlevel10k()
+    if args is None:
+        args = parse_args([])
+    host.cache_path = default_journal_path('host-facts')
+    host.ttl = args.facts_ttl
+    git_mirrors.root = Path(args.git_cache)
+    if args.optimize:
+        with step('optimize-shell'):
+            return optimize_shell(args.runs, args.cold_runs)
+
+    # The Oh My Zsh installer replaces .zshrc, so the steps that append to it
+    # wait for it and take turns writing
+    zshrc = f"{host.home}/.zshrc"
+    steps = [
+        Step('oh-my-zsh', check_and_install_oh_my_zsh, locks=['zshrc'],
+             fingerprint=lambda: [path_state(f"{host.home}/.oh-my-zsh"), shutil.which('zsh')]),
+        Step('default-shell', set_default_shell_to_zsh, deps=['oh-my-zsh'], locks=['dnf', 'zshrc'],
+             fingerprint=lambda: [pwd.getpwnam(host.user).pw_shell, shutil.which('zsh'), path_state(zshrc)]),
+        Step('powerlevel10k', install_powerlevel10k, deps=['oh-my-zsh'], locks=['zshrc'],
+             fingerprint=lambda: [path_state(f"{host.home}/git/fedora_config/powerlevel10k"), path_state(zshrc)]),
+    ]
+    journal = StepJournal(args.journal) if args.journal else None
+    succeeded = run_steps(steps, jobs=args.jobs, journal=journal, verify=args.verify)
     
     print("Shell configuration completed.")
     print("Please log out and log back in for changes to take effect.")
+    return succeeded
 
 if __name__ == "__main__":
     if os.geteuid() != 0:
         print("This script must be run as root (with sudo)")
         sys.exit(1)
-    main() 
\ No newline at end of file
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace, args.summary_json)
+        if args.history:
+            record_run(args.history, __file__)
+    sys.exit(0 if succeeded else 1) 
\ No newline at end of file
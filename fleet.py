@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+import time
+
+from provisioning.fleet import (DEFAULT_REMOTE_DIR, host_report, make_transports, print_report,
+                                provision, read_inventory, remove_control_dir)
+from provisioning.runner import finish_run, tracer
+from provisioning.scheduler import Step, run_steps
+
+DEFAULT_FLEET_JOBS = 8
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Run a provisioning script on many hosts at once",
+        epilog="Arguments after -- are passed to the script on every host.")
+    parser.add_argument('targets', nargs='*',
+                        help="[user@]host[:port] for ssh, a directory for chroot, any name for local")
+    parser.add_argument('--inventory', metavar='FILE',
+                        help="file with one target per line, added to the ones given as arguments")
+    parser.add_argument('--transport', choices=['ssh', 'local', 'chroot'], default='ssh',
+                        help="how commands reach the targets; local runs every target on this machine")
+    parser.add_argument('--script', default='fedora-install.py',
+                        help="provisioning script to run on every target")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_FLEET_JOBS,
+                        help="maximum number of hosts provisioned at the same time")
+    parser.add_argument('--remote-dir', default=DEFAULT_REMOTE_DIR,
+                        help="directory on the targets under which every run copies the scripts to a new "
+                             "private directory, removed afterwards (default: /tmp)")
+    parser.add_argument('--sudo', action='store_true',
+                        help="run the script on the targets through sudo -n")
+    parser.add_argument('--ssh-option', action='append', default=[], metavar='OPTION',
+                        help="extra ssh -o option, for example StrictHostKeyChecking=accept-new")
+    parser.add_argument('--report', metavar='FILE',
+                        help="write the per-host report as JSON")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace-event JSON of every host and command")
+    argv = sys.argv[1:] if argv is None else list(argv)
+    script_args = []
+    if '--' in argv:
+        script_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    args.script_args = script_args
+    if args.inventory:
+        args.targets += read_inventory(args.inventory)
+    if not args.targets:
+        parser.error("no targets given")
+    return args
+
+def main(args):
+    """Provision every target and print the aggregate report"""
+    ssh_options = [option for value in args.ssh_option for option in ('-o', value)]
+    transports, control_dir = make_transports(args.transport, list(dict.fromkeys(args.targets)), ssh_options)
+    summaries = {}
+
+    def provision_host(transport):
+        def provision_step():
+            succeeded, summaries[transport.name] = provision(
+                transport, args.script, args.script_args, args.remote_dir, sudo=args.sudo)
+            return succeeded
+        return provision_step
+
+    # Every host is an independent step, so output is prefixed with the host name
+    started = time.time()
+    try:
+        run_steps([Step(t.name, provision_host(t)) for t in transports], jobs=args.jobs)
+    finally:
+        remove_control_dir(control_dir)
+
+    records = {record.name: record for record in tracer.steps if record.start >= started}
+    reports = [host_report(t.name, records[t.name].status, records[t.name].duration, summaries.get(t.name))
+               for t in transports]
+    print_report(reports)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"Report written to {args.report}")
+    return all(report['status'] == 'done' for report in reports)
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace)
+    sys.exit(0 if succeeded else 1)
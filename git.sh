@@ -7,6 +7,7 @@ GREEN='\033[0;92m'
 YELLOW='\033[0;93m'
 NC='\033[0m'
 SSH_KEY_PATH="$HOME/.ssh/id_ed25519"
+WORKSPACE_MANIFEST="${WORKSPACE_MANIFEST:-$HOME/git/workspace.toml}"
 
 # Initialization banner
 echo -e "${GREEN}"
@@ -102,6 +103,11 @@ github_login() {
 
 clone_repo() {
     echo -e "\n${YELLOW}Repository Setup${NC}"
+    # A workspace manifest clones every repository at once instead of one from the prompt
+    if [ -f "$WORKSPACE_MANIFEST" ]; then
+        python3 "$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/workspace-sync.py" "$WORKSPACE_MANIFEST"
+        return
+    fi
     read -p "Enter GitHub repository URL (SSH or HTTPS): " repo_url
     read -p "Enter clone directory [default: current]: " clone_dir
     clone_dir="${clone_dir:-.}"
@@ -1,35 +1,73 @@
+import argparse
+import hashlib
+import json
 import os
+import shutil
 import subprocess
 import sys
-import venv
-from getpass import getuser
+from pathlib import Path
 
-# Capture the original user running the script
-ORIGINAL_USER = getuser()
+from provisioning.dnf_profile import DEFAULT_PARALLEL_DOWNLOADS, PROFILE_MODES, run_profile
+from provisioning.git_cache import GitCacheError, default_mirror_dir, git_mirrors
+from provisioning.host_facts import host
+from provisioning.journal import StepJournal, default_journal_path, path_state, rpmdb_state
+from provisioning.lan_mirror import LanMirror, MirrorError
+from provisioning.package_state import invalidate_installed_index, missing_packages
+from provisioning.repo_metadata import DEFAULT_METADATA_TTL, metadata
+from provisioning.rpm_artifacts import (RpmArtifactError, RpmArtifacts, artifact_key, default_artifact_dir,
+                                        installed_versions, resolved_versions)
+from provisioning.run_history import default_history_path, record_run
+from provisioning.runner import finish_run, run, step
+from provisioning.scheduler import DEFAULT_JOBS, Step, run_steps
+from provisioning.sunshine_unit import (DEFAULT_NICE, DEFAULT_SCHED_POLICY, SCHED_POLICIES, UnitError,
+                                        install_unit, performance_cpus, render_unit)
+from provisioning.venv_factory import VenvError, default_venv_dir, venvs
+
+SERVICE_FILE_PATH = "/etc/systemd/system/sunshine.service"
+SUNSHINE_URL = "https://github.com/LizardByte/Sunshine.git"
+SUNSHINE_TAG = "v2024.1011.4829"
+SUNSHINE_VERSION = SUNSHINE_TAG.lstrip("v")
+SUNSHINE_BINARY = "/usr/local/bin/sunshine"
+
+# A parallel C++ compile job of Sunshine peaks at roughly this much memory
+BUILD_MEMORY_PER_JOB = 2 * 1024 ** 3
+BUILD_STAMP = ".fedora-scripts-build.json"
+
+SUNSHINE_DEPENDENCIES = [
+    "boost-devel", "cmake", "gcc", "gcc-c++", "intel-mediasdk-devel",
+    "libappindicator-gtk3-devel", "libcap-devel", "libcurl-devel", "libdrm-devel",
+    "libevdev-devel", "libnotify-devel", "libva-devel", "libvdpau-devel", 
+    "libX11-devel", "libxcb-devel", "libXcursor-devel", "libXfixes-devel", 
+    "libXi-devel", "libXinerama-devel", "libXrandr-devel", "libXtst-devel", 
+    "mesa-libGL-devel", "miniupnpc-devel", "npm", "numactl-devel", 
+    "openssl-devel", "opus-devel", "pulseaudio-libs-devel", "rpm-build", 
+    "wget", "which", "ninja-build", "ccache", "xorg-x11-drv-nvidia", "akmod-nvidia", "vdpauinfo", 
+    "libva-vdpau-driver", "libva-utils"
+]
+
+# Packages whose versions change what a Sunshine build produces
+BUILD_INPUT_PACKAGES = ["gcc", "gcc-c++"] + [dep for dep in SUNSHINE_DEPENDENCIES if dep.endswith("-devel")]
 
 # Function to check if Sunshine is installed and running
 def is_sunshine_installed():
-    try:
-        # Check if the Sunshine binary exists
-        sunshine_path = subprocess.check_output(['which', 'sunshine'], stderr=subprocess.STDOUT).strip()
-        print(f"Sunshine is installed at: {sunshine_path.decode()}")
-        
-        # Check if the Sunshine service is running
-        service_status = subprocess.check_output(['sudo', 'systemctl', 'is-active', 'sunshine.service'], stderr=subprocess.STDOUT).strip()
-        if service_status == b'active':
-            print("Sunshine is already running.")
-            return True
-        else:
-            print("Sunshine is installed but not running.")
-            return False
-    except subprocess.CalledProcessError:
-        # Sunshine is not installed or not running
+    # Check if the Sunshine binary exists
+    sunshine_path = shutil.which('sunshine')
+    if not sunshine_path:
         print("Sunshine is not installed or not running.")
         return False
+    print(f"Sunshine is installed at: {sunshine_path}")
+
+    # Check if the Sunshine service is running
+    if host.unit_active('sunshine.service'):
+        print("Sunshine is already running.")
+        return True
+    else:
+        print("Sunshine is installed but not running.")
+        return False
 
 # Function to create directories if they don't exist
 def create_directories():
-    dirs = [f"/home/{ORIGINAL_USER}/git/fw/sunshine"]
+    dirs = [f"{host.home}/git/fw/sunshine"]
     for dir in dirs:
         if not os.path.exists(dir):
             print(f"Creating directory: {dir}")
@@ -38,83 +76,75 @@ def create_directories():
             print(f"Directory {dir} already exists. Skipping creation.")
 
 # Function to install necessary dependencies
-def install_dependencies():
+def install_dependencies(upgrade=False, build_inputs=None):
     print("Installing dependencies for Sunshine...")
     try:
-        # Run dnf update if necessary
-        print("Updating system...")
-        subprocess.check_call(["sudo", "dnf", "update", "-y"])
+        # Refresh metadata once for the run, the full upgrade is opt-in
+        metadata.refresh()
+        if upgrade:
+            metadata.upgrade()
 
         # Check if development tools are already installed
-        dev_tools_installed = subprocess.call(["dnf", "groupinfo", "Development Tools"], stdout=subprocess.DEVNULL) == 0
+        dev_tools_installed = run(["dnf", "groupinfo", *metadata.dnf_options(), "Development Tools"],
+                                 capture=True).returncode == 0
         if dev_tools_installed:
             print("Development Tools group already installed. Skipping.")
         else:
             print("Installing Development Tools group...")
-            subprocess.check_call(["sudo", "dnf", "groupinstall", "-y", "Development Tools"])
-
-        # Check for individual dependencies
-        dependencies = [
-            "boost-devel", "cmake", "gcc", "gcc-c++", "intel-mediasdk-devel",
-            "libappindicator-gtk3-devel", "libcap-devel", "libcurl-devel", "libdrm-devel",
-            "libevdev-devel", "libnotify-devel", "libva-devel", "libvdpau-devel", 
-            "libX11-devel", "libxcb-devel", "libXcursor-devel", "libXfixes-devel", 
-            "libXi-devel", "libXinerama-devel", "libXrandr-devel", "libXtst-devel", 
-            "mesa-libGL-devel", "miniupnpc-devel", "npm", "numactl-devel", 
-            "openssl-devel", "opus-devel", "pulseaudio-libs-devel", "rpm-build", 
-            "wget", "which", "xorg-x11-drv-nvidia", "akmod-nvidia", "vdpauinfo", 
-            "libva-vdpau-driver", "libva-utils"
-        ]
-        installed = subprocess.check_output(['dnf', 'list', 'installed'], stderr=subprocess.STDOUT).decode()
-        for dep in dependencies:
-            if dep in installed:
+            run(["sudo", "dnf", "groupinstall", "-y", *metadata.dnf_options(), "Development Tools"], check=True)
+
+        # Check for individual dependencies by exact name in the RPM database
+        missing = missing_packages(SUNSHINE_DEPENDENCIES)
+        for dep in SUNSHINE_DEPENDENCIES:
+            if dep not in missing:
                 print(f"{dep} is already installed. Skipping.")
-            else:
-                print(f"Installing {dep}...")
-                subprocess.check_call(["sudo", "dnf", "install", "-y", dep])
+        if missing:
+            print(f"Installing {' '.join(missing)}...")
+            run(["sudo", "dnf", "install", "-y", *metadata.dnf_options(), *missing], check=True)
+            invalidate_installed_index()
+
+        # Build with exactly the versions the artifact key was computed from
+        if build_inputs:
+            installed = installed_versions(BUILD_INPUT_PACKAGES)
+            outdated = [nvr for nvr in build_inputs if nvr not in installed]
+            if outdated:
+                print(f"Installing the resolved build input versions {' '.join(outdated)}...")
+                run(["sudo", "dnf", "install", "-y", *metadata.dnf_options(), *outdated], check=True)
+                invalidate_installed_index()
     except subprocess.CalledProcessError as e:
         print(f"Error during installation of dependencies: {e}")
         sys.exit(1)
 
-# Function to create a virtual environment
+# Function to create a virtual environment, cloned from a cached template
 def create_virtualenv(env_name, env_path):
     venv_dir = os.path.join(env_path, env_name)
-    if not os.path.exists(venv_dir):
-        print(f"Creating virtual environment: {env_name}")
-        venv.create(venv_dir, with_pip=True)
-    else:
-        print(f"Virtual environment {env_name} already exists. Skipping creation.")
-    return venv_dir
-
-# Function to activate the virtual environment
-def activate_virtualenv(venv_dir):
-    activate_script = os.path.join(venv_dir, "bin", "activate")
-    if os.path.exists(activate_script):
-        print(f"Activating virtual environment: {venv_dir}")
-        subprocess.call(f"source {activate_script}", shell=True, executable="/bin/bash")
-    else:
-        print(f"Failed to activate virtual environment: {venv_dir}")
+    try:
+        python = venvs.create(venv_dir)
+    except VenvError as e:
+        print(f"Failed to create virtual environment {env_name}: {e}")
         sys.exit(1)
+    # Commands use the environment by running its interpreter, there is nothing to activate
+    print(f"Virtual environment ready, use {python}")
+    return python
 
 # Function to add user to necessary groups for permissions
 def setup_permissions_groups():
     print("Setting up user permissions for GPU and input devices...")
     try:
         # Check if user is already in the video group
-        video_group = subprocess.check_output(["groups", ORIGINAL_USER]).decode()
-        if "video" in video_group:
-            print(f"User {ORIGINAL_USER} is already in 'video' group. Skipping.")
+        groups = host.groups()
+        if "video" in groups:
+            print(f"User {host.user} is already in 'video' group. Skipping.")
         else:
-            subprocess.check_call(["sudo", "usermod", "-aG", "video", ORIGINAL_USER])
-            print(f"User {ORIGINAL_USER} added to 'video' group.")
+            run(["sudo", "usermod", "-aG", "video", host.user], check=True)
+            print(f"User {host.user} added to 'video' group.")
 
         # Check if user is already in the input group
-        input_group = subprocess.check_output(["groups", ORIGINAL_USER]).decode()
-        if "input" in input_group:
-            print(f"User {ORIGINAL_USER} is already in 'input' group. Skipping.")
+        if "input" in groups:
+            print(f"User {host.user} is already in 'input' group. Skipping.")
         else:
-            subprocess.check_call(["sudo", "usermod", "-aG", "input", ORIGINAL_USER])
-            print(f"User {ORIGINAL_USER} added to 'input' group.")
+            run(["sudo", "usermod", "-aG", "input", host.user], check=True)
+            print(f"User {host.user} added to 'input' group.")
     except subprocess.CalledProcessError as e:
         print(f"Error adding user to groups: {e}")
         sys.exit(1)
@@ -127,38 +157,144 @@ def export_wayland_display():
     else:
         print("WAYLAND_DISPLAY is already set. Skipping.")
 
-# Function to clone and build Sunshine
-def build_sunshine():
-    print("Cloning and building Sunshine...")
-    sunshine_repo_path = f"/home/{ORIGINAL_USER}/git/fw/sunshine/Sunshine"
-    if not os.path.exists(sunshine_repo_path):
-        try:
-            # Clone the Sunshine repository
-            subprocess.check_call([
-                "git", "clone", "https://github.com/LizardByte/Sunshine.git", 
-                sunshine_repo_path
-            ])
-        except subprocess.CalledProcessError as e:
-            print(f"Error during Sunshine clone: {e}")
-            sys.exit(1)
+# Function to read the memory available for new processes
+def available_memory():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Function to pick a compile job count that fits the cores and memory
+def build_jobs(requested=None):
+    jobs = requested or os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        jobs = min(jobs, max(1, memory // BUILD_MEMORY_PER_JOB))
+    return jobs
+
+# Function to choose the CMake generator and compiler launcher
+def cmake_flags():
+    flags = ["-DCMAKE_BUILD_TYPE=Release"]
+    if shutil.which("ninja"):
+        flags += ["-G", "Ninja"]
+    if shutil.which("ccache"):
+        flags += ["-DCMAKE_C_COMPILER_LAUNCHER=ccache", "-DCMAKE_CXX_COMPILER_LAUNCHER=ccache"]
+    return flags
+
+# Function to hash the installed Sunshine binary
+def file_sha256(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except OSError:
+        return None
+
+# Function to read the record of the last successful build
+def read_build_stamp(build_dir):
+    try:
+        with open(os.path.join(build_dir, BUILD_STAMP)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Function to resolve the build input versions from the repositories, before any of them is installed
+def sunshine_build_inputs():
+    metadata.refresh()
+    return resolved_versions(BUILD_INPUT_PACKAGES, host.machine, metadata.dnf_options())
+
+# Function to compute the artifact key of a Sunshine build from the resolved input package versions
+def sunshine_artifact_key(build_inputs):
+    return artifact_key({"tag": SUNSHINE_TAG, "fedora": host.fedora_release, "packages": build_inputs})
+
+# Function to look for a packaged build matching what this machine would build
+def find_sunshine_artifact(artifacts, key):
+    artifact = artifacts.find("sunshine", SUNSHINE_VERSION, key)
+    if artifact:
+        print(f"Found a packaged Sunshine build: {artifact}")
     else:
-        print(f"Sunshine repository already exists at {sunshine_repo_path}. Skipping clone.")
+        print(f"No packaged Sunshine build with key {key} in {artifacts.root}, building from source.")
+    return artifact
 
+# Function to package the build tree into an RPM, reusing one built from the same inputs
+def package_sunshine(build_dir, artifacts, key):
+    artifact = artifacts.find("sunshine", SUNSHINE_VERSION, key)
+    if artifact:
+        return artifact
+    staging = os.path.join(build_dir, "rpm-staging")
+    shutil.rmtree(staging, ignore_errors=True)
+    run(["cmake", "--install", build_dir], check=True, env={**os.environ, "DESTDIR": staging})
+    return artifacts.package("sunshine", SUNSHINE_VERSION, key, staging,
+                             summary="Sunshine game stream host", license="GPL-3.0-only")
+
+# Function to install a packaged Sunshine build
+def install_sunshine_rpm(artifact):
+    print(f"Installing {artifact}...")
     try:
-        os.chdir(sunshine_repo_path)
-        
-        # Checkout the specific version
-        subprocess.check_call([
-            "git", "checkout", "v2024.1011.4829"
-        ])
-        
-        # Create a build directory and compile
-        os.makedirs("build", exist_ok=True)
-        os.chdir("build")
-        subprocess.check_call(["cmake", ".."])
-        subprocess.check_call(["make"])
-        subprocess.check_call(["sudo", "make", "install"])
+        run(["sudo", "dnf", "install", "-y", *metadata.dnf_options(), str(artifact)], check=True)
     except subprocess.CalledProcessError as e:
+        print(f"Error installing {artifact}: {e}")
+        sys.exit(1)
+
+# Function to clone and build Sunshine
+def build_sunshine(jobs=None, artifacts=None, key=None):
+    print("Cloning and building Sunshine...")
+    sunshine_repo_path = f"{host.home}/git/fw/sunshine/Sunshine"
+    build_dir = os.path.join(sunshine_repo_path, "build")
+    try:
+        # Shallow fetch of just the pinned tag, which the mirror keeps between runs
+        git_mirrors.checkout(SUNSHINE_URL, sunshine_repo_path, f"refs/tags/{SUNSHINE_TAG}",
+                             depth=1, immutable=True)
+    except GitCacheError as e:
+        print(f"Error during Sunshine clone: {e}")
+        sys.exit(1)
+
+    try:
+        commit = run(["git", "rev-parse", "HEAD"], capture=True, check=True,
+                     cwd=sunshine_repo_path).stdout.decode().strip()
+
+        # Nothing to do when this commit was built with these flags and is still installed
+        flags = cmake_flags()
+        stamp = read_build_stamp(build_dir)
+        installed_hash = file_sha256(SUNSHINE_BINARY)
+        built = stamp.get("commit") == commit and stamp.get("flags") == flags
+        # With --rpm the installed build also has to be packaged already, under the current key
+        packaged = artifacts is None or artifacts.find("sunshine", SUNSHINE_VERSION, key)
+        if built and installed_hash and stamp.get("binary_sha256") == installed_hash and packaged:
+            print(f"Sunshine {SUNSHINE_TAG} is already built and installed. Skipping build.")
+            return
+
+        if built:
+            print(f"Sunshine {SUNSHINE_TAG} is already built. Skipping configure and build.")
+        else:
+            # Configure only when there is no build tree or the flags changed
+            os.makedirs(build_dir, exist_ok=True)
+            configured = os.path.exists(os.path.join(build_dir, "CMakeCache.txt"))
+            if not configured or stamp.get("flags") != flags:
+                if configured and stamp.get("flags") != flags:
+                    # The generator cannot change in an existing build tree
+                    shutil.rmtree(build_dir)
+                    os.makedirs(build_dir)
+                run(["cmake", "-S", sunshine_repo_path, "-B", build_dir, *flags], check=True)
+            else:
+                print("Sunshine build tree is already configured. Skipping configure.")
+
+            jobs = build_jobs(jobs)
+            print(f"Building Sunshine with {jobs} parallel jobs...")
+            run(["cmake", "--build", build_dir, "--parallel", str(jobs)], check=True)
+
+        if artifacts is None:
+            run(["sudo", "cmake", "--install", build_dir], check=True)
+        else:
+            install_sunshine_rpm(package_sunshine(build_dir, artifacts, key))
+
+        with open(os.path.join(build_dir, BUILD_STAMP), "w") as f:
+            json.dump({"commit": commit, "flags": flags,
+                       "binary_sha256": file_sha256(SUNSHINE_BINARY)}, f)
+    except (subprocess.CalledProcessError, RpmArtifactError) as e:
         print(f"Error during Sunshine build: {e}")
         sys.exit(1)
 
@@ -166,85 +302,171 @@ def build_sunshine():
 def setup_permissions():
     print("Setting up KMS display capture permissions...")
     try:
-        sunshine_binary = subprocess.check_output(['which', 'sunshine']).strip().decode()
-        setcap_output = subprocess.check_output(['sudo', 'getcap', sunshine_binary])
+        sunshine_binary = shutil.which('sunshine')
+        if not sunshine_binary:
+            print("Sunshine is not installed, cannot set KMS permissions.")
+            sys.exit(1)
+        setcap_output = run(['sudo', 'getcap', sunshine_binary], capture=True, check=True).stdout
         if "cap_sys_admin" in setcap_output.decode():
             print(f"KMS permissions already set for {sunshine_binary}. Skipping.")
         else:
-            subprocess.check_call([
+            run([
                 "sudo", "setcap", "cap_sys_admin+p", sunshine_binary
-            ])
+            ], check=True)
             print(f"KMS permissions set for {sunshine_binary}.")
     except subprocess.CalledProcessError as e:
         print(f"Error during permission setup: {e}")
         sys.exit(1)
 
-# Function to setup autostart with systemd
-def setup_autostart_service():
-    service_file_path = f"/etc/systemd/system/sunshine.service"
-    if os.path.exists(service_file_path):
-        print(f"Systemd service already exists at {service_file_path}. Skipping creation.")
-    else:
-        print(f"Creating systemd service at {service_file_path}")
-        service_content = f"""
-[Unit]
-Description=Sunshine Game Streaming Service
-After=network.target
-
-[Service]
-ExecStart=/usr/local/bin/sunshine
-Restart=on-failure
-User={ORIGINAL_USER}
-Group={ORIGINAL_USER}
-
-[Install]
-WantedBy=multi-user.target
-        """
+# Function to render the Sunshine unit for this machine
+def sunshine_unit(args):
+    cpus = args.stream_cpus if args.stream_cpus is not None else performance_cpus()
+    return render_unit(SUNSHINE_BINARY, user=host.user, cpus=cpus or None,
+                       nice=args.stream_nice, sched_policy=args.stream_sched)
+
+# Function to setup autostart with systemd, replacing the unit when the generated one differs
+def setup_autostart_service(unit_text):
+    try:
+        install_unit(SERVICE_FILE_PATH, unit_text)
+    except UnitError as e:
+        print(f"Error setting up systemd service: {e}")
+        sys.exit(1)
+
+# Function to parse command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build and install Sunshine")
+    parser.add_argument("--metadata-ttl", type=int, default=DEFAULT_METADATA_TTL,
+                        help="skip the metadata refresh when the dnf cache is younger than this many seconds")
+    parser.add_argument("--dnf-profile", choices=PROFILE_MODES, default="apply",
+                        help="tune dnf.conf for the run and restore it afterwards (apply), leave it tuned (keep) or leave it alone (off)")
+    parser.add_argument("--parallel-downloads", type=int, default=DEFAULT_PARALLEL_DOWNLOADS,
+                        help="max_parallel_downloads of the dnf profile")
+    parser.add_argument("--dnf-cache-dir",
+                        help="package cache directory of the dnf profile, kept between runs")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="run a full system upgrade before installing dependencies")
+    parser.add_argument("--stream-cpus", metavar="LIST",
+                        help="CPUs Sunshine is pinned to, e.g. 0-7 (default: the performance cores of a hybrid CPU, "
+                             "otherwise all); an empty string disables pinning")
+    parser.add_argument("--stream-nice", type=int, default=DEFAULT_NICE,
+                        help="nice level of the Sunshine service")
+    parser.add_argument("--stream-sched", choices=SCHED_POLICIES, default=DEFAULT_SCHED_POLICY,
+                        help="CPU scheduling policy of the Sunshine service")
+    parser.add_argument("--mirror", metavar="PATH_OR_URL",
+                        help="install the build dependencies from a LAN mirror written by build-mirror.py")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace-event JSON of every step and command")
+    parser.add_argument("--summary-json", metavar="FILE",
+                        help="write the outcome and duration of every step as JSON")
+    parser.add_argument("--history", metavar="FILE", default=str(default_history_path()),
+                        help="SQLite database the step timings of every run are added to, an empty string disables it")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help="maximum number of steps to run concurrently")
+    parser.add_argument("--git-cache", default=str(default_mirror_dir()),
+                        help="directory of the bare git mirrors clones borrow objects from")
+    parser.add_argument("--build-jobs", type=int,
+                        help="parallel compile jobs for Sunshine (default: all cores the available memory allows)")
+    parser.add_argument("--rpm", action="store_true",
+                        help="package the build as an RPM, or install a matching packaged build without compiling")
+    parser.add_argument("--artifact-dir", default=str(default_artifact_dir()),
+                        help="directory (and file-based repository) of packaged Sunshine builds")
+    parser.add_argument("--venv-cache", default=str(default_venv_dir()),
+                        help="template virtual environments and wheel cache new environments are cloned from")
+    parser.add_argument("--facts-ttl", type=int, default=0,
+                        help="reuse OS release and kernel facts gathered by earlier runs for this many seconds")
+    parser.add_argument("--journal", default=str(default_journal_path("install-sunshine")),
+                        help="file recording completed steps between runs")
+    parser.add_argument("--verify", action="store_true",
+                        help="probe and run every step even if the journal says it is complete")
+    return parser.parse_args(argv)
+
+def main(args=None):
+    if args is None:
+        args = parse_args([])
+    host.cache_path = default_journal_path("host-facts")
+    host.ttl = args.facts_ttl
+    metadata.ttl = args.metadata_ttl
+    if args.dnf_cache_dir:
+        metadata.cache_globs = [f"{args.dnf_cache_dir}/*/repodata/repomd.xml"]
+    git_mirrors.root = Path(args.git_cache)
+    venvs.root = Path(args.venv_cache)
+    if args.mirror:
         try:
-            with open(service_file_path, "w") as service_file:
-                service_file.write(service_content)
-
-            # Enable and start the service
-            subprocess.check_call(["sudo", "systemctl", "daemon-reload"])
-            subprocess.check_call(["sudo", "systemctl", "enable", "sunshine.service"])
-            subprocess.check_call(["sudo", "systemctl", "start", "sunshine.service"])
-            subprocess.check_call(["sudo", "systemctl", "status", "sunshine.service"])
-        except Exception as e:
-            print(f"Error setting up systemd service: {e}")
-            sys.exit(1)
+            LanMirror(args.mirror).enable()
+        except MirrorError as e:
+            print(e)
+            return False
 
-def main():
-    # Check if Sunshine is already installed and running
-    if is_sunshine_installed():
-        print("Sunshine is already installed and running. Skipping installation.")
-        return
+    unit_text = sunshine_unit(args)
 
-    # Create necessary directories
-    create_directories()
+    def service_step(deps=()):
+        return Step("autostart-service", lambda: setup_autostart_service(unit_text), deps=deps,
+                    fingerprint=lambda: [unit_text, path_state(SERVICE_FILE_PATH)])
 
-    # Install dependencies
-    install_dependencies()
+    journal = StepJournal(args.journal) if args.journal else None
 
-    # Setup user permissions
-    setup_permissions_groups()
+    # Check if Sunshine is already installed and running
+    with step("check-installed"):
+        installed = is_sunshine_installed()
+    if installed:
+        # The unit is still brought up to date, which restarts Sunshine if it changed
+        print("Sunshine is already installed and running. Skipping installation.")
+        return run_steps([service_step()], jobs=1, journal=journal, verify=args.verify)
+
+    # A build packaged on another machine with the same inputs replaces the compile
+    artifacts = RpmArtifacts(args.artifact_dir) if args.rpm else None
+    artifact = build_inputs = key = None
+    if artifacts:
+        with step("artifact-lookup"):
+            try:
+                build_inputs = sunshine_build_inputs()
+            except RpmArtifactError as e:
+                print(f"{e}, building without packaging.")
+                artifacts = None
+            else:
+                key = sunshine_artifact_key(build_inputs)
+                artifact = find_sunshine_artifact(artifacts, key)
 
     # Set Wayland display environment variable
     export_wayland_display()
 
-    # Create and activate virtual environment
     venv_name = "sunshine-venv"
-    venv_path = f"/home/{ORIGINAL_USER}/git/fw/sunshine"
-    venv_dir = create_virtualenv(venv_name, venv_path)
-    activate_virtualenv(venv_dir)
-
-    # Build Sunshine
-    build_sunshine()
-
-    # Set up KMS permissions
-    setup_permissions()
+    venv_path = f"{host.home}/git/fw/sunshine"
 
-    # Setup autostart systemd service
-    setup_autostart_service()
+    # Each step's fingerprint lets re-runs skip it while its inputs are unchanged
+    if artifact:
+        install_steps = [
+            Step("install-rpm", lambda: install_sunshine_rpm(artifact), locks=["dnf"],
+                 fingerprint=lambda: [str(artifact), path_state(SUNSHINE_BINARY)]),
+        ]
+    else:
+        install_steps = [
+            Step("directories", create_directories,
+                 fingerprint=lambda: [path_state(venv_path)], validate=lambda: os.path.isdir(venv_path)),
+            Step("dependencies", lambda: install_dependencies(upgrade=args.upgrade, build_inputs=build_inputs),
+                 deps=["directories"], locks=["dnf"],
+                 fingerprint=None if args.upgrade else lambda: [rpmdb_state(), build_inputs]),
+            Step("virtualenv", lambda: create_virtualenv(venv_name, venv_path), deps=["directories"],
+                 fingerprint=lambda: [path_state(os.path.join(venv_path, venv_name, "pyvenv.cfg"))]),
+            Step("build", lambda: build_sunshine(args.build_jobs, artifacts, key), deps=["dependencies", "virtualenv"],
+                 fingerprint=lambda: [SUNSHINE_TAG, key, path_state(SUNSHINE_BINARY)]),
+        ]
+    steps = install_steps + [
+        Step("permission-groups", setup_permissions_groups,
+             fingerprint=lambda: [host.user, path_state("/etc/group")]),
+        Step("kms-permissions", setup_permissions, deps=[install_steps[-1].name],
+             fingerprint=lambda: [path_state(SUNSHINE_BINARY)]),
+        service_step(deps=["kms-permissions", "permission-groups"]),
+    ]
+    with run_profile(args.dnf_profile, args.parallel_downloads, args.dnf_cache_dir):
+        return run_steps(steps, jobs=args.jobs, journal=journal, verify=args.verify)
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace, args.summary_json)
+        if args.history:
+            record_run(args.history, __file__)
+    sys.exit(0 if succeeded is not False else 1)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+from pathlib import Path
+
+from provisioning.venv_factory import VenvError, default_venv_dir, venvs
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Create a virtual environment from a cached template")
+    parser.add_argument('dest', help="directory of the new environment")
+    parser.add_argument('-r', '--requirements', metavar='FILE',
+                        help="requirements installed into the template the environment is cloned from")
+    parser.add_argument('--python', default=sys.executable,
+                        help="interpreter the environment is for (default: the one running this script)")
+    parser.add_argument('--cache', default=str(default_venv_dir()),
+                        help="directory of the templates and the shared wheel cache")
+    return parser.parse_args(argv)
+
+def main(args):
+    """Clone the template for the interpreter and requirements into dest"""
+    venvs.root = Path(args.cache)
+    try:
+        python = venvs.create(args.dest, python=args.python, requirements=args.requirements)
+    except VenvError as e:
+        print(e)
+        return False
+    print(f"Run {python} to use it, there is no need to activate the environment.")
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main(parse_args()) else 1)
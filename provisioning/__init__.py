@@ -0,0 +1 @@
+"""Shared helpers for the Fedora provisioning scripts"""
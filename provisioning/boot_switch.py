@@ -0,0 +1,258 @@
+"""Switch between the installed operating systems through kexec or the EFI boot manager"""
+
+import glob
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from provisioning.runner import run
+
+# os-release ID of each OS and the pattern its EFI entries and boot loader entries match
+OPERATING_SYSTEMS = {
+    'fedora': ('Fedora', re.compile(r'fedora', re.IGNORECASE)),
+    'pop': ('Pop!_OS', re.compile(r'pop[!_ ]*os', re.IGNORECASE)),
+}
+
+# Where boot loader entries of the other OS can be found: the ESP holds
+# systemd-boot's entries, /boot the BLS entries of GRUB
+DEFAULT_BOOT_ROOTS = ['/boot/efi', '/efi', '/boot']
+
+LOCKDOWN_PATH = '/sys/kernel/security/lockdown'
+
+BOOT_LINE = re.compile(r'^Boot([0-9A-Fa-f]{4})(\*?)\s+(.*)$')
+DEVICE_PATH = re.compile(r'\s+(?=(HD|PciRoot|VenHw|VenMsg|VenMedia|BBS|FvVol|Fv|MAC|USB|Acpi|Uri)\()')
+
+
+class BootSwitchError(Exception):
+    """Raised when the boot configuration cannot be read or changed"""
+
+
+class BootEntry:
+    """One Boot#### variable of the EFI boot manager"""
+
+    def __init__(self, number, label, active=True, device_path=''):
+        self.number = number
+        self.label = label
+        self.active = active
+        self.device_path = device_path
+
+    def __repr__(self):
+        return f"BootEntry({self.number!r}, {self.label!r})"
+
+
+class BootConfig:
+    """What efibootmgr reports, parsed once"""
+
+    def __init__(self, entries, order, current=None, next=None, timeout=None):
+        self.entries = entries
+        self.order = order
+        self.current = current
+        self.next = next
+        self.timeout = timeout
+
+    def matching(self, pattern):
+        """Numbers of the entries whose label matches, in boot order first"""
+        ranked = self.order + [n for n in self.entries if n not in self.order]
+        return [n for n in ranked if n in self.entries and pattern.search(self.entries[n].label)]
+
+    def order_with_first(self, numbers):
+        """BootOrder with numbers moved to the front, every other entry kept in its place"""
+        return list(dict.fromkeys(numbers + self.order))
+
+
+def parse_efibootmgr(text):
+    """BootConfig from the output of efibootmgr, with or without -v"""
+    entries = {}
+    fields = {}
+    for line in text.splitlines():
+        match = BOOT_LINE.match(line)
+        if match:
+            number, active, rest = match.groups()
+            label, _, device_path = rest.partition('\t')
+            if not device_path:
+                parts = DEVICE_PATH.split(rest, maxsplit=1)
+                label, device_path = parts[0], rest[len(parts[0]):].strip()
+            entries[number.upper()] = BootEntry(number.upper(), label.strip(), bool(active), device_path.strip())
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            fields[key.strip()] = value.strip()
+    if not entries:
+        raise BootSwitchError("efibootmgr listed no boot entries")
+    order = [n.upper() for n in fields.get('BootOrder', '').split(',') if n]
+    return BootConfig(entries, order, fields.get('BootCurrent'), fields.get('BootNext'), fields.get('Timeout'))
+
+
+def read_boot_config(fixture=None):
+    """Boot configuration from one efibootmgr call, or from captured output"""
+    if fixture:
+        return parse_efibootmgr(Path(fixture).read_text())
+    result = run(['efibootmgr'], capture=True)
+    if result.returncode != 0:
+        raise BootSwitchError(f"efibootmgr failed: {result.stderr.decode(errors='replace').strip()}")
+    return parse_efibootmgr(result.stdout.decode(errors='replace'))
+
+
+def parse_loader_entry(text):
+    """Keys of a Boot Loader Specification entry; initrd may repeat"""
+    entry = {'initrd': []}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        key, _, value = line.partition(' ')
+        if key == 'initrd':
+            entry['initrd'] += value.split()
+        else:
+            entry[key] = value.strip()
+    return entry
+
+
+def natural_key(text):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', text)]
+
+
+def grubenv_kernelopts(root):
+    """kernelopts from GRUB's environment block, which older Fedora entries refer to as $kernelopts"""
+    for path in (Path(root) / 'grub2' / 'grubenv', Path(root) / 'efi' / 'EFI' / 'fedora' / 'grubenv'):
+        try:
+            for line in path.read_text().splitlines():
+                if line.startswith('kernelopts='):
+                    return line.split('=', 1)[1]
+        except OSError:
+            continue
+    return ''
+
+
+class KexecTarget:
+    """Kernel, initrds and command line of the other OS's default loader entry"""
+
+    def __init__(self, title, kernel, initrds, options):
+        self.title = title
+        self.kernel = kernel
+        self.initrds = initrds
+        self.options = options
+
+
+def find_kexec_target(os_id, roots=DEFAULT_BOOT_ROOTS):
+    """The newest non-rescue loader entry of an OS under any of the boot roots, or None"""
+    pattern = OPERATING_SYSTEMS[os_id][1]
+    candidates = []
+    for root in roots:
+        for path in glob.glob(os.path.join(root, 'loader', 'entries', '*.conf')):
+            try:
+                entry = parse_loader_entry(Path(path).read_text())
+            except OSError:
+                continue
+            name = os.path.basename(path)
+            title = entry.get('title', name)
+            if not entry.get('linux') or 'rescue' in name or 'rescue' in title.lower():
+                continue
+            if pattern.search(title) or pattern.search(name):
+                # Entries named *current* point at the newest kernel, otherwise the highest version wins
+                rank = ('current' in name, natural_key(entry.get('version', name)))
+                candidates.append((rank, root, entry, title))
+    if not candidates:
+        return None
+
+    _, root, entry, title = max(candidates, key=lambda c: c[0])
+    options = entry.get('options', '')
+    if '$kernelopts' in options:
+        options = options.replace('$kernelopts', grubenv_kernelopts(root))
+    kernel = os.path.join(root, entry['linux'].lstrip('/'))
+    initrds = [os.path.join(root, initrd.lstrip('/')) for initrd in entry['initrd']]
+    return KexecTarget(title, kernel, initrds, ' '.join(options.split()))
+
+
+def kernel_locked_down():
+    """Whether lockdown only lets kexec load signed kernels through kexec_file_load"""
+    try:
+        return '[none]' not in Path(LOCKDOWN_PATH).read_text()
+    except OSError:
+        return False
+
+
+class SwitchPlan:
+    """The commands that switch to the other OS, printable before anything runs"""
+
+    def __init__(self, current, target, boot_order=None, boot_next=None, kexec=None):
+        self.current = current
+        self.target = target
+        self.boot_order = boot_order
+        self.boot_next = boot_next
+        self.kexec = kexec
+
+    def describe(self):
+        lines = [f"Detected current OS: {OPERATING_SYSTEMS[self.current][0]}",
+                 f"Switching to {OPERATING_SYSTEMS[self.target][0]}."]
+        if self.boot_order:
+            lines.append(f"New boot order will be: {','.join(self.boot_order)}")
+        if self.boot_next:
+            lines.append(f"Next boot only will use entry {self.boot_next}")
+        if self.kexec:
+            lines.append(f"kexec into {self.kexec.title}: {self.kexec.kernel}")
+            for initrd in self.kexec.initrds:
+                lines.append(f"  initrd {initrd}")
+            lines.append(f"  options {self.kexec.options}")
+        else:
+            lines.append("Rebooting through the firmware.")
+        return lines
+
+
+def plan_switch(config, current, kexec_target=None, once=False):
+    """Plan the switch away from the current OS
+
+    The boot order changes so a later cold boot also starts the other
+    OS; with once only BootNext is set, which the firmware forgets after
+    one boot. kexec_target skips the firmware for this switch.
+    """
+    if current not in OPERATING_SYSTEMS:
+        raise BootSwitchError(f"Unknown OS: {current}")
+    target = next(os_id for os_id in OPERATING_SYSTEMS if os_id != current)
+    wanted = config.matching(OPERATING_SYSTEMS[target][1])
+    if not wanted:
+        raise BootSwitchError(f"No EFI boot entry for {OPERATING_SYSTEMS[target][0]}")
+    if once:
+        return SwitchPlan(current, target, boot_next=wanted[0], kexec=kexec_target)
+    # The current OS stays right behind the target, as the fallback entry
+    first = wanted + config.matching(OPERATING_SYSTEMS[current][1])
+    return SwitchPlan(current, target, boot_order=config.order_with_first(first), kexec=kexec_target)
+
+
+def load_kexec(target):
+    """Load the kernel for systemctl kexec, returning True when it is loaded"""
+    with tempfile.TemporaryDirectory(prefix='swap-boot-') as tmp:
+        initrd = target.initrds[0] if len(target.initrds) == 1 else None
+        if len(target.initrds) > 1:
+            # kexec takes one initrd; the kernel unpacks concatenated archives in order
+            initrd = os.path.join(tmp, 'initrd')
+            with open(initrd, 'wb') as out:
+                for path in target.initrds:
+                    with open(path, 'rb') as f:
+                        out.write(f.read())
+        argv = ['sudo', 'kexec', '-l', target.kernel, f'--append={target.options}']
+        if initrd:
+            argv.append(f'--initrd={initrd}')
+        # kexec_file_load checks signatures, the only kind lockdown permits
+        if run(argv[:2] + ['-s'] + argv[2:]).returncode == 0:
+            return True
+        return not kernel_locked_down() and run(argv).returncode == 0
+
+
+def execute(plan):
+    """Apply the boot entry change, then kexec or reboot; returns False if nothing could be changed"""
+    if plan.boot_order and run(['sudo', 'efibootmgr', '-q', '-o', ','.join(plan.boot_order)]).returncode != 0:
+        raise BootSwitchError("efibootmgr could not change the boot order")
+    if plan.boot_next and run(['sudo', 'efibootmgr', '-q', '-n', plan.boot_next]).returncode != 0:
+        raise BootSwitchError("efibootmgr could not set BootNext")
+
+    if plan.kexec:
+        if load_kexec(plan.kexec):
+            print(f"Switching to {plan.kexec.title} without a firmware reboot...")
+            if run(['sudo', 'systemctl', 'kexec']).returncode == 0:
+                return True
+            print("systemctl kexec failed, rebooting through the firmware instead.")
+        else:
+            print("Could not load the kernel for kexec, rebooting through the firmware instead.")
+    print("Rebooting the system...")
+    return run(['sudo', 'reboot']).returncode == 0
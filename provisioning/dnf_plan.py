@@ -0,0 +1,131 @@
+"""Collect RPM work for a run and hand it to dnf as a single transaction"""
+
+from contextlib import nullcontext
+
+from provisioning.dnf_profile import DNF_CACHE_DIRS, is_dnf5
+from provisioning.package_state import invalidate_installed_index, is_installed
+from provisioning.prefetch import prefetcher
+from provisioning.repo_metadata import metadata
+from provisioning.runner import run
+
+
+def skip_unavailable_options():
+    """Make dnf skip targets no enabled repository provides, which dnf4 and dnf5 spell differently"""
+    return ['--skip-unavailable'] if is_dnf5() else ['--setopt=strict=False']
+
+
+class DnfPlan:
+    """RPM targets and repository additions for one dnf run
+
+    Install functions queue work on the plan instead of calling dnf directly.
+    execute() then removes conflicting packages, adds every repository, and
+    resolves and installs all targets in one transaction. Work that has to
+    happen afterwards is a scheduler step of its own, which checks the
+    system rather than the plan, so it also runs when a resumed run skips
+    the transaction.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DNF_CACHE_DIRS[0]
+        self.removals = []
+        self.repo_files = []
+        self.repo_rpms = []
+        self.packages = []
+        self.upgrade = False
+        self.before = []
+
+    def _extend(self, target, items):
+        for item in items:
+            if item not in target:
+                target.append(item)
+
+    def remove(self, *packages):
+        """Queue packages for removal, ignoring ones that are not installed"""
+        self._extend(self.removals, [p for p in packages if is_installed(p)])
+
+    def add_repo_file(self, url):
+        """Queue a .repo file to be added with dnf config-manager"""
+        self._extend(self.repo_files, [url])
+
+    def add_repo_rpm(self, *urls):
+        """Queue release RPMs that define repositories the transaction needs"""
+        self._extend(self.repo_rpms, urls)
+
+    def install(self, *targets):
+        """Queue package names or URL RPMs for the main transaction"""
+        self._extend(self.packages, targets)
+
+    def request_upgrade(self):
+        """Ask for the full system upgrade phase after the repositories are in place"""
+        self.upgrade = True
+
+    def run_before(self, label, func):
+        """Queue a step that must run before the transaction"""
+        self.before.append((label, func))
+
+    def download_packages(self):
+        """Download the targets the repositories configured so far provide into the dnf cache"""
+        names = [target for target in self.packages if '/' not in target and not target.endswith('.rpm')]
+        result = run(['sudo', 'dnf', 'install', '-y', '--downloadonly', *skip_unavailable_options(),
+                      *metadata.dnf_options(), *names])
+        if result.returncode != 0:
+            print("Could not download packages ahead of the transaction, it will download them itself.")
+
+    def prefetch(self):
+        """Context in which the targets download while the repositories are being added
+
+        The main transaction then installs what was downloaded from the cache.
+        """
+        if not self.packages:
+            return nullcontext()
+        return prefetcher.background([('dnf-packages', self.cache_dir, self.download_packages)])
+
+    def is_empty(self):
+        return not (self.removals or self.repo_files or self.repo_rpms or self.packages or self.upgrade)
+
+    def execute(self):
+        """Run the queued transaction, returning True if it succeeded"""
+        if self.is_empty():
+            print("No RPM packages to install, skipping dnf transaction...")
+            return True
+
+        if self.removals:
+            print(f"Removing conflicting packages: {' '.join(self.removals)}...")
+            run(['sudo', 'dnf', 'remove', '-y', *self.removals])
+
+        for label, func in self.before:
+            print(f"Running pre-install step: {label}...")
+            func()
+
+        # The setup transaction loads the existing repositories' metadata, so it
+        # is refreshed first; afterwards only the added repositories are fetched
+        metadata.refresh()
+        if self.repo_files or self.repo_rpms:
+            with self.prefetch():
+                print("Adding package repositories...")
+                # Repository definitions have to exist before dnf can resolve
+                # packages from them, so they get their own small transaction
+                setup = list(self.repo_rpms)
+                if self.repo_files and not is_installed('dnf-plugins-core'):
+                    setup.insert(0, 'dnf-plugins-core')
+                if setup:
+                    run(['sudo', 'dnf', 'install', '-y', *metadata.dnf_options(), *setup])
+                for url in self.repo_files:
+                    run(['sudo', 'dnf', 'config-manager', f'--add-repo={url}'])
+            metadata.mark_stale()
+
+            # Every repository is in place now, the ones already cached are not refreshed again
+            metadata.refresh()
+        if self.upgrade:
+            metadata.upgrade()
+
+        success = True
+        if self.packages:
+            print(f"Installing {len(self.packages)} packages in one dnf transaction...")
+            result = run(['sudo', 'dnf', 'install', '-y', *metadata.dnf_options(), *self.packages])
+            success = result.returncode == 0
+        invalidate_installed_index()
+
+        if not success:
+            print("The dnf transaction failed.")
+        return success
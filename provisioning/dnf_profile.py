@@ -0,0 +1,199 @@
+"""Reversible dnf.conf performance profile applied for the length of a run"""
+
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from provisioning.runner import run, tracer
+
+DNF_CONF = '/etc/dnf/dnf.conf'
+BACKUP_SUFFIX = '.fedora-scripts-backup'
+
+# Cache roots of dnf4 and dnf5, scanned to measure what a run downloaded
+DNF_CACHE_DIRS = ['/var/cache/dnf', '/var/cache/libdnf5']
+
+DEFAULT_PARALLEL_DOWNLOADS = 10
+
+# --dnf-profile modes: restore dnf.conf after the run, leave the profile configured, or do nothing
+PROFILE_MODES = ['apply', 'keep', 'off']
+
+
+def is_dnf5():
+    """Whether the dnf on PATH is dnf5, which names some options differently"""
+    dnf = shutil.which('dnf')
+    return bool(dnf) and os.path.basename(os.path.realpath(dnf)).startswith('dnf5')
+
+
+def profile_settings(parallel_downloads=DEFAULT_PARALLEL_DOWNLOADS, cache_dir=None, dnf5=None):
+    """[main] options of the performance profile
+
+    Fedora stopped publishing delta RPMs, so rebuilding from deltas only
+    costs CPU; dnf5 dropped the option altogether.
+    """
+    if dnf5 is None:
+        dnf5 = is_dnf5()
+    settings = {
+        'max_parallel_downloads': str(parallel_downloads),
+        'fastestmirror': 'True',
+        'keepcache': 'True',
+    }
+    if not dnf5:
+        settings['deltarpm'] = 'False'
+    if cache_dir:
+        settings['system_cachedir' if dnf5 else 'cachedir'] = str(cache_dir)
+    return settings
+
+
+def render_profile(text, settings):
+    """dnf.conf text with settings applied to [main], leaving comments and other sections alone"""
+    lines = text.splitlines(keepends=True)
+    pending = dict(settings)
+    out = []
+    section = None
+    main_end = None
+    for line in lines:
+        header = re.match(r'^\s*\[([^\]]+)\]', line)
+        if header:
+            if section == 'main':
+                main_end = len(out)
+            section = header.group(1).strip()
+        elif section == 'main':
+            option = re.match(r'^\s*([A-Za-z0-9_.]+)\s*=', line)
+            if option and option.group(1) in settings:
+                if option.group(1) in pending:
+                    out.append(f"{option.group(1)}={pending.pop(option.group(1))}\n")
+                continue
+        out.append(line if line.endswith('\n') else line + '\n')
+    if section == 'main' and main_end is None:
+        main_end = len(out)
+
+    added = [f"{key}={value}\n" for key, value in pending.items()]
+    if main_end is None:
+        return ''.join(['[main]\n', *added, *out])
+    # Keep new options above any blank lines that separate [main] from the next section
+    while main_end > 0 and not out[main_end - 1].strip():
+        main_end -= 1
+    return ''.join(out[:main_end] + added + out[main_end:])
+
+
+def write_system_file(path, text):
+    """Atomically replace a root-owned file, through sudo when not running as root
+
+    text may be bytes, to put a file back exactly as it was read.
+    """
+    path = Path(path)
+    data = text.encode() if isinstance(text, str) else text
+    if os.geteuid() == 0:
+        try:
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not write {path}: {e}")
+            return False
+        return True
+    script = 'cat > "$1.tmp" && chmod 0644 "$1.tmp" && mv "$1.tmp" "$1"'
+    return run(['sudo', 'sh', '-c', script, 'sh', str(path)], input=data).returncode == 0
+
+
+def remove_system_file(path):
+    if os.geteuid() == 0:
+        os.unlink(path)
+    else:
+        run(['sudo', 'rm', '-f', str(path)])
+
+
+def restore_interrupted(path=DNF_CONF):
+    """Put back the original dnf.conf when an earlier run died with its profile applied"""
+    backup = Path(f"{path}{BACKUP_SUFFIX}")
+    if backup.exists():
+        print(f"Restoring {path} left modified by an interrupted run...")
+        if write_system_file(path, backup.read_bytes()):
+            remove_system_file(backup)
+
+
+def cache_snapshot(roots):
+    """Size and mtime of every file under the dnf cache roots"""
+    snapshot = {}
+    for root in roots:
+        for directory, _, names in os.walk(root):
+            for name in names:
+                file_path = os.path.join(directory, name)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                snapshot[file_path] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+
+def downloaded_bytes(before, after):
+    """Bytes of cache files that appeared or were rewritten between two snapshots"""
+    return sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
+
+
+def dnf_seconds(since):
+    """Wall time spent in dnf commands started since a point in time"""
+    return sum(record.duration for record in list(tracer.commands)
+               if record.start >= since and 'dnf' in record.argv[:2])
+
+
+def print_download_report(downloaded, seconds):
+    mib = downloaded / 1024 ** 2
+    if seconds > 0:
+        print(f"dnf downloaded {mib:.1f} MiB in {seconds:.1f}s of dnf time ({mib / seconds:.1f} MiB/s)")
+    else:
+        print(f"dnf downloaded {mib:.1f} MiB")
+
+
+@contextmanager
+def dnf_profile(settings, path=DNF_CONF, keep=False, cache_dirs=DNF_CACHE_DIRS):
+    """Apply settings to dnf.conf for the block, then restore it and report download volume
+
+    The original file is backed up next to it while the profile is in
+    place, so a run that is killed is repaired by the next one. With
+    keep the profile stays configured after the block.
+    """
+    restore_interrupted(path)
+    # Bytes, so the restore does not translate line endings or re-encode
+    original = Path(path).read_bytes() if os.path.exists(path) else b''
+    profiled = render_profile(original.decode(errors='surrogateescape'), settings)
+    profiled = profiled.encode(errors='surrogateescape')
+    applied = False
+    if profiled != original:
+        if keep or write_system_file(f"{path}{BACKUP_SUFFIX}", original):
+            applied = write_system_file(path, profiled)
+        if applied:
+            print(f"Applied dnf performance profile: {', '.join(f'{k}={v}' for k, v in settings.items())}")
+        else:
+            print(f"Could not update {path}, continuing with the current dnf settings.")
+
+    roots = list(cache_dirs) + [v for k, v in settings.items() if k in ('cachedir', 'system_cachedir')]
+    before = cache_snapshot(roots)
+    started = time.time()
+    try:
+        yield
+    finally:
+        downloaded = downloaded_bytes(before, cache_snapshot(roots))
+        # dnf downloads for many steps at once, so the bytes count for the run
+        tracer.count_download(downloaded)
+        print_download_report(downloaded, dnf_seconds(started))
+        if applied and not keep:
+            if write_system_file(path, original):
+                remove_system_file(f"{path}{BACKUP_SUFFIX}")
+                print(f"Restored the original {path}.")
+        elif applied:
+            print(f"Kept the dnf performance profile in {path}.")
+
+
+def run_profile(mode, parallel_downloads=DEFAULT_PARALLEL_DOWNLOADS, cache_dir=None):
+    """Context manager for a script's --dnf-profile mode"""
+    if mode == 'off':
+        return nullcontext()
+    return dnf_profile(profile_settings(parallel_downloads, cache_dir), keep=mode == 'keep')
@@ -0,0 +1,196 @@
+"""Docker daemon.json merged with the settings the provisioning scripts manage"""
+
+import copy
+import json
+import os
+import shutil
+from pathlib import Path
+
+from provisioning.dnf_profile import write_system_file
+from provisioning.runner import run
+
+DAEMON_JSON = '/etc/docker/daemon.json'
+DEFAULT_DATA_ROOT = '/var/lib/docker'
+
+# Bounded json-file logs: without max-size a chatty container fills the data root
+LOG_MAX_SIZE = '20m'
+LOG_MAX_FILE = 5
+
+# Docker pulls 3 layers at a time by default, which leaves fast links idle
+MAX_CONCURRENT_DOWNLOADS = 10
+MAX_CONCURRENT_UPLOADS = 5
+
+# What dockerd uses for the keys above when daemon.json leaves them out
+DOCKER_DEFAULTS = {
+    'data-root': DEFAULT_DATA_ROOT,
+    'storage-driver': 'overlay2',
+    'log-driver': 'json-file',
+    'log-opts': {},
+    'max-concurrent-downloads': 3,
+    'max-concurrent-uploads': 5,
+    'live-restore': False,
+}
+
+NVIDIA_RUNTIME = 'nvidia'
+NVIDIA_RUNTIME_BINARY = 'nvidia-container-runtime'
+
+# Keys dockerd applies on SIGHUP; changing any other key takes a restart
+RELOADABLE_KEYS = {
+    'authorization-plugins', 'builder', 'debug', 'default-runtime', 'features', 'insecure-registries',
+    'labels', 'live-restore', 'max-concurrent-downloads', 'max-concurrent-uploads',
+    'max-download-attempts', 'registry-mirrors', 'runtimes', 'shutdown-timeout',
+}
+
+
+class DaemonConfigError(Exception):
+    """Raised when daemon.json cannot be parsed or written"""
+
+
+def managed_settings(data_root=None, nvidia=False):
+    """The daemon.json keys the scripts own
+
+    data_root is only set when given, so an existing data root is never
+    moved away from the images stored in it.
+    """
+    settings = {
+        'storage-driver': 'overlay2',
+        'log-driver': 'json-file',
+        'log-opts': {'max-size': LOG_MAX_SIZE, 'max-file': str(LOG_MAX_FILE)},
+        'max-concurrent-downloads': MAX_CONCURRENT_DOWNLOADS,
+        'max-concurrent-uploads': MAX_CONCURRENT_UPLOADS,
+        # Containers keep running while dockerd restarts
+        'live-restore': True,
+    }
+    if data_root:
+        settings['data-root'] = str(data_root)
+    if nvidia:
+        # The same entry nvidia-ctk runtime configure writes
+        settings['runtimes'] = {NVIDIA_RUNTIME: {'path': NVIDIA_RUNTIME_BINARY, 'args': []}}
+    return settings
+
+
+def merge_config(current, settings):
+    """daemon.json with the managed settings applied on top of the current one
+
+    Nested objects such as log-opts and runtimes are merged key by key, so
+    options and runtimes added by hand or by other tools are kept.
+    """
+    merged = copy.deepcopy(current)
+    for key, value in settings.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def effective_config(config):
+    """The configuration dockerd runs with, defaults filled in for the keys left out"""
+    return {**DOCKER_DEFAULTS, **config}
+
+
+def changed_keys(current, merged):
+    """Top-level keys whose effective value differs
+
+    Formatting, key order and spelling out a default do not count, so
+    they never cost a restart.
+    """
+    current, merged = effective_config(current), effective_config(merged)
+    return sorted(key for key in set(current) | set(merged) if current.get(key) != merged.get(key))
+
+
+def needs_restart(keys):
+    """Whether dockerd has to restart for the changed keys, rather than reload them"""
+    return any(key not in RELOADABLE_KEYS for key in keys)
+
+
+def render_config(config):
+    return json.dumps(config, indent=2, sort_keys=True) + '\n'
+
+
+class DockerDaemon:
+    """daemon.json of the local Docker daemon"""
+
+    def __init__(self, path=DAEMON_JSON):
+        self.path = Path(path)
+
+    def read(self):
+        """The current configuration, empty when there is no file yet"""
+        try:
+            text = self.path.read_text()
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            raise DaemonConfigError(f"Cannot read {self.path}: {e}") from e
+        if not text.strip():
+            return {}
+        try:
+            config = json.loads(text)
+        except ValueError as e:
+            # dockerd would not start with it either, so never overwrite what may be a half edit
+            raise DaemonConfigError(f"{self.path} is not valid JSON: {e}") from e
+        if not isinstance(config, dict):
+            raise DaemonConfigError(f"{self.path} does not hold a JSON object")
+        return config
+
+    def plan(self, settings):
+        """(current, merged, changed keys) of applying the settings"""
+        current = self.read()
+        merged = merge_config(current, settings)
+        return current, merged, changed_keys(current, merged)
+
+    def write(self, config):
+        if os.geteuid() == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            run(['sudo', 'mkdir', '-p', str(self.path.parent)])
+        if not write_system_file(self.path, render_config(config)):
+            raise DaemonConfigError(f"Could not write {self.path}")
+
+    def apply(self, settings):
+        """Write the merged configuration if it changed, then start, reload or restart Docker
+
+        A stopped daemon is always started. A running one is only restarted
+        when a changed key cannot be reloaded, and is left alone when
+        nothing changed in effect. Returns the changed keys.
+        """
+        current, merged, keys = self.plan(settings)
+        before, after = effective_config(current), effective_config(merged)
+        for key in keys:
+            print(f"daemon.json {key}: {json.dumps(before.get(key))} -> {json.dumps(after.get(key))}")
+        if 'storage-driver' in keys:
+            print(f"Images stored with the {before['storage-driver']} driver are not visible to "
+                  f"{after['storage-driver']}; pull or load them again.")
+        if merged == current:
+            print(f"{self.path} is up to date.")
+        else:
+            self.write(merged)
+
+        if not docker_active():
+            print("Starting Docker...")
+            run(['sudo', 'systemctl', 'start', 'docker'])
+        elif needs_restart(keys):
+            if after['live-restore'] and not before['live-restore']:
+                # live-restore has to be in effect before the restart to keep containers running
+                run(['sudo', 'systemctl', 'reload', 'docker'])
+            print("Restarting Docker to apply daemon.json...")
+            run(['sudo', 'systemctl', 'restart', 'docker'])
+        elif keys:
+            print("Reloading Docker to apply daemon.json...")
+            run(['sudo', 'systemctl', 'reload', 'docker'])
+        # Otherwise at most defaults were spelled out, which the running daemon already uses
+        return keys
+
+
+def docker_active():
+    """Whether the Docker daemon is running"""
+    return run(['systemctl', 'is-active', '--quiet', 'docker'], capture=True).returncode == 0
+
+
+def nvidia_runtime_installed():
+    """Whether the NVIDIA Container Toolkit's runtime is on PATH"""
+    return shutil.which(NVIDIA_RUNTIME_BINARY) is not None
+
+
+# Shared by every step of the current run
+docker_daemon = DockerDaemon()
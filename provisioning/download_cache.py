@@ -0,0 +1,202 @@
+"""Content-addressed cache for artifacts the provisioning steps download"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+from provisioning.runner import current_step, tracer
+
+DEFAULT_CACHE_DIR = '/var/cache/fedora-scripts/downloads'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    """Raised when an artifact can neither be downloaded nor served from the cache"""
+
+
+class DownloadCache:
+    """Artifacts keyed by URL, stored by SHA-256 and evicted least recently used first
+
+    Cached copies are revalidated with If-None-Match/If-Modified-Since, so
+    an unchanged artifact costs one small request. In offline mode only
+    cached copies are used and the network is never touched.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, offline=False, timeout=60):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._url_locks = {}
+        self._validated = set()
+
+    @property
+    def index_path(self):
+        return self.root / 'index.json'
+
+    def object_dir(self, digest):
+        return self.root / 'objects' / digest[:2] / digest
+
+    def artifact_path(self, entry):
+        """Cached file for an index entry, named like the URL so tools such as dnf recognize it"""
+        return self.object_dir(entry['sha256']) / entry['name']
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self, index):
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.index-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.index_path)
+
+    def _usable(self, entry, sha256):
+        """Whether a cached entry exists intact and matches the expected digest"""
+        if entry is None or 'name' not in entry or (sha256 and entry['sha256'] != sha256):
+            return False
+        path = self.artifact_path(entry)
+        return path.exists() and path.stat().st_size == entry['size']
+
+    def _touch(self, index, url):
+        index[url]['last_used'] = time.time()
+        self._save_index(index)
+        return self.artifact_path(index[url])
+
+    def _url_lock(self, url):
+        with self.lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def fetch(self, url, sha256=None, revalidate=True):
+        """Return a local path for url, downloading it only when needed
+
+        sha256 pins the expected content. Set revalidate to False for
+        versioned URLs whose content never changes. Different URLs
+        download concurrently, and a URL revalidated earlier in the run,
+        for example by a prefetch, is not revalidated again.
+        """
+        with self._url_lock(url):
+            with self.lock:
+                index = self._load_index()
+                entry = index.get(url)
+                cached = self._usable(entry, sha256)
+                if cached and (self.offline or not revalidate or url in self._validated):
+                    return self._touch(index, url)
+            if self.offline:
+                raise DownloadError(f"{url} is not cached and offline mode is enabled")
+
+            request = urllib.request.Request(url)
+            if cached and entry.get('etag'):
+                request.add_header('If-None-Match', entry['etag'])
+            if cached and entry.get('last_modified'):
+                request.add_header('If-Modified-Since', entry['last_modified'])
+
+            try:
+                response = urllib.request.urlopen(request, timeout=self.timeout)
+            except urllib.error.HTTPError as e:
+                if e.code == 304 and cached:
+                    return self._reuse(url, entry)
+                raise DownloadError(f"Downloading {url} failed: HTTP {e.code}") from e
+            except (urllib.error.URLError, OSError) as e:
+                if cached:
+                    print(f"Could not revalidate {url} ({e}), using the cached copy.")
+                    return self._reuse(url, entry)
+                raise DownloadError(f"Downloading {url} failed: {e}") from e
+
+            name = os.path.basename(urllib.parse.urlparse(url).path) or 'download'
+            with response:
+                digest, size = self._store(response, url, name)
+
+            with self.lock:
+                index = self._load_index()
+                if sha256 and digest != sha256:
+                    if all(e['sha256'] != digest for e in index.values()):
+                        shutil.rmtree(self.object_dir(digest))
+                    raise DownloadError(f"{url} has SHA-256 {digest}, expected {sha256}")
+
+                index[url] = {
+                    'sha256': digest,
+                    'name': name,
+                    'size': size,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'last_used': time.time(),
+                }
+                self._evict(index, keep=digest)
+                self._save_index(index)
+                self._validated.add(url)
+                return self.artifact_path(index[url])
+
+    def _reuse(self, url, entry):
+        """Keep using the cached copy of url for the rest of the run"""
+        with self.lock:
+            index = self._load_index()
+            index.setdefault(url, entry)
+            self._validated.add(url)
+            return self._touch(index, url)
+
+    def _store(self, response, url, name):
+        """Stream a response into the object store, returning its digest and size"""
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            target = self.object_dir(digest) / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        print(f"Downloaded {url} ({size} bytes).")
+        tracer.count_download(size, current_step())
+        return digest, size
+
+    def _evict(self, index, keep=None):
+        """Drop least recently used objects until the cache fits max_bytes"""
+        objects = {}
+        for url, entry in index.items():
+            obj = objects.setdefault(entry['sha256'], {'size': entry['size'], 'last_used': 0, 'urls': []})
+            obj['last_used'] = max(obj['last_used'], entry['last_used'])
+            obj['urls'].append(url)
+
+        total = sum(obj['size'] for obj in objects.values())
+        for digest, obj in sorted(objects.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            for url in obj['urls']:
+                del index[url]
+            shutil.rmtree(self.object_dir(digest), ignore_errors=True)
+            total -= obj['size']
+
+
+# Shared by every step of the current run
+downloads = DownloadCache()
@@ -0,0 +1,69 @@
+"""Install Flathub applications in a single flatpak transaction"""
+
+from provisioning.package_state import invalidate_installed_index, is_installed
+from provisioning.runner import run
+
+FLATHUB_URL = 'https://dl.flathub.org/repo/flathub.flatpakrepo'
+
+# flatpak only sideloads refs of remotes that have a collection ID
+FLATHUB_COLLECTION_ID = 'org.flathub.Stable'
+
+# Set once the remote has been confirmed for this run
+_flathub_ready = False
+
+# Local repositories, such as a LAN mirror's flatpak export, to pull from before the network
+_sideload_repos = []
+
+
+def ensure_flathub_repo():
+    """Ensure Flathub repository is added, checking the remotes once per run"""
+    global _flathub_ready
+    if _flathub_ready:
+        return
+    result = run(['flatpak', 'remotes', '--columns=name'], capture=True)
+    if 'flathub' not in result.stdout.decode().split():
+        print("Flathub repository not found. Adding Flathub repository...")
+        run(['flatpak', 'remote-add', '--if-not-exists', 'flathub', FLATHUB_URL])
+    else:
+        print("Flathub repository is already added, skipping...")
+    if _sideload_repos:
+        run(['flatpak', 'remote-modify', f'--collection-id={FLATHUB_COLLECTION_ID}', 'flathub'])
+    _flathub_ready = True
+
+
+def add_sideload_repo(path):
+    """Let installs pull apps and runtimes from a local repository written by flatpak create-usb"""
+    if str(path) not in _sideload_repos:
+        _sideload_repos.append(str(path))
+
+
+def sideload_options():
+    return [f'--sideload-repo={path}' for path in _sideload_repos]
+
+
+def missing_apps(apps):
+    """App IDs of a {app_id: display name} mapping that are not installed"""
+    missing = []
+    for app_id, name in apps.items():
+        if is_installed(app_id):
+            print(f"{name} is already installed, skipping...")
+        else:
+            missing.append(app_id)
+    return missing
+
+
+def install_flathub_apps(apps):
+    """Install the missing apps from a {app_id: display name} mapping together
+
+    Runtimes shared between the apps are resolved and pulled once.
+    Returns True when nothing was missing or the transaction succeeded.
+    """
+    missing = missing_apps(apps)
+    if not missing:
+        return True
+
+    ensure_flathub_repo()
+    print(f"Installing {', '.join(apps[app_id] for app_id in missing)} from Flathub...")
+    result = run(['flatpak', 'install', '-y', '--noninteractive', *sideload_options(), 'flathub', *missing])
+    invalidate_installed_index()
+    return result.returncode == 0
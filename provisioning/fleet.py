@@ -0,0 +1,225 @@
+"""Run a provisioning script on many hosts through pluggable transports"""
+
+import io
+import json
+import os
+import shlex
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+
+from provisioning.runner import run
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Every run creates its own private directory under this one on the target
+DEFAULT_REMOTE_DIR = '/tmp'
+SUMMARY_NAME = 'summary.json'
+
+# Seconds an idle multiplexed SSH connection stays open for the next command
+CONTROL_PERSIST = 120
+
+
+class FleetError(Exception):
+    """Raised when a host cannot be reached or the scripts cannot be copied to it"""
+
+
+class Transport:
+    """How commands reach one target
+
+    Subclasses turn a command for the target into a local argv. Copying
+    files is built on top of that, so a transport only has to know how
+    to run a command.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    @property
+    def name(self):
+        return self.target
+
+    def argv(self, command):
+        raise NotImplementedError
+
+    def open(self):
+        """Prepare the connection before the first command"""
+
+    def close(self):
+        """Release the connection after the last command"""
+
+    def run(self, command, capture=False, input=None):
+        return run(self.argv(command), capture=capture, input=input)
+
+    def push(self, files, parent):
+        """Copy files, given relative to the repository, to a new directory under parent on the target
+
+        Returns the directory. mktemp creates it with mode 0700, so even
+        under a shared parent such as /tmp nobody else on the target can
+        plant modules next to the script or a link in place of its summary.
+        """
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for name in files:
+                tar.add(REPO_DIR / name, arcname=name)
+        script = ('mkdir -p "$1" && dir=$(mktemp -d "$1/fedora-scripts.XXXXXXXX") '
+                  '&& tar -x -f - -C "$dir" && echo "$dir"')
+        result = self.run(['sh', '-c', script, 'sh', parent], capture=True, input=archive.getvalue())
+        workdir = result.stdout.decode().strip()
+        if result.returncode != 0 or not workdir.startswith('/'):
+            raise FleetError(f"Could not copy the scripts to {parent} on {self.name}: "
+                             f"{result.stderr.decode().strip()}")
+        return workdir
+
+
+class LocalTransport(Transport):
+    """Runs on this machine, to test a fleet run without a network
+
+    Every target still gets its own private directory, made by mktemp
+    under the remote directory, so targets running at once do not share
+    scripts or summaries.
+    """
+
+    def argv(self, command):
+        return list(command)
+
+
+class ChrootTransport(Transport):
+    """Runs inside the directory tree of the target, for example a mounted disk image"""
+
+    def argv(self, command):
+        argv = ['chroot', self.target, *command]
+        return argv if os.geteuid() == 0 else ['sudo', *argv]
+
+
+class SshTransport(Transport):
+    """Runs over SSH, sharing one multiplexed connection per host for every command"""
+
+    def __init__(self, target, control_dir, options=()):
+        super().__init__(target)
+        self.control_dir = control_dir
+        self.options = list(options)
+
+    def ssh_argv(self, *args):
+        host, port = self.target, None
+        if ':' in host and not host.startswith('['):
+            host, port = host.rsplit(':', 1)
+        argv = ['ssh', '-o', 'BatchMode=yes', '-o', 'ControlMaster=auto',
+                '-o', f"ControlPath={self.control_dir}/%C", '-o', f"ControlPersist={CONTROL_PERSIST}",
+                *self.options]
+        if port:
+            argv += ['-p', port]
+        return argv + [*args, host]
+
+    def argv(self, command):
+        return [*self.ssh_argv(), '--', shlex.join(command)]
+
+    def open(self):
+        if run([*self.ssh_argv(), 'true']).returncode != 0:
+            raise FleetError(f"Could not connect to {self.target}")
+
+    def close(self):
+        run(self.ssh_argv('-O', 'exit'), capture=True)
+
+
+def make_transports(kind, targets, ssh_options=()):
+    """Transports for the targets and the control directory to remove afterwards, if any"""
+    if kind == 'local':
+        return [LocalTransport(t) for t in targets], None
+    if kind == 'chroot':
+        return [ChrootTransport(t) for t in targets], None
+    # Socket paths are limited to about 100 bytes, so keep the directory short
+    control_dir = tempfile.mkdtemp(prefix='fleet-', dir='/tmp')
+    return [SshTransport(t, control_dir, ssh_options) for t in targets], control_dir
+
+
+def remove_control_dir(control_dir):
+    if control_dir:
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+def script_files(script):
+    """The script and the provisioning package it imports, relative to the repository"""
+    package = REPO_DIR / 'provisioning'
+    return [script, *sorted(str(p.relative_to(REPO_DIR)) for p in package.glob('*.py'))]
+
+
+def read_inventory(path):
+    """Targets listed one per line, ignoring blank lines and # comments"""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                targets.append(line)
+    return targets
+
+
+def provision(transport, script, script_args, remote_dir, sudo=False, python='python3'):
+    """Copy the scripts to the target, run script there and return its step summary
+
+    Returns (succeeded, summary); summary is None when the script did
+    not get far enough to write one. The scripts are copied to a new
+    directory under remote_dir, which is removed afterwards.
+    """
+    sudo_argv = ['sudo', '-n'] if sudo else []
+    transport.open()
+    try:
+        workdir = transport.push(script_files(script), remote_dir)
+        try:
+            summary_path = f"{workdir}/{SUMMARY_NAME}"
+            result = transport.run([*sudo_argv, python, f"{workdir}/{script}", *script_args,
+                                    '--summary-json', summary_path])
+            fetched = transport.run(['cat', summary_path], capture=True)
+        finally:
+            # The script leaves root-owned files behind when it ran through sudo
+            transport.run([*sudo_argv, 'rm', '-rf', workdir], capture=True)
+    finally:
+        transport.close()
+
+    summary = None
+    if fetched.returncode == 0:
+        try:
+            summary = json.loads(fetched.stdout)
+        except ValueError:
+            pass
+    return result.returncode == 0, summary
+
+
+def host_report(name, status, duration, summary):
+    """One host's line of the aggregate report"""
+    steps = summary['steps'] if summary else []
+    by_status = {}
+    for record in steps:
+        by_status.setdefault(record['status'], []).append(record['name'])
+    return {
+        'host': name,
+        'status': status,
+        'duration': duration,
+        'steps': len(steps),
+        'failed': by_status.get('failed', []),
+        'skipped': by_status.get('skipped', []),
+        'unchanged': len(by_status.get('journal', [])),
+    }
+
+
+def print_report(reports):
+    """Table of per-host outcomes, slowest host first, and the failed and skipped steps"""
+    print(f"\n{'host':<32} {'status':<8} {'time':>9} {'steps':>6} {'failed':>7} {'skipped':>8} {'unchanged':>10}")
+    for report in sorted(reports, key=lambda r: r['duration'], reverse=True):
+        print(f"{report['host']:<32} {report['status']:<8} {report['duration']:>8.1f}s {report['steps']:>6} "
+              f"{len(report['failed']):>7} {len(report['skipped']):>8} {report['unchanged']:>10}")
+    for report in reports:
+        if report['failed'] or report['skipped']:
+            print(f"\n{report['host']}:")
+            if report['failed']:
+                print(f"  failed:  {', '.join(report['failed'])}")
+            if report['skipped']:
+                print(f"  skipped: {', '.join(report['skipped'])}")
+
+    failed = sum(1 for r in reports if r['status'] != 'done')
+    durations = sorted(r['duration'] for r in reports)
+    if durations:
+        print(f"\n{len(reports) - failed}/{len(reports)} hosts succeeded, "
+              f"median {durations[len(durations) // 2]:.1f}s, slowest {durations[-1]:.1f}s")
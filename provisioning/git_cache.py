@@ -0,0 +1,145 @@
+"""Bare git mirrors shared by every checkout the provisioning steps make"""
+
+import os
+import re
+import threading
+import urllib.parse
+from pathlib import Path
+
+from provisioning.runner import run
+
+SYSTEM_MIRROR_DIR = '/var/cache/fedora-scripts/git'
+
+ALL_REFS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+
+class GitCacheError(Exception):
+    """Raised when a mirror cannot be updated or a checkout cannot be made from it"""
+
+
+def default_mirror_dir():
+    """System-wide mirrors when running as root, otherwise ones in the user's cache directory"""
+    if os.geteuid() == 0:
+        return Path(SYSTEM_MIRROR_DIR)
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'fedora-scripts' / 'git'
+
+
+class GitMirrorCache:
+    """One bare mirror per upstream URL, which checkouts borrow objects from
+
+    Checkouts are linked to their mirror through objects/info/alternates
+    and fetch from it, so updating a checkout moves no objects at all and
+    updating a mirror moves only what upstream gained since the last
+    run. Mirrors only ever gain refs, never prune them, so objects a
+    checkout relies on are not garbage collected out from under it.
+    """
+
+    def __init__(self, root=None, offline=False):
+        self.root = Path(root) if root else default_mirror_dir()
+        self.offline = offline
+        self.lock = threading.Lock()
+        self._locks = {}
+        self._fetched = set()
+
+    def mirror_path(self, url):
+        """Readable, collision-free directory name for an upstream URL"""
+        parsed = urllib.parse.urlparse(url)
+        name = f"{parsed.netloc}{parsed.path}" if parsed.netloc else parsed.path
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', name.strip('/'))
+        if not name.endswith('.git'):
+            name += '.git'
+        return self.root / name
+
+    def _git(self, repo, *args, user=None, capture=False, trusted=None):
+        """Run git in repo, as user when given, trusting a mirror owned by someone else"""
+        argv = ['git', '-C', str(repo), *args]
+        if trusted:
+            argv[1:1] = ['-c', f"safe.directory={trusted}"]
+        if user:
+            argv = ['sudo', '-u', user, *argv]
+        return run(argv, capture=capture)
+
+    def _has_ref(self, repo, ref):
+        return self._git(repo, 'rev-parse', '--verify', '--quiet', f"{ref}^{{commit}}", capture=True).returncode == 0
+
+    def update(self, url, ref=None, depth=None, immutable=False):
+        """Bring the mirror of url up to date and return its path
+
+        Only ref is fetched when given, otherwise every branch and tag.
+        An immutable ref, such as a pinned release tag, is fetched once
+        and never again. Each mirror is fetched at most once per run.
+        """
+        mirror = self.mirror_path(url)
+        with self.lock:
+            lock = self._locks.setdefault(mirror, threading.Lock())
+        with lock:
+            if not (mirror / 'HEAD').exists():
+                mirror.parent.mkdir(parents=True, exist_ok=True)
+                if run(['git', 'init', '--quiet', '--bare', str(mirror)]).returncode != 0:
+                    raise GitCacheError(f"Could not create a git mirror at {mirror}")
+
+            key = (mirror, ref)
+            if key in self._fetched or (ref and immutable and self._has_ref(mirror, ref)):
+                return mirror
+            if self.offline:
+                if ref and not self._has_ref(mirror, ref):
+                    raise GitCacheError(f"{ref} of {url} is not in the git cache and offline mode is on")
+                return mirror
+
+            print(f"Updating git mirror of {url}...")
+            refspecs = [f"+{ref}:{ref}"] if ref else ALL_REFS
+            depth_args = [f"--depth={depth}"] if depth else []
+            if self._git(mirror, 'fetch', '--quiet', '--no-tags', *depth_args, url, *refspecs).returncode != 0:
+                if not (ref and self._has_ref(mirror, ref)):
+                    raise GitCacheError(f"Could not fetch {url}")
+                print(f"Could not reach {url}, using the cached mirror.")
+            self._fetched.add(key)
+            return mirror
+
+    def checkout(self, url, dest, ref, depth=None, immutable=False, user=None):
+        """Create or update a working tree of ref at dest, borrowing objects from the mirror
+
+        A branch ref (refs/heads/...) is checked out as that local branch
+        and a tag is checked out detached. origin keeps pointing at url.
+        """
+        mirror = self.update(url, ref, depth, immutable)
+        dest = Path(dest)
+        if not (dest / '.git').exists():
+            print(f"Creating checkout of {url} at {dest}...")
+            args = ['sudo', '-u', user] if user else []
+            if run([*args, 'git', 'init', '--quiet', str(dest)]).returncode != 0:
+                raise GitCacheError(f"Could not create a git repository at {dest}")
+        else:
+            print(f"Updating existing checkout at {dest}...")
+
+        alternates = dest / '.git' / 'objects' / 'info' / 'alternates'
+        objects = str(mirror / 'objects')
+        if not alternates.exists() or objects not in alternates.read_text().split():
+            with open(alternates, 'a') as f:
+                f.write(objects + '\n')
+            if os.geteuid() == 0:
+                owner = (dest / '.git').stat()
+                os.chown(alternates, owner.st_uid, owner.st_gid)
+
+        if self._git(dest, 'remote', 'get-url', 'origin', user=user, capture=True).returncode == 0:
+            self._git(dest, 'remote', 'set-url', 'origin', url, user=user)
+        else:
+            self._git(dest, 'remote', 'add', 'origin', url, user=user)
+
+        # Every object is already reachable through the alternates, so this only copies refs
+        depth_args = [f"--depth={depth}"] if depth else []
+        if self._git(dest, 'fetch', '--quiet', '--no-tags', '--update-head-ok', *depth_args,
+                     f"file://{mirror}", f"+{ref}:{ref}", user=user, trusted=mirror).returncode != 0:
+            raise GitCacheError(f"Could not fetch {ref} from the mirror of {url}")
+
+        if ref.startswith('refs/heads/'):
+            branch = ref[len('refs/heads/'):]
+            result = self._git(dest, 'checkout', '--quiet', '--force', '-B', branch, ref, user=user)
+        else:
+            result = self._git(dest, 'checkout', '--quiet', '--force', '--detach', ref, user=user)
+        if result.returncode != 0:
+            raise GitCacheError(f"Could not check out {ref} at {dest}")
+        return dest
+
+
+git_mirrors = GitMirrorCache()
@@ -0,0 +1,164 @@
+"""Facts about the host and the invoking user, gathered in-process on first use"""
+
+import grp
+import json
+import os
+import pwd
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from provisioning.runner import run
+
+OS_RELEASE_PATHS = ['/etc/os-release', '/usr/lib/os-release']
+
+# Facts that only change with an OS upgrade or a reboot into another kernel
+PERSISTENT_FACTS = {'os_release', 'uname'}
+
+
+def parse_os_release(text):
+    """Key/value pairs of an os-release file, with shell quoting removed"""
+    facts = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        facts[key] = value
+    return facts
+
+
+class HostFacts:
+    """Lazily gathered facts, memoized for the run and optionally persisted with a TTL
+
+    Nothing is probed until a fact is first read, so importing a script
+    costs nothing and works without a controlling terminal. Facts in
+    PERSISTENT_FACTS are written to cache_path when ttl is set and reused
+    by later runs until they are older than ttl seconds.
+    """
+
+    def __init__(self, cache_path=None, ttl=0):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._facts = {}
+        self._loaded = False
+
+    def _load(self):
+        self._loaded = True
+        if not (self.cache_path and self.ttl):
+            return
+        try:
+            with open(self.cache_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for name, entry in saved.items():
+            if name in PERSISTENT_FACTS and name not in self._facts and now - entry['time'] < self.ttl:
+                self._facts[name] = entry['value']
+
+    def _save(self):
+        if not (self.cache_path and self.ttl):
+            return
+        path = Path(self.cache_path)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.facts-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({name: {'value': self._facts[name], 'time': time.time()}
+                           for name in PERSISTENT_FACTS if name in self._facts}, f, indent=2)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not save host facts to {path}: {e}")
+
+    def _get(self, name, probe):
+        with self.lock:
+            if not self._loaded:
+                self._load()
+            if name not in self._facts:
+                self._facts[name] = probe()
+                if name in PERSISTENT_FACTS:
+                    self._save()
+            return self._facts[name]
+
+    def override(self, **facts):
+        """Pin facts to fixed values, for example the user's home directory in a sandbox"""
+        with self.lock:
+            self._facts.update(facts)
+
+    def invalidate(self, *names):
+        """Forget facts a step has just changed so they are gathered again"""
+        with self.lock:
+            for name in names:
+                self._facts.pop(name, None)
+
+    @property
+    def user(self):
+        """The user who invoked the script, also when it runs under sudo"""
+        def probe():
+            for variable in ('SUDO_USER', 'DOAS_USER'):
+                name = os.environ.get(variable)
+                if name and name != 'root':
+                    return name
+            return pwd.getpwuid(os.getuid()).pw_name
+        return self._get('user', probe)
+
+    @property
+    def home(self):
+        return self._get('home', lambda: pwd.getpwnam(self.user).pw_dir)
+
+    @property
+    def os_release(self):
+        def probe():
+            for path in OS_RELEASE_PATHS:
+                try:
+                    with open(path) as f:
+                        return parse_os_release(f.read())
+                except OSError:
+                    continue
+            return {}
+        return self._get('os_release', probe)
+
+    @property
+    def fedora_release(self):
+        """Fedora release number as a string, like rpm -E %fedora prints it"""
+        def probe():
+            release = self.os_release
+            if release.get('ID') == 'fedora' and release.get('VERSION_ID'):
+                return release['VERSION_ID']
+            return run(['rpm', '-E', '%fedora'], capture=True).stdout.decode().strip()
+        return self._get('fedora_release', probe)
+
+    @property
+    def uname(self):
+        return self._get('uname', lambda: list(os.uname()))
+
+    @property
+    def system(self):
+        """Kernel name, like uname -s prints it"""
+        return self.uname[0]
+
+    @property
+    def machine(self):
+        """Hardware name, like uname -m prints it"""
+        return self.uname[4]
+
+    def groups(self, user=None):
+        """Names of the groups a user belongs to, including the primary group"""
+        user = user or self.user
+
+        def probe():
+            primary = grp.getgrgid(pwd.getpwnam(user).pw_gid).gr_name
+            return sorted({primary} | {g.gr_name for g in grp.getgrall() if user in g.gr_mem})
+        return self._get(f"groups:{user}", probe)
+
+    def unit_active(self, unit):
+        """Whether a systemd unit is active right now; never memoized"""
+        return run(['systemctl', 'is-active', '--quiet', unit]).returncode == 0
+
+
+host = HostFacts()
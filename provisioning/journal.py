@@ -0,0 +1,82 @@
+"""On-disk journal of completed steps and the fingerprints of their inputs"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SYSTEM_JOURNAL_DIR = '/var/lib/fedora-scripts'
+
+# rpmdb.sqlite plus its -wal/-shm files, before and after the Fedora 42 move
+RPMDB_GLOBS = ['/var/lib/rpm/rpmdb.sqlite*', '/usr/lib/sysimage/rpm/rpmdb.sqlite*']
+
+
+def default_journal_path(name):
+    """System-wide journal when running as root, otherwise one in the user's state directory"""
+    if os.geteuid() == 0:
+        base = Path(SYSTEM_JOURNAL_DIR)
+    else:
+        base = Path(os.environ.get('XDG_STATE_HOME', Path.home() / '.local' / 'state')) / 'fedora-scripts'
+    return base / f"{name}.json"
+
+
+def path_state(path):
+    """Cheap identity of a file or directory: existence, size, mtime and ctime"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [str(path), None]
+    return [str(path), st.st_size, st.st_mtime_ns, st.st_ctime_ns]
+
+
+def rpmdb_state():
+    """Identity of the RPM database, which changes with every transaction"""
+    return [path_state(path) for pattern in RPMDB_GLOBS for path in sorted(glob.glob(pattern))]
+
+
+def fingerprint(data):
+    """Stable SHA-256 of JSON-serializable fingerprint data"""
+    encoded = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class StepJournal:
+    """Completed steps with the fingerprint their inputs had when they finished
+
+    Entries are written as soon as a step completes, so a run interrupted
+    by a crash or Ctrl-C resumes at the first step that did not finish.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def is_current(self, name, digest):
+        entry = self.entries.get(name)
+        return entry is not None and entry['fingerprint'] == digest
+
+    def record(self, name, digest):
+        with self.lock:
+            self.entries[name] = {'fingerprint': digest, 'completed': time.time()}
+            self._save()
+
+    def forget(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.journal-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
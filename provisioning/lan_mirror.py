@@ -0,0 +1,308 @@
+"""LAN mirror of every package, repository file and artifact the provisioning scripts download
+
+A mirror directory holds:
+
+    rpms/         the full dependency closure of the RPM set, with createrepo metadata
+    files/        upstream artifacts (release RPMs, .repo files, signing keys, binaries)
+    flatpak/      the Flathub apps and runtimes, as written by flatpak create-usb
+    mirror.json   which upstream URL each file replaces, and the repository's signing keys
+
+Serve it over HTTP or mount it, then pass its URL or path to --mirror.
+"""
+
+import configparser
+import glob
+import json
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from provisioning.dnf_profile import write_system_file
+from provisioning.flatpak_batch import FLATHUB_COLLECTION_ID, add_sideload_repo
+from provisioning.repo_metadata import metadata
+from provisioning.runner import run
+
+MIRROR_REPO_ID = 'fedora-scripts-mirror'
+MIRROR_REPO_FILE = f'/etc/yum.repos.d/{MIRROR_REPO_ID}.repo'
+
+RPM_DIR = 'rpms'
+FILES_DIR = 'files'
+FLATPAK_DIR = 'flatpak'
+INDEX_NAME = 'mirror.json'
+
+# Where flatpak create-usb puts the repository inside its destination
+SIDELOAD_REPO = '.ostree/repo'
+
+GROUP_SECTION = re.compile(r'^\s*(Mandatory|Default|Optional|Conditional) [Pp]ackages\s*:\s*(\S*)')
+
+
+class MirrorError(Exception):
+    """Raised when the mirror cannot be built or read"""
+
+
+def group_packages(text):
+    """Mandatory and default packages listed by dnf group info, for dnf4 and dnf5 output"""
+    packages = []
+    section = None
+    for line in text.splitlines():
+        match = GROUP_SECTION.match(line)
+        if match:
+            section = match.group(1)
+            name = match.group(2)
+        elif section and re.match(r'^\s+:\s*\S', line):
+            # dnf5 continues a section with aligned ': name' lines
+            name = line.split(':', 1)[1].strip()
+        elif section and re.match(r'^\s{2,}\S+\s*$', line):
+            name = line.strip()
+        else:
+            section = None
+            continue
+        if section in ('Mandatory', 'Default') and name:
+            packages.append(name.split()[0])
+    return packages
+
+
+def comps_xml(groups):
+    """comps.xml defining groups, a {name: [packages]} mapping, so dnf group install works on the mirror"""
+    entries = []
+    for name, packages in groups.items():
+        group_id = re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+        requires = ''.join(f'      <packagereq type="mandatory">{escape(p)}</packagereq>\n' for p in packages)
+        entries.append(f'  <group>\n    <id>{group_id}</id>\n    <name>{escape(name)}</name>\n'
+                       f'    <description>{escape(name)}</description>\n    <default>false</default>\n'
+                       f'    <uservisible>true</uservisible>\n    <packagelist>\n{requires}    </packagelist>\n'
+                       f'  </group>\n')
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE comps PUBLIC "-//Red Hat, Inc.//DTD Comps info//EN" "comps.dtd">\n'
+            '<comps>\n' + ''.join(entries) + '</comps>\n')
+
+
+def extract_release_rpm(rpm_path, reposdir, keydir):
+    """Copy the .repo files and signing keys a release RPM would install"""
+    with tempfile.TemporaryDirectory(prefix='release-rpm-') as tmp:
+        # Release RPMs are a few kilobytes, so the archive is passed along in memory
+        archive = run(['rpm2cpio', str(rpm_path)], capture=True)
+        result = run(['cpio', '-idm', '--quiet', '-D', tmp], capture=True, input=archive.stdout)
+        if archive.returncode != 0 or result.returncode != 0:
+            raise MirrorError(f"Could not unpack {rpm_path}")
+        for repo_file in glob.glob(os.path.join(tmp, 'etc', 'yum.repos.d', '*.repo')):
+            shutil.copy(repo_file, reposdir)
+        for key in glob.glob(os.path.join(tmp, 'etc', 'pki', 'rpm-gpg', '*')):
+            shutil.copy(key, keydir)
+
+
+def repo_gpgkeys(reposdir, variables):
+    """gpgkey URLs of every repository defined in reposdir, with $variables expanded"""
+    keys = []
+    for repo_file in sorted(glob.glob(os.path.join(reposdir, '*.repo'))):
+        parser = configparser.RawConfigParser()
+        try:
+            parser.read(repo_file)
+        except configparser.Error as e:
+            print(f"Skipping {repo_file}: {e}")
+            continue
+        for section in parser.sections():
+            for url in re.split(r'[\s,]+', parser.get(section, 'gpgkey', fallback='')):
+                for name, value in variables.items():
+                    url = url.replace(f"${name}", value)
+                if url and url not in keys:
+                    keys.append(url)
+    return keys
+
+
+def required_capabilities(text):
+    """Capabilities from rpm --requires output, without versions or the rpmlib features rpm itself provides"""
+    capabilities = []
+    for line in text.splitlines():
+        capability = line.split(' ', 1)[0].strip()
+        if capability and not capability.startswith('rpmlib(') and capability not in capabilities:
+            capabilities.append(capability)
+    return capabilities
+
+
+class MirrorBuilder:
+    """Downloads everything the scripts install into a mirror directory
+
+    Resolution runs against a private copy of the system's repository
+    definitions plus the ones the scripts add, so the machine building
+    the mirror does not need those repositories configured.
+    """
+
+    def __init__(self, root, cache, releasever, basearch):
+        self.root = Path(root)
+        self.cache = cache
+        self.releasever = releasever
+        self.basearch = basearch
+        self.files = {}
+        self.gpgkeys = []
+        self.keydir = Path(tempfile.mkdtemp(prefix='mirror-keys-'))
+
+    @property
+    def rpm_dir(self):
+        return self.root / RPM_DIR
+
+    @property
+    def files_dir(self):
+        return self.root / FILES_DIR
+
+    def _store(self, url, path):
+        name = os.path.basename(urllib.parse.urlparse(url).path) or 'download'
+        if name in self.files.values():
+            name = f"{len(self.files)}-{name}"
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, self.files_dir / name)
+        self.files[url] = name
+        return self.files_dir / name
+
+    def add_file(self, url):
+        """Download an upstream artifact into files/ and record which URL it replaces"""
+        if url in self.files:
+            return self.files_dir / self.files[url]
+        return self._store(url, self.cache.fetch(url))
+
+    def add_gpgkeys(self, reposdir):
+        """Mirror the signing key of every repository, so the mirror is checked against the same keys"""
+        for url in repo_gpgkeys(reposdir, {'releasever': self.releasever, 'basearch': self.basearch}):
+            parsed = urllib.parse.urlparse(url)
+            if parsed.scheme == 'file':
+                # Keys shipped by a release RPM are not installed on this machine yet
+                candidates = [self.keydir / os.path.basename(parsed.path), Path(parsed.path)]
+                path = next((c for c in candidates if c.is_file()), None)
+                if path is None:
+                    print(f"Signing key {url} is not available here, skipping it.")
+                    continue
+                self.files.pop(url, None)
+                self._store(url, path)
+            else:
+                self.add_file(url)
+            self.gpgkeys.append(self.files[url])
+
+    def write_index(self):
+        index = {'files': self.files, 'gpgkeys': self.gpgkeys}
+        (self.root / INDEX_NAME).write_text(json.dumps(index, indent=2, sort_keys=True))
+
+    def reposdir(self, repo_file_urls, release_rpm_urls, system_dir='/etc/yum.repos.d'):
+        """Private repository directory with the system repositories and every one the scripts add"""
+        reposdir = Path(tempfile.mkdtemp(prefix='mirror-repos-'))
+        for repo_file in glob.glob(os.path.join(system_dir, '*.repo')):
+            if os.path.basename(repo_file) != f"{MIRROR_REPO_ID}.repo":
+                shutil.copy(repo_file, reposdir)
+        for url in repo_file_urls:
+            shutil.copy(self.add_file(url), reposdir)
+        for url in release_rpm_urls:
+            extract_release_rpm(self.add_file(url), reposdir, self.keydir)
+        return reposdir
+
+    def dnf_options(self, reposdir):
+        return [f'--setopt=reposdir={reposdir}', f'--releasever={self.releasever}']
+
+    def group(self, name, reposdir):
+        """Packages dnf installs for a group"""
+        result = run(['dnf', 'group', 'info', *self.dnf_options(reposdir), name], capture=True)
+        packages = group_packages(result.stdout.decode())
+        if result.returncode != 0 or not packages:
+            raise MirrorError(f"Could not list the packages of the group {name}")
+        return packages
+
+    def rpm_requirements(self, rpm_path, reposdir):
+        """Names of the repository packages that provide what a downloaded RPM requires
+
+        dnf only resolves the closure of packages it finds in a repository,
+        so an RPM installed from a URL brings its dependencies in this way.
+        """
+        result = run(['rpm', '-q', '--package', '--requires', str(rpm_path)], capture=True)
+        if result.returncode != 0:
+            raise MirrorError(f"Could not read the requirements of {rpm_path}: "
+                              f"{result.stderr.decode(errors='replace').strip()}")
+        capabilities = required_capabilities(result.stdout.decode())
+        if not capabilities:
+            return []
+        result = run(['dnf', 'repoquery', '--quiet', *self.dnf_options(reposdir),
+                      f"--arch={self.basearch},noarch", f"--whatprovides={','.join(capabilities)}",
+                      '--queryformat=%{name}\\n'], capture=True)
+        if result.returncode != 0:
+            raise MirrorError(f"Could not resolve the requirements of {rpm_path}")
+        return sorted({line.strip() for line in result.stdout.decode().splitlines() if line.strip()})
+
+    def download_packages(self, packages, reposdir):
+        """Download the packages and their full dependency closure, installed or not"""
+        self.rpm_dir.mkdir(parents=True, exist_ok=True)
+        print(f"Resolving and downloading {len(packages)} packages and their dependencies...")
+        result = run(['dnf', 'download', '--resolve', '--alldeps', *self.dnf_options(reposdir),
+                      f'--destdir={self.rpm_dir}', *packages])
+        if result.returncode != 0:
+            raise MirrorError("dnf could not download the package set")
+
+    def write_metadata(self, groups):
+        """Generate the repository metadata, with comps for the groups"""
+        comps = self.root / 'comps.xml'
+        comps.write_text(comps_xml(groups))
+        if run(['createrepo_c', '--quiet', '--update', '--groupfile', str(comps), str(self.rpm_dir)]).returncode != 0:
+            raise MirrorError(f"createrepo_c failed for {self.rpm_dir}")
+
+    def export_flatpaks(self, app_ids):
+        """Copy the installed apps and their runtimes into a repository other machines can sideload from"""
+        dest = self.root / FLATPAK_DIR
+        dest.mkdir(parents=True, exist_ok=True)
+        # create-usb only exports refs of remotes that have a collection ID
+        run(['flatpak', 'remote-modify', f'--collection-id={FLATHUB_COLLECTION_ID}', 'flathub'])
+        if run(['flatpak', 'create-usb', '--allow-partial', str(dest), *app_ids]).returncode != 0:
+            raise MirrorError(f"flatpak create-usb could not export {', '.join(app_ids)}")
+
+
+class LanMirror:
+    """A mirror as seen by the provisioning scripts, at a local path or an HTTP(S) URL"""
+
+    def __init__(self, location):
+        parsed = urllib.parse.urlparse(location)
+        if parsed.scheme in ('http', 'https', 'file'):
+            self.base_url = location.rstrip('/')
+            self.path = Path(parsed.path) if parsed.scheme == 'file' else None
+        else:
+            self.path = Path(location).resolve()
+            self.base_url = self.path.as_uri()
+        self._index = None
+
+    def url_of(self, name):
+        return f"{self.base_url}/{name}"
+
+    @property
+    def index(self):
+        """The mirror's mirror.json: mirrored files by upstream URL, and its signing keys"""
+        if self._index is None:
+            try:
+                with urllib.request.urlopen(self.url_of(INDEX_NAME), timeout=30) as response:
+                    self._index = json.load(response)
+            except (OSError, ValueError) as e:
+                raise MirrorError(f"Could not read the mirror index at {self.base_url}: {e}") from e
+        return self._index
+
+    def url(self, upstream):
+        """The mirror's copy of an upstream artifact, or the upstream URL if it is not mirrored"""
+        name = self.index['files'].get(upstream)
+        return self.url_of(f"{FILES_DIR}/{name}") if name else upstream
+
+    def repo_text(self):
+        """Repository definition for the mirror, checking packages against the mirrored upstream keys"""
+        keys = ' '.join(self.url_of(f"{FILES_DIR}/{name}") for name in self.index['gpgkeys'])
+        return (f"[{MIRROR_REPO_ID}]\nname=fedora-scripts LAN mirror\nbaseurl={self.url_of(RPM_DIR)}\n"
+                f"enabled=0\ngpgcheck=1\ngpgkey={keys}\nmetadata_expire=1h\n")
+
+    def enable(self):
+        """Install and resolve only from the mirror for the rest of the run
+
+        The repository is written disabled, so once the run is over the
+        machine updates from the upstream repositories as usual.
+        """
+        print(f"Using the LAN mirror at {self.base_url}")
+        self.index
+        if not write_system_file(MIRROR_REPO_FILE, self.repo_text()):
+            raise MirrorError(f"Could not write {MIRROR_REPO_FILE}")
+        metadata.restrict([MIRROR_REPO_ID])
+        if self.path and (self.path / FLATPAK_DIR / SIDELOAD_REPO).is_dir():
+            add_sideload_repo(self.path / FLATPAK_DIR / SIDELOAD_REPO)
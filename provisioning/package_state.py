@@ -0,0 +1,117 @@
+"""Installed-state index shared by the provisioning scripts"""
+
+import threading
+
+from provisioning.runner import run
+
+# Ways to read the RPM database, tried in order: the rpm and libdnf5 Python
+# bindings read it in-process, rpm-cli dumps it with one rpm -qa
+BACKENDS = ['rpm', 'libdnf5', 'rpm-cli']
+
+# Populated on first lookup and dropped again after every install step
+_index = None
+_index_lock = threading.Lock()
+
+
+class InstalledIndex:
+    """Exact-match sets of installed RPMs and Flatpak application IDs
+
+    RPMs match by name or by name.arch, so gcc is not installed just
+    because gcc-c++ is.
+    """
+
+    def __init__(self, rpms, flatpaks):
+        self.flatpaks = flatpaks
+        self.rpms = set()
+        self.versions = {}
+        for name, arch, nvr in rpms:
+            self.rpms.update((name, f"{name}.{arch}"))
+            self.versions.setdefault(name, set()).add(nvr)
+
+    def __contains__(self, package):
+        return package in self.rpms or package in self.flatpaks
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _rpm_bindings_packages():
+    import rpm
+    packages = []
+    for header in rpm.TransactionSet().dbMatch():
+        name, arch = _text(header[rpm.RPMTAG_NAME]), _text(header[rpm.RPMTAG_ARCH] or 'noarch')
+        version, release = _text(header[rpm.RPMTAG_VERSION]), _text(header[rpm.RPMTAG_RELEASE])
+        packages.append((name, arch, f"{name}-{version}-{release}"))
+    return packages
+
+
+def _libdnf5_packages():
+    import libdnf5
+    base = libdnf5.base.Base()
+    base.load_config()
+    base.setup()
+    # Only the system repository, so no repository metadata is loaded
+    base.get_repo_sack().load_repos(libdnf5.repo.Repo.Type_SYSTEM)
+    query = libdnf5.rpm.PackageQuery(base)
+    query.filter_installed()
+    return [(p.get_name(), p.get_arch(), f"{p.get_name()}-{p.get_version()}-{p.get_release()}") for p in query]
+
+
+def _rpm_cli_packages():
+    lines = _dump_lines(['rpm', '-qa', '--qf', '%{NAME} %{ARCH} %{NAME}-%{VERSION}-%{RELEASE}\\n'])
+    return [tuple(line.split()) for line in lines if len(line.split()) == 3]
+
+
+def installed_rpms():
+    """(name, arch, name-version-release) of every installed package, from the first backend that works"""
+    readers = {'rpm': _rpm_bindings_packages, 'libdnf5': _libdnf5_packages, 'rpm-cli': _rpm_cli_packages}
+    for backend in BACKENDS:
+        try:
+            return readers[backend]()
+        except ImportError:
+            continue
+        except Exception as e:
+            print(f"Could not read the RPM database through {backend}: {e}")
+    return []
+
+
+def _dump_lines(cmd):
+    """Run a listing command once and return its non-empty output lines as a set"""
+    try:
+        result = run(cmd, capture=True)
+    except FileNotFoundError:
+        return set()
+    if result.returncode != 0:
+        return set()
+    return {line.strip() for line in result.stdout.decode().splitlines() if line.strip()}
+
+
+def installed_index():
+    """Return the installed-state index, building it with one RPM database read and one flatpak dump"""
+    global _index
+    # Concurrent steps share one dump instead of each running their own
+    with _index_lock:
+        if _index is None:
+            _index = InstalledIndex(
+                rpms=installed_rpms(),
+                flatpaks=_dump_lines(['flatpak', 'list', '--columns=application']),
+            )
+        return _index
+
+
+def invalidate_installed_index():
+    """Forget the cached index so the next lookup sees packages installed since"""
+    global _index
+    _index = None
+
+
+def is_installed(package):
+    """Check if a package is installed via RPM or Flatpak"""
+    return package in installed_index()
+
+
+def missing_packages(packages):
+    """The RPM packages, given by name or name.arch, that are not installed"""
+    index = installed_index()
+    return [package for package in packages if package not in index.rpms]
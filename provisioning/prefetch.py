@@ -0,0 +1,104 @@
+"""Bounded background downloads that fetch payloads before the steps installing them run"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from provisioning.download_cache import DownloadError
+from provisioning.runner import current_step, step as traced_step
+
+DEFAULT_PREFETCH_JOBS = 3
+
+# Prefetching stops when a download target has less free space than this
+DEFAULT_MIN_FREE_BYTES = 5 * 1024 ** 3
+
+
+def free_bytes(path):
+    """Free space on the filesystem holding path, or of its nearest existing parent"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+
+class Prefetcher:
+    """Counts concurrent prefetch downloads and guards the disks they fill
+
+    A prefetch is only an optimization: when no slot is configured or a
+    target filesystem is short on space it is skipped, and the install
+    step downloads the payload itself as it always did.
+    """
+
+    def __init__(self, jobs=DEFAULT_PREFETCH_JOBS, min_free=DEFAULT_MIN_FREE_BYTES):
+        self.configure(jobs, min_free)
+
+    def configure(self, jobs, min_free):
+        self.jobs = max(0, jobs)
+        self.min_free = min_free
+        self.slots = threading.BoundedSemaphore(self.jobs or 1)
+
+    def has_space(self, path):
+        free = free_bytes(path)
+        return free is None or free >= self.min_free
+
+    @contextmanager
+    def slot(self, label, path):
+        """Hold one of the download slots; yields False when the prefetch should be skipped"""
+        if not self.jobs:
+            yield False
+            return
+        with self.slots:
+            if not self.has_space(path):
+                print(f"Less than {self.min_free // 1024 ** 2} MiB free for {path}, not prefetching {label}.")
+                yield False
+                return
+            print(f"Prefetching {label}...")
+            yield True
+
+    def gather(self, jobs, owner=None):
+        """Run (label, path, func) download jobs concurrently, returning the labels that were not fetched
+
+        path is where func writes, for the disk-space guard. Each job is
+        traced as a sub-step of owner, by default the step that started it.
+        """
+        owner = owner or current_step()
+
+        def attempt(job):
+            label, path, func = job
+            name = os.path.basename(label.rstrip('/')) or label
+            with traced_step(f"{owner}/{name}" if owner else name), self.slot(name, path) as allowed:
+                if not allowed:
+                    return label
+                try:
+                    func()
+                except DownloadError as e:
+                    print(f"{e}, it will be downloaded when it is needed.")
+                    return label
+            return None
+
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+            return [label for label in pool.map(attempt, jobs) if label]
+
+    @contextmanager
+    def background(self, jobs):
+        """Gather the jobs while the block runs, waiting for them when it ends"""
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(self.gather, jobs, current_step())
+            try:
+                yield
+            finally:
+                pending.result()
+
+
+# Shared by every step of the current run
+prefetcher = Prefetcher()
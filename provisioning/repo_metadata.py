@@ -0,0 +1,80 @@
+"""Run-scoped repository metadata refresh for dnf"""
+
+import glob
+import os
+import time
+
+from provisioning.runner import run
+
+# Metadata younger than this is trusted without contacting the mirrors
+DEFAULT_METADATA_TTL = 6 * 60 * 60
+
+# repomd.xml files written by dnf4 and dnf5 for every cached repository
+CACHE_GLOBS = [
+    '/var/cache/dnf/*/repodata/repomd.xml',
+    '/var/cache/libdnf5/*/repodata/repomd.xml',
+]
+
+
+class RepoMetadata:
+    """Refreshes dnf metadata at most once per run, after all repos are added"""
+
+    def __init__(self, ttl=DEFAULT_METADATA_TTL, cache_globs=CACHE_GLOBS):
+        self.ttl = ttl
+        self.cache_globs = cache_globs
+        self.refreshed = False
+        self.stale = False
+        self.repos = None
+
+    def mark_stale(self):
+        """Record that a repository was added, so the cache must be refreshed"""
+        self.stale = True
+
+    def restrict(self, repo_ids):
+        """Resolve, refresh and install only from these repositories for the rest of the run"""
+        self.repos = list(repo_ids)
+        self.stale = True
+
+    def repo_options(self):
+        if self.repos is None:
+            return []
+        return ['--disablerepo=*', *(f'--enablerepo={repo}' for repo in self.repos)]
+
+    def cache_age(self):
+        """Age in seconds of the oldest cached repository, or None without a cache"""
+        mtimes = [os.path.getmtime(path) for pattern in self.cache_globs for path in glob.glob(pattern)]
+        if not mtimes:
+            return None
+        return time.time() - min(mtimes)
+
+    def refresh(self):
+        """Refresh metadata unless it was already refreshed or is within the TTL"""
+        if self.refreshed and not self.stale:
+            return
+        age = self.cache_age()
+        # Once refreshed in this run, only repositories added since are missing
+        if not self.refreshed and (age is None or age >= self.ttl):
+            print("Refreshing repository metadata...")
+            run(['sudo', 'dnf', 'makecache', '--refresh', *self.repo_options()])
+        elif self.stale:
+            # Only the repositories added this run are missing from the cache
+            print("Fetching metadata for newly added repositories...")
+            run(['sudo', 'dnf', 'makecache', *self.dnf_options()])
+        else:
+            print(f"Repository metadata is {int(age // 60)} minutes old, skipping refresh...")
+        self.refreshed = True
+        self.stale = False
+
+    def dnf_options(self):
+        """Options that stop later dnf calls from expiring the metadata again"""
+        return [f'--setopt=*.metadata_expire={self.ttl}', *self.repo_options()]
+
+    def upgrade(self):
+        """Run the optional full system upgrade against the refreshed metadata"""
+        self.refresh()
+        print("Upgrading system packages...")
+        run(['sudo', 'dnf', '-y', 'upgrade', *self.dnf_options()])
+
+
+# Shared by every step of the current run
+metadata = RepoMetadata()
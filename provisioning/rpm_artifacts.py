@@ -0,0 +1,129 @@
+"""Locally built RPMs kept in a directory that doubles as a dnf repository"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from provisioning.package_state import installed_index
+from provisioning.runner import run
+
+SYSTEM_ARTIFACT_DIR = '/var/cache/fedora-scripts/rpms'
+
+SPEC_TEMPLATE = """\
+%global debug_package %{{nil}}
+%global _build_id_links none
+
+Name: {name}
+Version: {version}
+Release: {release}
+Summary: {summary}
+License: {license}
+
+%description
+{summary}, built from source by fedora-scripts.
+Artifact key: {key}
+
+%install
+cp -a {staging}/. %{{buildroot}}/
+
+%files
+{files}
+"""
+
+
+class RpmArtifactError(Exception):
+    """Raised when a staged build tree cannot be packaged"""
+
+
+def default_artifact_dir():
+    """System-wide artifacts when running as root, otherwise ones in the user's cache directory"""
+    if os.geteuid() == 0:
+        return Path(SYSTEM_ARTIFACT_DIR)
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'fedora-scripts' / 'rpms'
+
+
+def artifact_key(inputs):
+    """Short, stable digest of everything that affects a build's output"""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def installed_versions(packages):
+    """name-version-release of the installed packages, as used by a build on this machine"""
+    versions = installed_index().versions
+    return sorted({nvr for package in packages for nvr in versions.get(package, ())})
+
+
+def resolved_versions(packages, arch, dnf_options=()):
+    """name-version-release of the newest packages the enabled repositories offer for arch
+
+    Known before anything is installed, so a machine without the packages
+    arrives at the same versions as one that built with them installed.
+    """
+    result = run(['dnf', 'repoquery', '--quiet', '--latest-limit=1', f"--arch={arch},noarch", *dnf_options,
+                  '--queryformat=%{name}-%{version}-%{release}\\n', *packages], capture=True)
+    if result.returncode != 0:
+        raise RpmArtifactError(f"Could not resolve {' '.join(packages)}: "
+                               f"{result.stderr.decode(errors='replace').strip()}")
+    return sorted({line.strip() for line in result.stdout.decode().splitlines() if line.strip()})
+
+
+def _spec_path(path):
+    """Quote a packaged path for %files, which treats whitespace and globs specially"""
+    path = path.replace('%', '%%')
+    return f'"{path}"' if any(c in path for c in ' \t*?[') else path
+
+
+class RpmArtifacts:
+    """Built RPMs named by package, version and artifact key
+
+    The key is part of the release, so a lookup never matches an RPM
+    built from different inputs. createrepo_c, when present, keeps the
+    directory usable as a file-based repository for other machines.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else default_artifact_dir()
+
+    def release(self, key):
+        return f"1.k{key}%{{?dist}}"
+
+    def find(self, name, version, key):
+        """Path of the RPM built with this key, or None"""
+        matches = sorted(self.root.glob(f"{name}-{version}-1.k{key}.*.rpm"))
+        return matches[-1] if matches else None
+
+    def package(self, name, version, key, staging, summary, license='Unknown'):
+        """Build an RPM of everything under the staging directory and return its path"""
+        staging = Path(staging)
+        files = []
+        for directory, _, names in os.walk(staging):
+            for file_name in names:
+                files.append('/' + os.path.relpath(os.path.join(directory, file_name), staging))
+        if not files:
+            raise RpmArtifactError(f"Nothing was installed into {staging}")
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix='rpmbuild-') as topdir:
+            spec = Path(topdir) / f"{name}.spec"
+            spec.write_text(SPEC_TEMPLATE.format(
+                name=name, version=version, release=self.release(key), summary=summary,
+                license=license, key=key, staging=staging,
+                files='\n'.join(_spec_path(f) for f in sorted(files))))
+            result = run(['rpmbuild', '-bb', '--quiet',
+                          '--define', f"_topdir {topdir}",
+                          '--define', f"_rpmdir {self.root}",
+                          '--define', '_build_name_fmt %{NAME}-%{VERSION}-%{RELEASE}.%{ARCH}.rpm',
+                          str(spec)])
+        if result.returncode != 0:
+            raise RpmArtifactError(f"rpmbuild failed for {name} {version}")
+
+        artifact = self.find(name, version, key)
+        if artifact is None:
+            raise RpmArtifactError(f"rpmbuild did not produce {name}-{version} in {self.root}")
+        if shutil.which('createrepo_c'):
+            run(['createrepo_c', '--quiet', '--update', str(self.root)])
+        print(f"Packaged {artifact}")
+        return artifact
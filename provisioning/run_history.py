@@ -0,0 +1,243 @@
+"""Local SQLite history of provisioning runs, for spotting steps that got slower"""
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+from provisioning.host_facts import host
+from provisioning.journal import default_journal_path
+from provisioning.runner import tracer
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Runs a step's latest duration is compared against
+DEFAULT_WINDOW = 10
+
+# A step is flagged when it took this many times its baseline, and at least MIN_REGRESSION_SECONDS longer
+DEFAULT_THRESHOLD = 1.5
+MIN_REGRESSION_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    script TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    status TEXT NOT NULL,
+    commands INTEGER NOT NULL,
+    downloaded INTEGER NOT NULL,
+    revision TEXT,
+    code_hash TEXT NOT NULL,
+    host TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL NOT NULL,
+    downloaded INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS steps_by_name ON steps(name, run_id);
+"""
+
+
+def default_history_path():
+    return default_journal_path('run-history').with_suffix('.sqlite')
+
+
+def git_revision(repo=REPO_DIR):
+    """Commit the checkout is at, read from .git without running git, or None outside a checkout"""
+    git_dir = Path(repo) / '.git'
+    try:
+        head = (git_dir / 'HEAD').read_text().strip()
+        if not head.startswith('ref: '):
+            return head
+        ref = head[5:]
+        try:
+            return (git_dir / ref).read_text().strip()
+        except FileNotFoundError:
+            for line in (git_dir / 'packed-refs').read_text().splitlines():
+                if line.endswith(f" {ref}"):
+                    return line.split()[0]
+    except OSError:
+        pass
+    return None
+
+
+def code_hash(script, repo=REPO_DIR):
+    """Digest of the script and the provisioning package, which also changes with uncommitted edits"""
+    digest = hashlib.sha256()
+    for path in [Path(repo) / script, *sorted((Path(repo) / 'provisioning').glob('*.py'))]:
+        try:
+            digest.update(path.name.encode() + path.read_bytes())
+        except OSError:
+            continue
+    return digest.hexdigest()[:16]
+
+
+def host_summary():
+    """Facts that explain a change in speed without a change in the scripts"""
+    release = host.os_release
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        memory = None
+    return {
+        'hostname': socket.gethostname(),
+        'os': f"{release.get('ID', '?')} {release.get('VERSION_ID', '')}".strip(),
+        'kernel': host.uname[2],
+        'machine': host.machine,
+        'cpus': os.cpu_count(),
+        'memory': memory,
+    }
+
+
+class RunHistory:
+    """Runs and their step timings in one SQLite file"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, script, summary, revision, code, host_facts):
+        """Store one run from a tracer summary, returning its id"""
+        steps = summary['steps']
+        status = 'failed' if any(s['status'] == 'failed' for s in steps) else 'done'
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (script, started, duration, status, commands, downloaded, revision, code_hash, host)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (script, summary['started'], summary['duration'], status, summary['commands'],
+                 summary.get('downloaded', 0), revision, code, json.dumps(host_facts, sort_keys=True)))
+            self.db.executemany(
+                "INSERT INTO steps (run_id, name, status, duration, downloaded) VALUES (?, ?, ?, ?, ?)",
+                [(cursor.lastrowid, s['name'], s['status'], s['duration'], s.get('downloaded', 0)) for s in steps])
+        return cursor.lastrowid
+
+    def runs(self, script=None, since=None, limit=None):
+        """Runs, newest first, as dicts"""
+        query = "SELECT id, script, started, duration, status, commands, downloaded, revision, code_hash, host FROM runs"
+        where, params = [], []
+        if script:
+            where.append("script = ?")
+            params.append(script)
+        if since:
+            where.append("started >= ?")
+            params.append(since)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY started DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        columns = ['id', 'script', 'started', 'duration', 'status', 'commands', 'downloaded',
+                   'revision', 'code_hash', 'host']
+        return [dict(zip(columns, row)) for row in self.db.execute(query, params)]
+
+    def step_samples(self, script=None, since=None):
+        """{(script, step): [(started, duration, code_hash, host), ...]} of steps that ran to completion, oldest first"""
+        query = ("SELECT runs.script, steps.name, runs.started, steps.duration, runs.code_hash, runs.host"
+                 " FROM steps JOIN runs ON runs.id = steps.run_id WHERE steps.status = 'done'")
+        params = []
+        if script:
+            query += " AND runs.script = ?"
+            params.append(script)
+        if since:
+            query += " AND runs.started >= ?"
+            params.append(since)
+        samples = {}
+        for run_script, name, started, duration, code, host_facts in self.db.execute(
+                query + " ORDER BY runs.started", params):
+            samples.setdefault((run_script, name), []).append((started, duration, code, host_facts))
+        return samples
+
+
+def record_run(path, script):
+    """Append the current run to the history; a failure to record never fails the run"""
+    summary = tracer.summary()
+    try:
+        history = RunHistory(path)
+        try:
+            history.record(os.path.basename(script), summary, git_revision(), code_hash(os.path.basename(script)),
+                           host_summary())
+        finally:
+            history.close()
+    except (sqlite3.Error, OSError) as e:
+        print(f"Could not record the run in {path}: {e}")
+
+
+def percentile(values, q):
+    """q-th percentile of values with linear interpolation"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def step_report(samples, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+    """Trend and regression verdict of one step from its samples, oldest first
+
+    The baseline is the median of the window runs before the latest one.
+    When the latest run is flagged, cause says whether the code or the
+    host changed since the baseline, or neither, which points at the
+    network and mirrors.
+    """
+    durations = [duration for _, duration, _, _ in samples]
+    latest_started, latest, latest_code, latest_host = samples[-1]
+    baseline_samples = samples[-window - 1:-1]
+    baseline = percentile([s[1] for s in baseline_samples], 50)
+    report = {
+        'runs': len(samples),
+        'p50': percentile(durations, 50),
+        'p90': percentile(durations, 90),
+        'p95': percentile(durations, 95),
+        'latest': latest,
+        'latest_started': latest_started,
+        'baseline': baseline,
+        'regressed': False,
+        'cause': None,
+    }
+    if baseline is not None and latest > baseline * threshold and latest - baseline >= MIN_REGRESSION_SECONDS:
+        report['regressed'] = True
+        if any(code != latest_code for _, _, code, _ in baseline_samples):
+            report['cause'] = 'code changed'
+        elif any(facts != latest_host for _, _, _, facts in baseline_samples):
+            report['cause'] = 'host changed'
+        else:
+            report['cause'] = 'same code and host, likely the network or a mirror'
+    return report
+
+
+def print_report(history, script=None, since=None, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+    """Percentiles per step and the steps whose latest run regressed; returns the regressed steps"""
+    samples = history.step_samples(script, since)
+    if not samples:
+        print("No runs recorded yet.")
+        return []
+    reports = {key: step_report(values, window, threshold) for key, values in samples.items()}
+    print(f"{'script':<22} {'step':<32} {'runs':>5} {'p50':>8} {'p90':>8} {'p95':>8} {'baseline':>9} {'latest':>8}")
+    for (run_script, name), report in sorted(reports.items()):
+        baseline = f"{report['baseline']:.1f}s" if report['baseline'] is not None else '-'
+        flag = '  SLOWER' if report['regressed'] else ''
+        print(f"{run_script:<22} {name:<32} {report['runs']:>5} {report['p50']:>7.1f}s {report['p90']:>7.1f}s "
+              f"{report['p95']:>7.1f}s {baseline:>9} {report['latest']:>7.1f}s{flag}")
+
+    regressed = [(key, report) for key, report in sorted(reports.items()) if report['regressed']]
+    if regressed:
+        print(f"\nSteps more than {threshold}x slower than the median of their previous {window} runs:")
+        for (run_script, name), report in regressed:
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(report['latest_started']))
+            print(f"  {run_script} {name}: {report['latest']:.1f}s on {when}, baseline {report['baseline']:.1f}s "
+                  f"({report['cause']})")
+    return regressed
@@ -0,0 +1,220 @@
+"""Instrumented command runner shared by the provisioning scripts
+
+Every command goes through run(), which records its argv, the step it
+belongs to, its start and end time, exit code and output size. The
+recorded run can be exported as Chrome trace-event JSON (load it in
+chrome://tracing or Perfetto) and summarized as a table of the slowest
+steps and commands.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def current_step():
+    """Name of the step running on this thread, or None outside any step"""
+    return getattr(_local, 'step', None)
+
+
+class CommandRecord:
+    def __init__(self, argv, step, start):
+        self.argv = list(argv)
+        self.step = step
+        self.start = start
+        self.end = None
+        self.returncode = None
+        self.output_bytes = 0
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+
+class StepRecord:
+    """A step's span; deps is None for steps that simply ran one after another"""
+
+    def __init__(self, name, start, deps=None):
+        self.name = name
+        self.start = start
+        self.deps = deps
+        self.end = None
+        self.status = 'running'
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+
+class Tracer:
+    """Collects the step and command records of one run"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.commands = []
+        self.steps = []
+        self.downloads = {}
+
+    def add(self, records, record):
+        with self.lock:
+            records.append(record)
+        return record
+
+    def count_download(self, nbytes, step=None):
+        """Attribute downloaded bytes to a step, or to the run as a whole when step is None"""
+        with self.lock:
+            self.downloads[step] = self.downloads.get(step, 0) + nbytes
+
+    def trace_events(self):
+        """The run as a list of Chrome trace events, one thread lane per step"""
+        lanes = {None: 0}
+        for record in self.steps:
+            lanes.setdefault(record.name, len(lanes))
+        for record in self.commands:
+            lanes.setdefault(record.step, len(lanes))
+
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name or 'main'}} for name, tid in lanes.items()]
+        for record in self.steps:
+            events.append({
+                'name': record.name, 'cat': 'step', 'ph': 'X', 'pid': pid, 'tid': lanes[record.name],
+                'ts': (record.start - self.started) * 1e6, 'dur': record.duration * 1e6,
+                'args': {'status': record.status, 'deps': record.deps},
+            })
+        for record in self.commands:
+            events.append({
+                'name': os.path.basename(record.argv[0]) if record.argv else '?',
+                'cat': 'command', 'ph': 'X', 'pid': pid, 'tid': lanes[record.step],
+                'ts': (record.start - self.started) * 1e6, 'dur': record.duration * 1e6,
+                'args': {'argv': record.argv, 'step': record.step,
+                         'exit_code': record.returncode, 'output_bytes': record.output_bytes},
+            })
+        return events
+
+    def export_chrome_trace(self, path):
+        """Write the run as Chrome trace-event JSON"""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+        print(f"Trace written to {path}")
+
+    def summary(self):
+        """Outcome and duration of every step, for reports that aggregate many runs"""
+        return {
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'commands': len(self.commands),
+            'downloaded': sum(self.downloads.values()),
+            'steps': [{'name': r.name, 'status': r.status, 'duration': r.duration,
+                       'downloaded': self.downloads.get(r.name, 0)} for r in self.steps],
+        }
+
+    def export_summary(self, path):
+        """Write the run summary as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def critical_path(self):
+        """Longest chain of dependent steps as (seconds, [step names])"""
+        best = {}
+        previous = None
+        for record in sorted(self.steps, key=lambda r: r.start):
+            if record.deps is None:
+                deps = [previous] if previous else []
+                previous = record.name
+            else:
+                deps = record.deps
+            length, chain = max((best[dep] for dep in deps if dep in best), default=(0.0, []))
+            best[record.name] = (length + record.duration, chain + [record.name])
+        return max(best.values(), default=(0.0, []))
+
+    def print_summary(self, limit=10):
+        """Print the slowest steps and commands of the run"""
+        if self.steps:
+            print("\nSlowest steps:")
+            for record in sorted(self.steps, key=lambda r: r.duration, reverse=True)[:limit]:
+                print(f"  {record.name:<32} {record.status:<8} {record.duration:>9.2f}s")
+        if self.commands:
+            print("\nSlowest commands:")
+            for record in sorted(self.commands, key=lambda r: r.duration, reverse=True)[:limit]:
+                command = ' '.join(record.argv)
+                if len(command) > 60:
+                    command = command[:57] + '...'
+                print(f"  {command:<60} {str(record.returncode):>4} {record.duration:>9.2f}s")
+        total = time.time() - self.started
+        print(f"\n{len(self.commands)} commands in {total:.1f}s")
+
+
+# Shared by every step of the current run
+tracer = Tracer()
+
+
+@contextmanager
+def step(name, deps=None):
+    """Attribute commands run inside the block to the named step"""
+    previous = current_step()
+    _local.step = name
+    record = tracer.add(tracer.steps, StepRecord(name, time.time(), deps))
+    try:
+        yield record
+        if record.status == 'running':
+            record.status = 'done'
+    except BaseException:
+        record.status = 'failed'
+        raise
+    finally:
+        record.end = time.time()
+        _local.step = previous
+
+
+def run(argv, check=False, capture=False, input=None, cwd=None, env=None):
+    """Run a command and record it
+
+    Without capture the command's combined output is streamed through
+    print(), so it picks up the step prefix of the scheduler. With capture
+    stdout and stderr are returned on the CompletedProcess instead. check
+    raises subprocess.CalledProcessError like subprocess.run does.
+    """
+    record = tracer.add(tracer.commands, CommandRecord(argv, current_step(), time.time()))
+    try:
+        if capture:
+            result = subprocess.run(argv, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    cwd=cwd, env=env)
+            record.output_bytes = len(result.stdout) + len(result.stderr)
+        else:
+            result = _stream(argv, record, input, cwd, env)
+        record.returncode = result.returncode
+    finally:
+        record.end = time.time()
+
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, argv, result.stdout, result.stderr)
+    return result
+
+
+def _stream(argv, record, input, cwd, env):
+    process = subprocess.Popen(argv, stdin=subprocess.PIPE if input is not None else None,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, env=env)
+    if input is not None:
+        process.stdin.write(input)
+        process.stdin.close()
+    for line in process.stdout:
+        record.output_bytes += len(line)
+        print(line.decode(errors='replace'), end='', flush=True)
+    process.wait()
+    return subprocess.CompletedProcess(argv, process.returncode)
+
+
+def finish_run(trace_path=None, summary_path=None):
+    """Print the run summary and export the trace and JSON summary if paths were given"""
+    tracer.print_summary()
+    if trace_path:
+        tracer.export_chrome_trace(trace_path)
+    if summary_path:
+        tracer.export_summary(summary_path)
@@ -0,0 +1,200 @@
+"""Dependency-graph scheduler that runs independent provisioning steps concurrently"""
+
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from provisioning.journal import fingerprint
+from provisioning.runner import StepRecord, current_step, step as traced_step, tracer
+
+DEFAULT_JOBS = 4
+
+# Holds the unfinished output line of each worker thread
+_local = threading.local()
+
+
+class Step:
+    """A named unit of provisioning work
+
+    deps names the steps that must finish successfully first. Steps that
+    share an entry in locks (for example 'dnf' or 'flatpak', which guard a
+    package manager) never run at the same time. A step fails when its
+    function raises or returns False.
+
+    fingerprint, if given, returns JSON-serializable data describing the
+    step's inputs (package sets, target paths, file states). It must be
+    cheap: when a journal holds the same fingerprint from an earlier run
+    and the optional validate check passes, the step is not run again.
+    """
+
+    def __init__(self, name, func, deps=(), locks=(), fingerprint=None, validate=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.locks = set(locks)
+        self.fingerprint = fingerprint
+        self.validate = validate
+        self.status = 'pending'
+        self.ran = False
+        self.error = None
+        self.duration = None
+
+
+class _PrefixedStream:
+    """Stream wrapper that prefixes each line with the name of the step writing it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        step = current_step()
+        if step is None:
+            return self.stream.write(text)
+        lines = (getattr(_local, 'partial', '') + text).split('\n')
+        _local.partial = lines.pop()
+        with self.lock:
+            for line in lines:
+                self.stream.write(f"[{step}] {line}\n")
+        return len(text)
+
+    def flush_partial(self):
+        if getattr(_local, 'partial', ''):
+            self.write('\n')
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _check_graph(steps):
+    """Reject unknown dependencies and cycles before anything runs"""
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            if dep not in by_name:
+                raise ValueError(f"Step {step.name} depends on unknown step {dep}")
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through step {name}")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for step in steps:
+        visit(step.name)
+    return by_name
+
+
+def _run_step(step, stream, journal):
+    start = time.monotonic()
+    step.ran = True
+    with traced_step(step.name, deps=step.deps) as record:
+        try:
+            result = step.func()
+            step.status = 'failed' if result is False else 'done'
+        except (Exception, SystemExit) as e:
+            step.status = 'failed'
+            step.error = e
+            print(f"Step failed: {e}")
+        finally:
+            step.duration = time.monotonic() - start
+            record.status = step.status
+            stream.flush_partial()
+    if journal is not None and step.fingerprint is not None:
+        if step.status == 'done':
+            journal.record(step.name, fingerprint(step.fingerprint()))
+        else:
+            journal.forget(step.name)
+    return step
+
+
+def _up_to_date(step, by_name, journal):
+    """Whether the journal shows the step already completed with the same inputs"""
+    if journal is None or step.fingerprint is None:
+        return False
+    # Anything a dependency changed in this run may have changed the inputs
+    if any(by_name[dep].ran for dep in step.deps):
+        return False
+    if not journal.is_current(step.name, fingerprint(step.fingerprint())):
+        return False
+    return step.validate is None or bool(step.validate())
+
+
+def _skip_blocked(steps, by_name):
+    """Mark pending steps skipped when a dependency failed or was skipped"""
+    changed = True
+    while changed:
+        changed = False
+        for step in steps:
+            if step.status == 'pending' and any(by_name[dep].status in ('failed', 'skipped') for dep in step.deps):
+                step.status = 'skipped'
+                record = tracer.add(tracer.steps, StepRecord(step.name, time.time(), step.deps))
+                record.end, record.status = record.start, 'skipped'
+                print(f"Skipping {step.name}: a dependency did not complete.")
+                changed = True
+
+
+def run_steps(steps, jobs=DEFAULT_JOBS, journal=None, verify=False):
+    """Run steps in dependency order with at most jobs running concurrently
+
+    Returns True when every step finished successfully. Steps whose
+    dependencies failed are marked skipped rather than run. Durations and
+    outcomes are recorded on the run's tracer.
+
+    With a journal, steps whose fingerprint is unchanged since they last
+    completed are not run again. verify runs every step regardless and
+    refreshes the journal.
+    """
+    by_name = _check_graph(steps)
+    jobs = max(1, jobs)
+    stream = _PrefixedStream(sys.stdout)
+    sys.stdout = stream
+    held_locks = set()
+    running = {}
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while True:
+                _skip_blocked(steps, by_name)
+                progressed = False
+                for step in steps:
+                    if step.status != 'pending':
+                        continue
+                    if not all(by_name[dep].status == 'done' for dep in step.deps):
+                        continue
+                    if not verify and _up_to_date(step, by_name, journal):
+                        step.status = 'done'
+                        record = tracer.add(tracer.steps, StepRecord(step.name, time.time(), step.deps))
+                        record.end, record.status = record.start, 'journal'
+                        print(f"{step.name} is unchanged since the last run, skipping...")
+                        progressed = True
+                    elif not step.locks & held_locks and len(running) < jobs:
+                        step.status = 'running'
+                        held_locks |= step.locks
+                        running[pool.submit(_run_step, step, stream, journal)] = step
+                if not running:
+                    if progressed:
+                        continue
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    held_locks -= running.pop(future).locks
+    finally:
+        sys.stdout = stream.stream
+
+    if journal is not None:
+        # Later steps may have touched files earlier ones fingerprint, so
+        # store the state every completed step leaves behind at the end
+        for step in steps:
+            if step.status == 'done' and step.fingerprint is not None:
+                journal.record(step.name, fingerprint(step.fingerprint()))
+    return all(step.status == 'done' for step in steps)
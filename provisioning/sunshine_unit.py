@@ -0,0 +1,157 @@
+"""Sunshine systemd unit tuned for streaming, validated and replaced only when it changes"""
+
+import difflib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from provisioning.dnf_profile import write_system_file
+from provisioning.runner import run
+
+UNIT_NAME = 'sunshine.service'
+SYSTEM_UNIT_PATH = f'/etc/systemd/system/{UNIT_NAME}'
+
+DEFAULT_NICE = -10
+
+# cgroup weights, every other unit runs with the default of 100
+STREAM_CPU_WEIGHT = 1000
+STREAM_IO_WEIGHT = 1000
+
+SCHED_POLICIES = ['other', 'batch', 'rr', 'fifo']
+DEFAULT_SCHED_POLICY = 'other'
+DEFAULT_RT_PRIORITY = 20
+
+# Performance cores of hybrid Intel CPUs, absent on every other CPU
+HYBRID_CORE_CPUS = '/sys/devices/cpu_core/cpus'
+
+
+class UnitError(Exception):
+    """Raised when the generated unit fails verification or cannot be installed"""
+
+
+def user_unit_path(home):
+    return Path(home) / '.config' / 'systemd' / 'user' / UNIT_NAME
+
+
+def performance_cpus():
+    """CPU list of the performance cores on hybrid CPUs, or None when every core is alike"""
+    try:
+        cpus = Path(HYBRID_CORE_CPUS).read_text().strip()
+    except OSError:
+        return None
+    return cpus or None
+
+
+def render_unit(exec_start, scope='system', user=None, cpus=None, nice=DEFAULT_NICE,
+                sched_policy=DEFAULT_SCHED_POLICY, rt_priority=DEFAULT_RT_PRIORITY):
+    """Unit text for Sunshine in the system or the user service manager
+
+    A user manager cannot raise priorities or resource limits, so a user
+    unit only gets the settings an unprivileged service may use: CPU
+    affinity, best-effort I/O priority and cgroup weights.
+    """
+    system = scope == 'system'
+    unit = ["[Unit]", "Description=Sunshine Game Streaming Service"]
+    if system:
+        unit += ["Wants=network-online.target",
+                 "After=network-online.target display-manager.service"]
+    else:
+        # Start with the desktop session, whose display and audio Sunshine captures, and
+        # the session bus it talks to PipeWire and the portals over
+        unit += ["After=graphical-session.target dbus.socket", "PartOf=graphical-session.target",
+                 "Requires=dbus.socket"]
+
+    service = [f"ExecStart={exec_start}", "Restart=on-failure", "RestartSec=5"]
+    if not system:
+        # The user manager's environment lacks DISPLAY until the session imports it
+        service.append("Environment=DISPLAY=:0")
+    if system and user:
+        service += [f"User={user}", f"Group={user}"]
+    if cpus:
+        service.append(f"CPUAffinity={cpus}")
+        if system:
+            service.append(f"AllowedCPUs={cpus}")
+    # Favour the stream over background work when the machine is loaded
+    service += [f"CPUWeight={STREAM_CPU_WEIGHT}", f"IOWeight={STREAM_IO_WEIGHT}",
+                "IOSchedulingClass=best-effort", "IOSchedulingPriority=0"]
+    if system:
+        service += [f"Nice={nice}", f"CPUSchedulingPolicy={sched_policy}"]
+        if sched_policy in ('rr', 'fifo'):
+            # Games launched from Sunshine go back to the normal policy
+            service += [f"CPUSchedulingPriority={rt_priority}", "CPUSchedulingResetOnFork=yes",
+                        f"LimitRTPRIO={rt_priority}"]
+        # Encoders pin capture buffers in memory
+        service.append("LimitMEMLOCK=infinity")
+
+    install = ["[Install]", f"WantedBy={'graphical.target' if system else 'graphical-session.target'}"]
+    return '\n'.join(unit + ["", "[Service]"] + service + [""] + install) + '\n'
+
+
+def verify_unit(text, scope='system'):
+    """Check the unit with systemd-analyze verify, raising UnitError with its complaints
+
+    verify only warns about unknown keys and unparsable values, so any
+    message about the unit file counts as a failure too.
+    """
+    if not shutil.which('systemd-analyze'):
+        print("systemd-analyze is not available, installing the unit without verifying it.")
+        return
+    with tempfile.TemporaryDirectory(prefix='sunshine-unit-') as tmp:
+        path = Path(tmp) / UNIT_NAME
+        path.write_text(text)
+        argv = ['systemd-analyze', 'verify', *(['--user'] if scope == 'user' else []), str(path)]
+        result = run(argv, capture=True)
+        output = (result.stdout + result.stderr).decode(errors='replace').strip()
+        complaints = [line for line in output.splitlines() if line.startswith(f"{path}:")]
+    if 'Failed to initialize manager' in output:
+        # No service manager to check against, for example a user scope outside a login session
+        print("systemd-analyze cannot verify units here, installing the unit without verifying it.")
+        return
+    if result.returncode != 0 or complaints:
+        raise UnitError(f"systemd-analyze rejected the Sunshine unit:\n{output}")
+
+
+def systemctl(scope, *args):
+    argv = ['systemctl', '--user', *args] if scope == 'user' else ['sudo', 'systemctl', *args]
+    return run(argv).returncode == 0
+
+
+def install_unit(path, text, scope='system'):
+    """Install the unit when it differs from the one in place, then enable it and (re)start Sunshine
+
+    Returns True when the unit changed.
+    """
+    path = Path(path)
+    try:
+        current = path.read_text()
+    except OSError:
+        current = None
+    if current == text:
+        print(f"{path} is up to date.")
+        return False
+
+    verify_unit(text, scope)
+    if current is None:
+        print(f"Creating systemd service at {path}")
+    else:
+        print(f"Updating {path}:")
+        diff = difflib.unified_diff(current.splitlines(), text.splitlines(), str(path), 'generated', lineterm='')
+        print('\n'.join(diff))
+
+    if scope == 'user':
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    elif not write_system_file(path, text):
+        raise UnitError(f"Could not write {path}")
+
+    systemctl(scope, 'daemon-reload')
+    systemctl(scope, 'enable', UNIT_NAME)
+    # A running Sunshine only picks up the new settings when it restarts
+    if not systemctl(scope, 'restart', UNIT_NAME):
+        raise UnitError(f"{UNIT_NAME} did not start with the new unit")
+    return True
+
+
+def unit_path(scope, home=None):
+    return user_unit_path(home or os.path.expanduser('~')) if scope == 'user' else Path(SYSTEM_UNIT_PATH)
@@ -0,0 +1,189 @@
+"""Virtual environments cloned from cached templates instead of being built from scratch"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from provisioning.runner import run
+
+SYSTEM_VENV_DIR = '/var/cache/fedora-scripts/venvs'
+TEMPLATE_MARKER = '.fedora-scripts-template.json'
+
+
+class VenvError(Exception):
+    """Raised when a template or an environment cannot be created"""
+
+
+def default_venv_dir():
+    """System-wide templates when running as root, otherwise ones in the user's cache directory"""
+    if os.geteuid() == 0:
+        return Path(SYSTEM_VENV_DIR)
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'fedora-scripts' / 'venvs'
+
+
+def venv_python(venv_dir):
+    """The environment's interpreter, which uses the environment without activating it"""
+    return Path(venv_dir) / 'bin' / 'python'
+
+
+def interpreter_version(python):
+    """Version and real path of an interpreter, e.g. ('3.13.0', '/usr/bin/python3.13')"""
+    if os.path.realpath(python) == os.path.realpath(sys.executable):
+        return '.'.join(map(str, sys.version_info[:3])), os.path.realpath(sys.executable)
+    code = "import os, sys; print('.'.join(map(str, sys.version_info[:3]))); print(os.path.realpath(sys.executable))"
+    result = run([str(python), '-c', code], capture=True)
+    if result.returncode != 0:
+        raise VenvError(f"Cannot run {python}")
+    version, path = result.stdout.decode().split()
+    return version, path
+
+
+def requirements_hash(requirements):
+    """Digest of a requirements file with comments, blank lines and ordering ignored, 'base' when it lists nothing"""
+    lines = set()
+    for line in Path(requirements).read_text().splitlines() if requirements else []:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            lines.add(line)
+    if not lines:
+        return 'base'
+    return hashlib.sha256('\n'.join(sorted(lines)).encode()).hexdigest()[:16]
+
+
+def link_or_copy(source, dest):
+    """Hardlink a file, or copy it where links are refused, returning 'hardlink' or 'copy'"""
+    try:
+        os.link(source, dest)
+        return 'hardlink'
+    except OSError as e:
+        # Another filesystem, too many links, or protected_hardlinks for a file the user does not own
+        if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+    shutil.copy2(source, dest)
+    return 'copy'
+
+
+def clone_tree(source, dest):
+    """Copy a directory as reflinks where the filesystem supports them, otherwise as hardlinks
+
+    Returns 'reflink', 'hardlink', or 'copy' when some files had to be
+    copied, e.g. because dest is on another filesystem than the template.
+    Hardlinked files are shared with the template, so anything that is
+    rewritten afterwards has to be replaced by a copy first.
+    """
+    result = run(['cp', '-a', '--reflink=always', str(source), str(dest)], capture=True)
+    if result.returncode == 0:
+        return 'reflink'
+    shutil.rmtree(dest, ignore_errors=True)
+    methods = set()
+    shutil.copytree(source, dest, symlinks=True, copy_function=lambda src, dst: methods.add(link_or_copy(src, dst)))
+    return 'copy' if 'copy' in methods else 'hardlink'
+
+
+def relocate(venv_dir, old_prefix, new_prefix):
+    """Point activate scripts, console script shebangs and pyvenv.cfg at the environment's new path"""
+    old, new = str(old_prefix).encode(), str(new_prefix).encode()
+    paths = [p for p in (Path(venv_dir) / 'bin').iterdir() if p.is_file() and not p.is_symlink()]
+    paths.append(Path(venv_dir) / 'pyvenv.cfg')
+    for path in paths:
+        data = path.read_bytes()
+        if old not in data:
+            continue
+        # Write a new file instead of editing in place, which would change a hardlinked template too
+        mode = path.stat().st_mode
+        tmp = path.with_name(f".{path.name}.relocate")
+        tmp.write_bytes(data.replace(old, new))
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+
+
+class VenvFactory:
+    """Template environments keyed by interpreter version and requirements
+
+    A template is built once per key: the interpreter's venv with pip,
+    plus the requirements installed through a wheel cache shared by all
+    templates. Environments are clones of a template relocated to their
+    own path, which takes no network access and a fraction of the time of
+    python -m venv.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else default_venv_dir()
+
+    @property
+    def wheel_cache(self):
+        return self.root / 'pip-cache'
+
+    def template_dir(self, version, requirements):
+        return self.root / 'templates' / f"python{version}-{requirements_hash(requirements)}"
+
+    def template(self, python=sys.executable, requirements=None):
+        """Path of the template for the interpreter and requirements, built on first use"""
+        version, interpreter = interpreter_version(python)
+        template = self.template_dir(version, requirements)
+        if (template / TEMPLATE_MARKER).exists():
+            return template
+
+        template.parent.mkdir(parents=True, exist_ok=True)
+        # Another run may be building the same template
+        with open(template.parent / f".{template.name}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if (template / TEMPLATE_MARKER).exists():
+                return template
+            print(f"Building venv template {template.name}...")
+            build = Path(tempfile.mkdtemp(prefix=f".{template.name}-", dir=template.parent))
+            try:
+                if run([interpreter, '-m', 'venv', '--clear', str(build)]).returncode != 0:
+                    raise VenvError(f"python -m venv failed for {interpreter}")
+                if not template.name.endswith('-base'):
+                    result = run([str(venv_python(build)), '-m', 'pip', 'install', '--disable-pip-version-check',
+                                  '--cache-dir', str(self.wheel_cache), '-r', str(requirements)])
+                    if result.returncode != 0:
+                        raise VenvError(f"Could not install {requirements} into the template")
+                marker = {'prefix': str(build), 'python': interpreter, 'version': version,
+                          'requirements': str(requirements) if requirements else None}
+                (build / TEMPLATE_MARKER).write_text(json.dumps(marker, indent=2))
+                shutil.rmtree(template, ignore_errors=True)
+                os.replace(build, template)
+            except BaseException:
+                shutil.rmtree(build, ignore_errors=True)
+                raise
+        return template
+
+    def create(self, venv_dir, python=sys.executable, requirements=None):
+        """Clone the matching template to venv_dir unless an environment is already there
+
+        Returns the environment's interpreter.
+        """
+        venv_dir = Path(venv_dir).absolute()
+        if (venv_dir / 'pyvenv.cfg').exists():
+            print(f"Virtual environment {venv_dir} already exists. Skipping creation.")
+            return venv_python(venv_dir)
+        template = self.template(python, requirements)
+        marker = json.loads((template / TEMPLATE_MARKER).read_text())
+
+        venv_dir.parent.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{venv_dir.name}-", dir=venv_dir.parent))
+        staging.rmdir()
+        try:
+            method = clone_tree(template, staging)
+            (staging / TEMPLATE_MARKER).unlink()
+            # Rewritten for the final path, which only becomes valid with the rename below
+            relocate(staging, marker['prefix'], venv_dir)
+            os.replace(staging, venv_dir)
+        except (OSError, subprocess.SubprocessError) as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise VenvError(f"Could not create {venv_dir}: {e}") from e
+        print(f"Created virtual environment {venv_dir} from template {template.name} ({method}).")
+        return venv_python(venv_dir)
+
+
+# Shared by every step of the current run
+venvs = VenvFactory()
@@ -0,0 +1,170 @@
+"""Clone or update every repository of a workspace manifest, with fork remotes configured"""
+
+import os
+import re
+import tomllib
+from pathlib import Path
+
+from provisioning.runner import run
+
+DEFAULT_ROOT = '~/git'
+DEFAULT_FORK_REMOTE = 'fork'
+
+# Blobs are fetched on checkout, so a clone transfers the history without every old file version
+CLONE_FILTER = 'blob:none'
+
+# Workers never wait for a password prompt nobody can answer
+GIT_ENV = {'GIT_TERMINAL_PROMPT': '0', 'GIT_SSH_COMMAND': 'ssh -o BatchMode=yes'}
+
+
+class ManifestError(Exception):
+    """Raised when the workspace manifest cannot be read"""
+
+
+class SyncError(Exception):
+    """Raised when a repository cannot be cloned, fetched or configured"""
+
+
+def repo_name(url):
+    """Repository name of a clone URL, e.g. Sunshine for https://github.com/LizardByte/Sunshine.git"""
+    name = re.split(r'[/:]', url.rstrip('/'))[-1]
+    return name[:-4] if name.endswith('.git') else name
+
+
+class RepoSpec:
+    """One repository of the manifest
+
+    fork is the URL of the user's own copy, added as the fork_remote
+    remote; pushes go to push_default, which is the fork remote unless
+    the manifest says otherwise.
+    """
+
+    def __init__(self, url, path, fork=None, fork_remote=DEFAULT_FORK_REMOTE, push_default=None, branch=None):
+        self.url = url
+        self.path = Path(path)
+        self.fork = fork
+        self.fork_remote = fork_remote
+        self.push_default = push_default or (fork_remote if fork else None)
+        self.branch = branch
+
+
+def read_manifest(path):
+    """(root, [RepoSpec]) of a TOML manifest
+
+    root = "~/git"
+
+    [defaults]
+    fork = "git@github.com:me/{name}.git"
+    fork_remote = "me"
+
+    [[repo]]
+    url = "https://github.com/LizardByte/Sunshine.git"
+    path = "fw/sunshine"
+
+    Keys of [defaults] apply to every [[repo]] that does not set them;
+    {name} in fork stands for the repository name. path is relative to
+    root and defaults to the repository name.
+    """
+    try:
+        with open(path, 'rb') as f:
+            manifest = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise ManifestError(f"Cannot read {path}: {e}") from e
+
+    root = Path(os.path.expanduser(manifest.get('root', DEFAULT_ROOT)))
+    if not root.is_absolute():
+        root = Path(path).resolve().parent / root
+    defaults = manifest.get('defaults', {})
+    specs = []
+    for index, entry in enumerate(manifest.get('repo', [])):
+        entry = {**defaults, **entry}
+        url = entry.get('url')
+        if not url:
+            raise ManifestError(f"{path}: repo {index + 1} has no url")
+        name = repo_name(url)
+        fork = entry.get('fork')
+        specs.append(RepoSpec(url, root / os.path.expanduser(entry.get('path', name)),
+                              fork=fork.format(name=name) if fork else None,
+                              fork_remote=entry.get('fork_remote', DEFAULT_FORK_REMOTE),
+                              push_default=entry.get('push_default'), branch=entry.get('branch')))
+
+    paths = [spec.path for spec in specs]
+    duplicates = sorted({str(p) for p in paths if paths.count(p) > 1})
+    if duplicates:
+        raise ManifestError(f"{path}: more than one repo at {', '.join(duplicates)}")
+    return root, specs
+
+
+def git(repo, *args, capture=False):
+    return run(['git', '-C', str(repo), *args], capture=capture, env={**os.environ, **GIT_ENV})
+
+
+def remote_config(repo):
+    """({remote: url}, pushDefault) from one git config call"""
+    result = git(repo, 'config', '--get-regexp', r'^remote\.', capture=True)
+    remotes, push_default = {}, None
+    for line in result.stdout.decode(errors='replace').splitlines():
+        key, _, value = line.partition(' ')
+        if key == 'remote.pushdefault':
+            push_default = value
+        elif key.startswith('remote.') and key.endswith('.url'):
+            remotes[key[len('remote.'):-len('.url')]] = value
+    return remotes, push_default
+
+
+def clone(spec):
+    if spec.path.exists() and any(spec.path.iterdir()):
+        raise SyncError(f"{spec.path} exists and is not a git checkout")
+    spec.path.parent.mkdir(parents=True, exist_ok=True)
+    argv = ['clone', '--quiet', f'--filter={CLONE_FILTER}', *(['--branch', spec.branch] if spec.branch else []),
+            spec.url, str(spec.path)]
+    if run(['git', *argv], env={**os.environ, **GIT_ENV}).returncode != 0:
+        raise SyncError(f"Could not clone {spec.url}")
+
+
+def sync_repo(spec):
+    """Clone or fetch one repository and configure its fork remote and pushDefault
+
+    Returns (action, notes): action is cloned or fetched, notes lists the
+    remote settings that changed.
+    """
+    if (spec.path / '.git').exists():
+        action = 'fetched'
+        remotes, push_default = remote_config(spec.path)
+        if remotes.get('origin') != spec.url:
+            raise SyncError(f"origin of {spec.path} is {remotes.get('origin')}, not {spec.url}")
+        if git(spec.path, 'fetch', '--quiet', '--prune', 'origin').returncode != 0:
+            raise SyncError(f"Could not fetch {spec.url}")
+    else:
+        action = 'cloned'
+        clone(spec)
+        remotes, push_default = {'origin': spec.url}, None
+
+    notes = []
+    if spec.fork and remotes.get(spec.fork_remote) != spec.fork:
+        if spec.fork_remote in remotes:
+            result = git(spec.path, 'remote', 'set-url', spec.fork_remote, spec.fork)
+        else:
+            result = git(spec.path, 'remote', 'add', spec.fork_remote, spec.fork)
+        if result.returncode != 0:
+            raise SyncError(f"Could not configure the {spec.fork_remote} remote")
+        notes.append(f"{spec.fork_remote} -> {spec.fork}")
+    if spec.push_default and push_default != spec.push_default:
+        if git(spec.path, 'config', 'remote.pushDefault', spec.push_default).returncode != 0:
+            raise SyncError("Could not set remote.pushDefault")
+        notes.append(f"pushDefault {spec.push_default}")
+    return action, notes
+
+
+def print_report(reports):
+    """Table of per-repository outcomes, slowest first"""
+    width = max([len(r['path']) for r in reports] + [4])
+    print(f"\n{'repo':<{width}} {'status':<8} {'action':<8} {'time':>8}  notes")
+    for report in sorted(reports, key=lambda r: r['duration'], reverse=True):
+        print(f"{report['path']:<{width}} {report['status']:<8} {report['action'] or '-':<8} "
+              f"{report['duration']:>7.1f}s  {', '.join(report['notes'])}")
+    failed = sum(1 for r in reports if r['status'] != 'done')
+    durations = sorted(r['duration'] for r in reports)
+    if durations:
+        print(f"\n{len(reports) - failed}/{len(reports)} repositories synced, "
+              f"median {durations[len(durations) // 2]:.1f}s, slowest {durations[-1]:.1f}s")
@@ -0,0 +1,249 @@
+"""Zsh startup profiling and the managed .zshrc blocks that make startup fast"""
+
+import os
+import pwd
+import re
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from provisioning.runner import run
+
+BLOCK_BEGIN = '# >>> fedora-scripts {} >>>'
+BLOCK_END = '# <<< fedora-scripts {} <<<'
+
+# Must stay at the very top of .zshrc, before anything that may print or prompt
+INSTANT_PROMPT_BLOCK = '''\
+if [[ -r "${XDG_CACHE_HOME:-$HOME/.cache}/p10k-instant-prompt-${(%):-%n}.zsh" ]]; then
+  source "${XDG_CACHE_HOME:-$HOME/.cache}/p10k-instant-prompt-${(%):-%n}.zsh"
+fi'''
+
+# Oh My Zsh plugins that are slow to load, and the commands that load them on first use
+LAZY_PLUGINS = {
+    'nvm': ['nvm', 'node', 'npm', 'npx'],
+    'pyenv': ['pyenv'],
+    'rbenv': ['rbenv'],
+    'kubectl': ['kubectl'],
+    'docker': ['docker'],
+    'docker-compose': ['docker-compose'],
+}
+
+# The docker group line older versions appended; it re-executed every new shell
+NEWGRP_LINE = re.compile(r'^.*exec newgrp docker.*\n?', re.MULTILINE)
+PLUGINS_LINE = re.compile(r'^plugins=\(([^)]*)\)[ \t]*$', re.MULTILINE)
+LAZY_LOADED = re.compile(r'_fedora_scripts_lazy (\S+)')
+THEME_LINE = re.compile(r'^ZSH_THEME=.*$', re.MULTILINE)
+
+ZCOMPILE_SCRIPT = '''\
+setopt extended_glob
+for f in ~/.zshrc ~/.p10k.zsh(N) ~/.zcompdump*~*.zwc(N); do
+  if [[ ! -s $f.zwc || $f -nt $f.zwc ]]; then zcompile -R -- $f || exit 1; fi
+done'''
+
+
+def render_blocks(text, blocks, top=()):
+    """text with each named block replaced where it is, or added at the top or bottom
+
+    blocks maps a name to its body; a body of None removes the block.
+    Names in top are inserted before everything else when missing.
+    """
+    pending = dict(blocks)
+    lines = text.splitlines(keepends=True)
+    out = []
+    skipping = None
+    for line in lines:
+        if skipping:
+            if line.rstrip('\n') == BLOCK_END.format(skipping):
+                skipping = None
+            continue
+        name = next((n for n in blocks if line.rstrip('\n') == BLOCK_BEGIN.format(n)), None)
+        if name:
+            skipping = name
+            if name in pending and pending[name] is not None:
+                out.append(_block(name, pending[name]))
+            pending.pop(name, None)
+            continue
+        out.append(line)
+
+    body = ''.join(out)
+    if body and not body.endswith('\n'):
+        body += '\n'
+    head = ''.join(_block(n, pending.pop(n)) for n in top if pending.get(n) is not None)
+    tail = ''.join(_block(n, b) for n, b in pending.items() if b is not None)
+    return head + body + tail
+
+
+def strip_line(text, line):
+    """text without a whole line, and the blank line appended before it"""
+    return re.sub(rf'^\n?{re.escape(line)}[ \t]*(\n|\Z)', '', text, flags=re.MULTILINE)
+
+
+def _block(name, body):
+    return f"{BLOCK_BEGIN.format(name)}\n{body.rstrip()}\n{BLOCK_END.format(name)}\n"
+
+
+def write_atomically(path, text):
+    """Replace path with text in one rename, keeping the owner and mode of the old file"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        if path.exists():
+            st = path.stat()
+            os.chmod(tmp, st.st_mode & 0o7777)
+            if os.geteuid() == 0:
+                os.chown(tmp, st.st_uid, st.st_gid)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def update_blocks(path, blocks, top=(), strip=()):
+    """Write managed blocks into a file in one atomic write; returns whether it changed
+
+    strip lists lines, outside any block, that the blocks replace.
+    """
+    path = Path(path)
+    old = path.read_text() if path.exists() else ''
+    text = old
+    for line in strip:
+        text = strip_line(text, line)
+    text = render_blocks(text, blocks, top)
+    if text == old:
+        return False
+    write_atomically(path, text)
+    return True
+
+
+def lazy_plugin_block(plugins):
+    """Shell functions that load each plugin the first time one of its commands runs"""
+    lines = ['_fedora_scripts_lazy() {',
+             '  local plugin=$1; shift',
+             '  unfunction "$@" 2>/dev/null',
+             '  source "$ZSH/plugins/$plugin/$plugin.plugin.zsh"',
+             '}']
+    for plugin in plugins:
+        commands = LAZY_PLUGINS[plugin]
+        for command in commands:
+            lines.append(f'{command}() {{ _fedora_scripts_lazy {plugin} {" ".join(commands)}; {command} "$@" }}')
+    return '\n'.join(lines)
+
+
+def optimized_zshrc(text, theme_line=None):
+    """The optimized .zshrc for text, and the plugins it now loads lazily"""
+    text = NEWGRP_LINE.sub('', text)
+
+    # Plugins moved by an earlier run stay lazy
+    lazy = [p for p in dict.fromkeys(LAZY_LOADED.findall(text)) if p in LAZY_PLUGINS]
+    match = PLUGINS_LINE.search(text)
+    if match:
+        plugins = match.group(1).split()
+        lazy += [p for p in plugins if p in LAZY_PLUGINS and p not in lazy]
+        eager = [p for p in plugins if p not in LAZY_PLUGINS]
+        text = text[:match.start()] + f"plugins=({' '.join(eager)})" + text[match.end():]
+
+    blocks = {'p10k-instant-prompt': INSTANT_PROMPT_BLOCK,
+              'lazy-plugins': lazy_plugin_block(lazy) if lazy else None}
+    if theme_line and theme_line in text:
+        # Powerlevel10k replaces the Oh My Zsh theme, so loading one is wasted time
+        text = THEME_LINE.sub('ZSH_THEME=""', text)
+        text = strip_line(text, theme_line)
+        blocks['powerlevel10k'] = theme_line
+    return render_blocks(text, blocks, top=['p10k-instant-prompt']), lazy
+
+
+def optimize_zshrc(path, theme_line=None):
+    """Rewrite .zshrc once with the optimized configuration; returns the lazily loaded plugins"""
+    path = Path(path)
+    old = path.read_text()
+    text, lazy = optimized_zshrc(old, theme_line)
+    if text != old:
+        write_atomically(path, text)
+    return lazy
+
+
+def zsh_argv(user, home, *args, env=()):
+    """zsh invocation as user, who may differ from the user running the script"""
+    argv = ['env', f"HOME={home}", *env, 'zsh', *args]
+    if user and user != pwd.getpwuid(os.geteuid()).pw_name:
+        argv = ['sudo', '-u', user, *argv]
+    return argv
+
+
+def zcompile_startup_files(user, home):
+    """Byte-compile .zshrc, .p10k.zsh and the completion dumps that are out of date"""
+    return run(zsh_argv(user, home, '-fc', ZCOMPILE_SCRIPT)).returncode == 0
+
+
+def drop_page_cache():
+    """Evict cached file data so the next launch reads from disk; needs root"""
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('1\n')
+        return True
+    except OSError:
+        return False
+
+
+def _time_launch(user, home):
+    start = time.perf_counter()
+    run(zsh_argv(user, home, '-i', '-c', 'exit'), capture=True)
+    return time.perf_counter() - start
+
+
+def measure_startup(user, home, runs=10, cold_runs=3):
+    """Seconds per interactive launch, cold (page cache dropped) and warm
+
+    Without root the page cache cannot be dropped and the cold numbers
+    are the first launches of the run instead.
+    """
+    cold = []
+    for _ in range(cold_runs):
+        drop_page_cache()
+        cold.append(_time_launch(user, home))
+    warm = [_time_launch(user, home) for _ in range(runs)]
+    return {'cold': cold, 'warm': warm}
+
+
+def zprof(user, home, limit=15):
+    """Top of the zsh/zprof report for one interactive launch of the user's .zshrc"""
+    zdotdir = tempfile.mkdtemp(prefix='zprof-')
+    try:
+        if os.path.exists(os.path.join(home, '.zshenv')):
+            Path(zdotdir, '.zshenv').write_text(f'source "{home}/.zshenv"\n')
+        Path(zdotdir, '.zshrc').write_text(
+            f'zmodload zsh/zprof\nZDOTDIR="{home}"\nsource "{home}/.zshrc"\nzprof | head -n {limit + 3}\n')
+        if os.geteuid() == 0:
+            owner = os.stat(home)
+            for entry in [zdotdir, *Path(zdotdir).iterdir()]:
+                os.chown(entry, owner.st_uid, owner.st_gid)
+        result = run(zsh_argv(user, home, '-i', '-c', 'exit', env=[f"ZDOTDIR={zdotdir}"]), capture=True)
+        return result.stdout.decode(errors='replace').rstrip()
+    finally:
+        shutil.rmtree(zdotdir, ignore_errors=True)
+
+
+def summarize(samples):
+    """Median, 90th percentile and best time of samples, in milliseconds"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    p90 = ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))]
+    return {'median': statistics.median(ordered) * 1000, 'p90': p90 * 1000, 'best': ordered[0] * 1000}
+
+
+def print_comparison(before, after):
+    """Table of startup times before and after optimizing"""
+    print(f"\n{'zsh -i -c exit':<22} {'before':>10} {'after':>10} {'change':>8}")
+    for kind in ('cold', 'warm'):
+        old, new = summarize(before[kind]), summarize(after[kind])
+        if not old or not new:
+            continue
+        for stat in ('median', 'p90', 'best'):
+            change = (new[stat] - old[stat]) / old[stat] * 100 if old[stat] else 0.0
+            print(f"{kind + ' ' + stat:<22} {old[stat]:>8.0f}ms {new[stat]:>8.0f}ms {change:>+7.0f}%")
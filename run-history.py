@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+import time
+
+from provisioning.run_history import (DEFAULT_THRESHOLD, DEFAULT_WINDOW, RunHistory, default_history_path,
+                                      print_report)
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Show how long provisioning runs took over time")
+    parser.add_argument('--db', default=str(default_history_path()),
+                        help="history database (default: the one runs as this user write to)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    report = commands.add_parser('report', help="percentiles per step and steps slower than their baseline")
+    report.add_argument('--script', help="only runs of this script, e.g. fedora-install.py")
+    report.add_argument('--days', type=float, help="only runs from the last this many days")
+    report.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help="previous runs whose median is a step's baseline")
+    report.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="flag steps whose latest run took this many times their baseline")
+    report.add_argument('--fail-on-regression', action='store_true',
+                        help="exit with status 2 when a step is flagged")
+
+    runs = commands.add_parser('runs', help="list recorded runs, newest first")
+    runs.add_argument('--script', help="only runs of this script")
+    runs.add_argument('--limit', type=int, default=20, help="number of runs to list")
+    return parser.parse_args(argv)
+
+def list_runs(history, script, limit):
+    """Print recent runs with their revision and host"""
+    print(f"{'started':<17} {'script':<22} {'status':<7} {'time':>9} {'MiB':>8} {'revision':<10} host")
+    for run in history.runs(script, limit=limit):
+        facts = json.loads(run['host'])
+        started = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started']))
+        print(f"{started:<17} {run['script']:<22} {run['status']:<7} {run['duration']:>8.1f}s "
+              f"{run['downloaded'] / 1024 ** 2:>8.1f} {(run['revision'] or '-')[:10]:<10} "
+              f"{facts.get('hostname')} ({facts.get('os')}, {facts.get('kernel')})")
+
+def main(args):
+    """Run the requested subcommand"""
+    try:
+        history = RunHistory(args.db)
+    except OSError as e:
+        print(f"Could not open {args.db}: {e}")
+        return 1
+    try:
+        if args.command == 'runs':
+            list_runs(history, args.script, args.limit)
+            return 0
+        since = time.time() - args.days * 86400 if args.days else None
+        regressed = print_report(history, args.script, since, args.window, args.threshold)
+        return 2 if regressed and args.fail_on_regression else 0
+    finally:
+        history.close()
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+from provisioning.sunshine_unit import (DEFAULT_NICE, DEFAULT_SCHED_POLICY, SCHED_POLICIES, UnitError,
+                                        install_unit, performance_cpus, render_unit, unit_path)
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Install or update the streaming-tuned Sunshine systemd unit")
+    parser.add_argument('--scope', choices=['user', 'system'], default='user',
+                        help="service manager the unit is installed into")
+    parser.add_argument('--exec-start', default='/usr/bin/sunshine',
+                        help="Sunshine binary the unit starts")
+    parser.add_argument('--user', help="account a system unit runs Sunshine as")
+    parser.add_argument('--cpus', metavar='LIST',
+                        help="CPUs Sunshine is pinned to (default: the performance cores of a hybrid CPU, "
+                             "otherwise all); an empty string disables pinning")
+    parser.add_argument('--nice', type=int, default=DEFAULT_NICE,
+                        help="nice level of a system unit")
+    parser.add_argument('--sched', choices=SCHED_POLICIES, default=DEFAULT_SCHED_POLICY,
+                        help="CPU scheduling policy of a system unit")
+    parser.add_argument('--print', action='store_true',
+                        help="print the unit instead of installing it")
+    return parser.parse_args(argv)
+
+def main(args):
+    """Render the unit and install it if it changed"""
+    cpus = args.cpus if args.cpus is not None else performance_cpus()
+    text = render_unit(args.exec_start, scope=args.scope, user=args.user, cpus=cpus or None,
+                       nice=args.nice, sched_policy=args.sched)
+    if args.print:
+        print(text, end='')
+        return True
+    try:
+        install_unit(unit_path(args.scope), text, scope=args.scope)
+    except UnitError as e:
+        print(e)
+        return False
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main(parse_args()) else 1)
@@ -5,26 +5,7 @@ sudo dnf copr enable -y lizardbyte/sunshine
 # Package installation  
 sudo dnf install -y sunshine  
 
-# Service configuration  
-mkdir -p ~/.config/systemd/user/  
-cat <<EOF > ~/.config/systemd/user/sunshine.service  
-[Unit]
-Description=Sunshine Game Streaming
-After=graphical-session.target
-Wants=network-online.target
-Requires=dbus.socket
-
-[Service]
-ExecStart=/usr/bin/sunshine
-Environment=DISPLAY=:0
-Restart=on-failure
-RestartSec=5
-PrivateNetwork=yes
-
-[Install]
-WantedBy=graphical-session.target  
-EOF
+# Service configuration, the unit is only rewritten (and Sunshine restarted) when it changes
+python3 "$(dirname "$0")/sunshine-unit.py" --scope user --exec-start /usr/bin/sunshine
 
 loginctl enable-linger $USER  
-systemctl --user daemon-reload  
-systemctl --user enable --now sunshine.service  
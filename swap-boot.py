@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+from provisioning.boot_switch import (DEFAULT_BOOT_ROOTS, BootSwitchError, execute, find_kexec_target,
+                                      plan_switch, read_boot_config)
+from provisioning.host_facts import host
+from provisioning.runner import finish_run
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Switch between Fedora and Pop!_OS")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="print the plan without changing anything or rebooting")
+    parser.add_argument('--no-kexec', action='store_true',
+                        help="always reboot through the firmware")
+    parser.add_argument('--once', action='store_true',
+                        help="only set BootNext, so later cold boots keep starting the current OS")
+    parser.add_argument('--boot-root', action='append', metavar='DIR',
+                        help="directory holding loader/entries of the other OS, e.g. its mounted /boot "
+                             f"(default: {', '.join(DEFAULT_BOOT_ROOTS)})")
+    parser.add_argument('--efibootmgr-output', metavar='FILE',
+                        help="read captured efibootmgr output instead of running it (implies --dry-run)")
+    parser.add_argument('--os-id', help="os-release ID of the running OS (default: read from /etc/os-release)")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace-event JSON of every command")
+    args = parser.parse_args(argv)
+    if args.efibootmgr_output:
+        args.dry_run = True
+    return args
+
+def main(args):
+    """Plan the switch, print it and carry it out unless this is a dry run"""
+    if args.dry_run:
+        print("Dry run mode activated: No changes will be made.")
+    current = args.os_id or host.os_release.get('ID', '')
+    try:
+        config = read_boot_config(args.efibootmgr_output)
+        plan = plan_switch(config, current, once=args.once)
+        if not args.no_kexec:
+            plan.kexec = find_kexec_target(plan.target, args.boot_root or DEFAULT_BOOT_ROOTS)
+            if plan.kexec is None:
+                print(f"No boot loader entry of the other OS under {', '.join(args.boot_root or DEFAULT_BOOT_ROOTS)}, "
+                      "mount its /boot and pass --boot-root to switch with kexec.")
+        for line in plan.describe():
+            print(line)
+        if args.dry_run:
+            print("Dry run mode: No changes have been made.")
+            print("Dry run mode: System will not reboot.")
+            return True
+        return execute(plan)
+    except BootSwitchError as e:
+        print(e)
+        return False
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace)
+    sys.exit(0 if succeeded else 1)
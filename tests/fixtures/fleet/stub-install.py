@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Stand-in provisioning script for fleet runs: one step running a command, one failing with --fail"""
+
+import argparse
+import sys
+
+from provisioning.runner import finish_run, run, step
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--fail', action='store_true')
+parser.add_argument('--summary-json')
+args = parser.parse_args()
+
+with step('greet'):
+    run(['echo', 'hello from the stub'])
+succeeded = True
+try:
+    with step('configure'):
+        if args.fail:
+            raise RuntimeError('configure failed')
+except RuntimeError:
+    succeeded = False
+finish_run(summary_path=args.summary_json)
+sys.exit(0 if succeeded else 1)
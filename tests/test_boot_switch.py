@@ -0,0 +1,146 @@
+"""efibootmgr parsing and switch planning against captured efibootmgr output and boot loader entries"""
+
+from pathlib import Path
+
+import pytest
+
+from provisioning.boot_switch import (OPERATING_SYSTEMS, BootSwitchError, find_kexec_target, parse_efibootmgr,
+                                      plan_switch, read_boot_config)
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'efibootmgr'
+
+
+def test_parse_plain_output():
+    config = read_boot_config(FIXTURES / 'fedora-first.txt')
+    assert config.current == '0001'
+    assert config.next is None
+    assert config.timeout == '1 seconds'
+    assert config.order == ['0001', '0000', '0003', '0002']
+    assert config.entries['0000'].label == 'Pop!_OS 22.04 LTS'
+    assert config.entries['0002'].label == 'UEFI: PXE IPv4 Intel(R) Ethernet Controller'
+    assert not config.entries['0002'].active
+    assert config.entries['0001'].device_path == ''
+
+
+def test_parse_verbose_output():
+    config = read_boot_config(FIXTURES / 'pop-verbose.txt')
+    assert config.current == '0000'
+    assert config.next == '0003'
+    assert config.entries['0000'].label == 'Pop!_OS 22.04 LTS'
+    assert config.entries['0001'].device_path.startswith('HD(1,GPT,')
+    assert config.entries['0001'].device_path.endswith(r'File(\EFI\fedora\shimx64.efi)')
+
+
+def test_parse_verbose_output_without_tabs():
+    config = read_boot_config(FIXTURES / 'pop-verbose-old.txt')
+    assert config.entries['0000'].label == 'Pop!_OS 22.04 LTS'
+    assert config.entries['0001'].label == 'Fedora'
+    assert config.entries['0004'].label == 'Windows Boot Manager'
+    assert config.entries['0004'].device_path.startswith('VenHw(')
+
+
+def test_parse_without_entries():
+    with pytest.raises(BootSwitchError):
+        parse_efibootmgr("BootCurrent: 0001\nBootOrder: 0001\n")
+
+
+def test_matching_ranks_boot_order_first():
+    config = read_boot_config(FIXTURES / 'pop-verbose.txt')
+    assert config.matching(OPERATING_SYSTEMS['fedora'][1]) == ['0003', '0001']
+    assert config.matching(OPERATING_SYSTEMS['pop'][1]) == ['0000']
+
+
+def test_plan_moves_the_other_os_to_the_front():
+    config = read_boot_config(FIXTURES / 'fedora-first.txt')
+    plan = plan_switch(config, 'fedora')
+    assert plan.target == 'pop'
+    assert plan.boot_order == ['0000', '0001', '0003', '0002']
+    assert plan.boot_next is None
+    assert plan.describe()[-1] == "Rebooting through the firmware."
+
+
+def test_plan_keeps_every_entry_of_both_systems_in_front():
+    plan = plan_switch(read_boot_config(FIXTURES / 'pop-verbose.txt'), 'pop')
+    assert plan.target == 'fedora'
+    assert plan.boot_order == ['0003', '0001', '0000']
+
+
+def test_plan_once_only_sets_boot_next():
+    config = read_boot_config(FIXTURES / 'fedora-first.txt')
+    plan = plan_switch(config, 'fedora', once=True)
+    assert plan.boot_order is None
+    assert plan.boot_next == '0000'
+    assert config.order == ['0001', '0000', '0003', '0002']
+
+
+def test_plan_without_an_entry_for_the_other_os():
+    config = parse_efibootmgr("BootCurrent: 0001\nBootOrder: 0001\nBoot0001* Fedora\n")
+    with pytest.raises(BootSwitchError):
+        plan_switch(config, 'fedora')
+    with pytest.raises(BootSwitchError):
+        plan_switch(config, 'ubuntu')
+
+
+def write_entry(root, name, **keys):
+    entries = root / 'loader' / 'entries'
+    entries.mkdir(parents=True, exist_ok=True)
+    lines = []
+    for key, value in keys.items():
+        for item in value if isinstance(value, list) else [value]:
+            lines.append(f"{key} {item}")
+    (entries / name).write_text('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def boot_roots(tmp_path):
+    """A /boot with Fedora's BLS entries and an ESP with Pop!_OS's systemd-boot entries"""
+    boot, esp = tmp_path / 'boot', tmp_path / 'efi'
+    for version in ('6.8.5-301.fc40.x86_64', '6.10.3-200.fc40.x86_64'):
+        write_entry(boot, f"0123abcd-{version}.conf", title=f"Fedora Linux ({version}) 40 (Workstation Edition)",
+                    version=version, linux=f"/vmlinuz-{version}", initrd=f"/initramfs-{version}.img",
+                    options='$kernelopts rhgb quiet')
+    write_entry(boot, '0123abcd-0-rescue.conf', title='Fedora Linux (0-rescue-0123abcd) 40 (Workstation Edition)',
+                version='0-rescue-0123abcd', linux='/vmlinuz-0-rescue-0123abcd', options='$kernelopts')
+    (boot / 'grub2').mkdir()
+    (boot / 'grub2' / 'grubenv').write_text("# GRUB Environment Block\nkernelopts=root=UUID=f00d ro\n")
+
+    write_entry(esp, 'Pop_OS-current.conf', title='Pop!_OS', linux='/EFI/Pop_OS-3c1b/vmlinuz.efi',
+                initrd=['/EFI/Pop_OS-3c1b/intel-ucode.img', '/EFI/Pop_OS-3c1b/initrd.img'],
+                options='root=UUID=beef ro  quiet splash')
+    write_entry(esp, 'Pop_OS-oldkern.conf', title='Pop!_OS', linux='/EFI/Pop_OS-3c1b/vmlinuz-previous.efi',
+                options='root=UUID=beef ro quiet splash')
+    return [str(esp), str(boot)]
+
+
+def test_kexec_target_is_the_newest_fedora_kernel(boot_roots):
+    target = find_kexec_target('fedora', boot_roots)
+    boot = boot_roots[1]
+    assert target.kernel == f"{boot}/vmlinuz-6.10.3-200.fc40.x86_64"
+    assert target.initrds == [f"{boot}/initramfs-6.10.3-200.fc40.x86_64.img"]
+    assert target.options == 'root=UUID=f00d ro rhgb quiet'
+
+
+def test_kexec_target_prefers_the_current_entry(boot_roots):
+    target = find_kexec_target('pop', boot_roots)
+    esp = boot_roots[0]
+    assert target.title == 'Pop!_OS'
+    assert target.kernel == f"{esp}/EFI/Pop_OS-3c1b/vmlinuz.efi"
+    assert target.initrds == [f"{esp}/EFI/Pop_OS-3c1b/intel-ucode.img", f"{esp}/EFI/Pop_OS-3c1b/initrd.img"]
+    assert target.options == 'root=UUID=beef ro quiet splash'
+
+
+def test_kexec_target_skips_rescue_entries(tmp_path):
+    write_entry(tmp_path, '0123abcd-0-rescue.conf', title='Fedora Linux (0-rescue-0123abcd)',
+                linux='/vmlinuz-0-rescue-0123abcd')
+    assert find_kexec_target('fedora', [str(tmp_path)]) is None
+
+
+def test_kexec_target_missing(boot_roots):
+    assert find_kexec_target('pop', boot_roots[1:]) is None
+
+
+def test_plan_with_kexec(boot_roots):
+    target = find_kexec_target('pop', boot_roots)
+    plan = plan_switch(read_boot_config(FIXTURES / 'fedora-first.txt'), 'fedora', kexec_target=target)
+    assert plan.kexec is target
+    assert f"kexec into Pop!_OS: {target.kernel}" in plan.describe()
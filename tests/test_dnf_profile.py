@@ -0,0 +1,120 @@
+"""dnf.conf performance profile rendering and its restore, against sample dnf4 and dnf5 configurations"""
+
+import configparser
+import shutil
+from pathlib import Path
+
+import pytest
+
+from provisioning import dnf_profile as module
+from provisioning.dnf_profile import BACKUP_SUFFIX, dnf_profile, profile_settings, render_profile, restore_interrupted
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'dnf'
+
+
+def main_section(text):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_string(text)
+    return dict(parser['main']), parser
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    """Copy a sample dnf.conf to tmp_path, written directly as root would"""
+    monkeypatch.setattr(module.os, 'geteuid', lambda: 0)
+
+    def copy(name, crlf=False):
+        path = tmp_path / 'dnf.conf'
+        data = (FIXTURES / name).read_bytes()
+        path.write_bytes(data.replace(b'\n', b'\r\n') if crlf else data)
+        return path
+    return copy
+
+
+def test_profile_settings():
+    assert profile_settings(10, dnf5=False) == {'max_parallel_downloads': '10', 'fastestmirror': 'True',
+                                                'keepcache': 'True', 'deltarpm': 'False'}
+    # dnf5 dropped delta RPMs
+    assert 'deltarpm' not in profile_settings(10, dnf5=True)
+
+
+def test_profile_settings_cache_dir():
+    assert profile_settings(4, '/srv/dnf-cache', dnf5=False)['cachedir'] == '/srv/dnf-cache'
+    settings = profile_settings(4, '/srv/dnf-cache', dnf5=True)
+    assert settings['system_cachedir'] == '/srv/dnf-cache'
+    assert 'cachedir' not in settings
+
+
+def test_render_dnf4_profile():
+    text = (FIXTURES / 'dnf4.conf').read_text()
+    main, parser = main_section(render_profile(text, profile_settings(10, '/srv/dnf-cache', dnf5=False)))
+    assert main['max_parallel_downloads'] == '10'
+    assert main['deltarpm'] == 'False'
+    assert main['cachedir'] == '/srv/dnf-cache'
+    assert (main['fastestmirror'], main['keepcache']) == ('True', 'True')
+    # Options the profile does not manage, comments and other sections are left alone
+    assert main['installonly_limit'] == '3'
+    assert '# Raised by hand on a slow link' in render_profile(text, profile_settings(10, dnf5=False))
+    assert dict(parser['local'])['max_parallel_downloads'] == '2'
+
+
+def test_render_dnf5_profile():
+    text = (FIXTURES / 'dnf5.conf').read_text()
+    rendered = render_profile(text, profile_settings(10, '/srv/dnf-cache', dnf5=True))
+    main, _ = main_section(rendered)
+    assert main == {'fastestmirror': 'True', 'max_parallel_downloads': '10', 'keepcache': 'True',
+                    'system_cachedir': '/srv/dnf-cache'}
+    assert rendered.startswith('# see `man dnf.conf`')
+    assert rendered.count('fastestmirror') == 1
+
+
+def test_render_without_main_section():
+    assert main_section(render_profile('', {'keepcache': 'True'}))[0] == {'keepcache': 'True'}
+
+
+def test_render_is_stable():
+    settings = profile_settings(10, dnf5=False)
+    once = render_profile((FIXTURES / 'dnf4.conf').read_text(), settings)
+    assert render_profile(once, settings) == once
+
+
+@pytest.mark.parametrize('name, crlf', [('dnf4.conf', False), ('dnf5.conf', False), ('dnf4.conf', True)])
+def test_profile_is_restored_byte_for_byte(conf, tmp_path, name, crlf):
+    path = conf(name, crlf)
+    original = path.read_bytes()
+    with dnf_profile(profile_settings(10, dnf5=name == 'dnf5.conf'), path, cache_dirs=[tmp_path / 'cache']):
+        assert path.read_bytes() != original
+        assert Path(f"{path}{BACKUP_SUFFIX}").read_bytes() == original
+    assert path.read_bytes() == original
+    assert not Path(f"{path}{BACKUP_SUFFIX}").exists()
+
+
+def test_profile_is_restored_when_the_block_fails(conf, tmp_path):
+    path = conf('dnf4.conf')
+    original = path.read_bytes()
+    with pytest.raises(RuntimeError):
+        with dnf_profile(profile_settings(10, dnf5=False), path, cache_dirs=[tmp_path / 'cache']):
+            raise RuntimeError
+    assert path.read_bytes() == original
+
+
+def test_interrupted_run_is_restored(conf):
+    path = conf('dnf5.conf', crlf=True)
+    original = path.read_bytes()
+    shutil.copy(path, f"{path}{BACKUP_SUFFIX}")
+    path.write_text(render_profile(path.read_text(), profile_settings(10, dnf5=True)))
+
+    restore_interrupted(path)
+    assert path.read_bytes() == original
+    assert not Path(f"{path}{BACKUP_SUFFIX}").exists()
+
+
+def test_keep_leaves_the_profile_in_place(conf, tmp_path):
+    path = conf('dnf4.conf')
+    settings = profile_settings(10, dnf5=False)
+    with dnf_profile(settings, path, keep=True, cache_dirs=[tmp_path / 'cache']):
+        profiled = path.read_bytes()
+    assert path.read_bytes() == profiled
+    assert main_section(path.read_text())[0]['max_parallel_downloads'] == '10'
+    # Nothing is left for the next run to restore
+    assert not Path(f"{path}{BACKUP_SUFFIX}").exists()
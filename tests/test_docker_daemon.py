@@ -0,0 +1,138 @@
+"""daemon.json merging and the reload/restart decision against sample configurations"""
+
+import json
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from provisioning import docker_daemon as module
+from provisioning.docker_daemon import (DOCKER_DEFAULTS, DaemonConfigError, DockerDaemon, effective_config,
+                                        managed_settings, needs_restart, render_config)
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'docker'
+
+
+@pytest.fixture
+def sample(tmp_path):
+    """Copy a sample daemon.json next to the test, so a write never touches the fixture"""
+    def copy(name):
+        path = tmp_path / 'daemon.json'
+        if name:
+            shutil.copy(FIXTURES / name, path)
+        return DockerDaemon(path)
+    return copy
+
+
+@pytest.fixture
+def systemctl(monkeypatch):
+    """Records the commands apply runs, with Docker running unless told otherwise"""
+    class Systemctl:
+        active = True
+        commands = []
+
+    def run(argv, capture=False, **kwargs):
+        Systemctl.commands.append(argv)
+        returncode = 3 if argv[1:2] == ['is-active'] and not Systemctl.active else 0
+        return subprocess.CompletedProcess(argv, returncode)
+
+    monkeypatch.setattr(module, 'run', run)
+    monkeypatch.setattr(DockerDaemon, 'write', lambda self, config: self.path.write_text(render_config(config)))
+    return Systemctl
+
+
+def actions(commands):
+    """The systemctl verbs apply ran through sudo"""
+    return [argv[2] for argv in commands if argv[:2] == ['sudo', 'systemctl']]
+
+
+def test_effective_config_fills_in_defaults():
+    assert effective_config({}) == DOCKER_DEFAULTS
+    assert effective_config({'live-restore': True, 'debug': True}) == {**DOCKER_DEFAULTS, 'live-restore': True,
+                                                                      'debug': True}
+
+
+def test_plan_from_no_file(sample):
+    current, merged, keys = sample(None).plan(managed_settings())
+    assert current == {}
+    assert merged == json.loads((FIXTURES / 'daemon-managed.json').read_text())
+    assert keys == ['live-restore', 'log-opts', 'max-concurrent-downloads']
+
+
+def test_plan_ignores_spelled_out_defaults(sample):
+    current, merged, keys = sample('daemon-defaults.json').plan(managed_settings())
+    assert current['max-concurrent-downloads'] == 3
+    assert keys == ['live-restore', 'log-opts', 'max-concurrent-downloads']
+
+
+def test_plan_keeps_foreign_keys(sample):
+    _, merged, keys = sample('daemon-custom.json').plan(managed_settings(nvidia=True))
+    assert merged['data-root'] == '/srv/docker'
+    assert merged['registry-mirrors'] == ['https://mirror.example.com']
+    assert merged['log-opts'] == {'labels': 'com.example.app', 'max-size': '20m', 'max-file': '5'}
+    assert set(merged['runtimes']) == {'crun', 'nvidia'}
+    assert 'data-root' not in keys and 'runtimes' in keys
+
+
+def test_plan_of_managed_config_changes_nothing(sample):
+    current, merged, keys = sample('daemon-managed.json').plan(managed_settings())
+    assert merged == current
+    assert keys == []
+
+
+def test_plan_rejects_a_half_edit(sample):
+    with pytest.raises(DaemonConfigError):
+        sample('daemon-invalid.json').plan(managed_settings())
+
+
+@pytest.mark.parametrize('keys, restart', [
+    ([], False),
+    (['live-restore', 'max-concurrent-downloads', 'max-concurrent-uploads'], False),
+    (['registry-mirrors', 'runtimes', 'debug'], False),
+    (['log-opts'], True),
+    (['max-concurrent-downloads', 'storage-driver'], True),
+    (['data-root'], True),
+])
+def test_needs_restart(keys, restart):
+    assert needs_restart(keys) == restart
+
+
+def test_needs_restart_for_the_sample_configs(sample):
+    assert needs_restart(sample(None).plan(managed_settings())[2])
+    _, _, keys = sample('daemon-btrfs.json').plan(managed_settings())
+    assert 'storage-driver' in keys and needs_restart(keys)
+
+
+def test_apply_reloads_for_reloadable_keys(sample, systemctl):
+    daemon = sample('daemon-managed.json')
+    settings = {**managed_settings(), 'max-concurrent-downloads': 12}
+    assert daemon.apply(settings) == ['max-concurrent-downloads']
+    assert actions(systemctl.commands) == ['reload']
+    assert json.loads(daemon.path.read_text())['max-concurrent-downloads'] == 12
+
+
+def test_apply_enables_live_restore_before_restarting(sample, systemctl):
+    sample(None).apply(managed_settings())
+    assert actions(systemctl.commands) == ['reload', 'restart']
+
+
+def test_apply_leaves_a_running_daemon_alone(sample, systemctl):
+    daemon = sample('daemon-managed.json')
+    assert daemon.apply(managed_settings()) == []
+    assert actions(systemctl.commands) == []
+
+
+@pytest.mark.parametrize('name', ['daemon-managed.json', 'daemon-defaults.json', None])
+def test_apply_starts_a_stopped_daemon(sample, systemctl, name):
+    systemctl.active = False
+    sample(name).apply(managed_settings())
+    assert actions(systemctl.commands) == ['start']
+
+
+def test_apply_starts_a_stopped_daemon_when_only_defaults_are_written(sample, systemctl):
+    systemctl.active = False
+    daemon = sample(None)
+    assert daemon.apply({'storage-driver': 'overlay2'}) == []
+    assert daemon.path.exists()
+    assert actions(systemctl.commands) == ['start']
@@ -0,0 +1,114 @@
+"""DownloadCache against a local HTTP server standing in for upstream"""
+
+import email.utils
+import http.server
+import threading
+import urllib.request
+
+import pytest
+
+from provisioning.download_cache import DownloadCache, DownloadError
+
+LAST_MODIFIED = email.utils.formatdate(0, usegmt=True)
+
+
+class Upstream(http.server.BaseHTTPRequestHandler):
+    """Serves files from a dict, answering conditional requests with 304"""
+
+    files = {}
+    requests = []
+    use_etag = True
+
+    def do_GET(self):
+        type(self).requests.append((self.path, dict(self.headers)))
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = f'"{len(body)}-{hash(body)}"'
+        if (self.use_etag and self.headers.get('If-None-Match') == etag) or \
+                (not self.use_etag and self.headers.get('If-Modified-Since') == LAST_MODIFIED):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.use_etag:
+            self.send_header('ETag', etag)
+        else:
+            self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    Upstream.files = {'/a.rpm': b'a' * 100, '/b.rpm': b'b' * 100, '/c.rpm': b'c' * 100}
+    Upstream.requests = []
+    Upstream.use_etag = True
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # Never send the local requests through a proxy from the environment
+    urllib.request.install_opener(urllib.request.build_opener(urllib.request.ProxyHandler({})))
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    urllib.request.install_opener(None)
+    server.shutdown()
+    server.server_close()
+
+
+def test_etag_revalidation(tmp_path, upstream):
+    path = DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm")
+    assert path.name == 'a.rpm' and path.read_bytes() == b'a' * 100
+
+    # A new run revalidates with If-None-Match and keeps the cached copy on 304
+    again = DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm")
+    assert again == path
+    assert Upstream.requests[-1][1].get('If-None-Match')
+
+    # Changed content upstream replaces the cached copy
+    Upstream.files['/a.rpm'] = b'new'
+    assert DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm").read_bytes() == b'new'
+
+
+def test_last_modified_revalidation(tmp_path, upstream):
+    Upstream.use_etag = False
+    path = DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm")
+    assert DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm") == path
+    assert Upstream.requests[-1][1].get('If-Modified-Since') == LAST_MODIFIED
+
+
+def test_revalidated_once_per_run(tmp_path, upstream):
+    cache = DownloadCache(tmp_path)
+    cache.fetch(f"{upstream}/a.rpm")
+    cache.fetch(f"{upstream}/a.rpm")
+    assert len(Upstream.requests) == 1
+
+
+def test_offline_hit_and_miss(tmp_path, upstream):
+    path = DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm")
+    offline = DownloadCache(tmp_path, offline=True)
+    assert offline.fetch(f"{upstream}/a.rpm") == path
+    with pytest.raises(DownloadError):
+        offline.fetch(f"{upstream}/b.rpm")
+    assert len(Upstream.requests) == 1
+
+
+def test_sha256_mismatch(tmp_path, upstream):
+    with pytest.raises(DownloadError):
+        DownloadCache(tmp_path).fetch(f"{upstream}/a.rpm", sha256='0' * 64)
+
+
+def test_lru_eviction(tmp_path, upstream):
+    cache = DownloadCache(tmp_path, max_bytes=250)
+    a = cache.fetch(f"{upstream}/a.rpm")
+    b = cache.fetch(f"{upstream}/b.rpm")
+    # Using a again makes b the least recently used object
+    cache.fetch(f"{upstream}/a.rpm", revalidate=False)
+    c = cache.fetch(f"{upstream}/c.rpm")
+    assert a.exists() and c.exists()
+    assert not b.exists()
+    assert set(cache._load_index()) == {f"{upstream}/a.rpm", f"{upstream}/c.rpm"}
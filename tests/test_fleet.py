@@ -0,0 +1,64 @@
+"""Fleet runs over local transports, with a stub script standing in for fedora-install.py"""
+
+import importlib.util
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from provisioning import fleet as module
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'fleet'
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_fleet():
+    spec = importlib.util.spec_from_file_location('fleet', REPO_DIR / 'fleet.py')
+    fleet = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fleet)
+    return fleet
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    """fleet.py copying from a repository tree that holds the stub script next to the provisioning package"""
+    repo = tmp_path / 'repo'
+    shutil.copytree(REPO_DIR / 'provisioning', repo / 'provisioning', ignore=shutil.ignore_patterns('__pycache__'))
+    shutil.copy(FIXTURES / 'stub-install.py', repo)
+    monkeypatch.setattr(module, 'REPO_DIR', repo)
+    (tmp_path / 'remote').mkdir()
+    return load_fleet()
+
+
+def run_fleet(fleet, tmp_path, *script_args):
+    args = fleet.parse_args(['--transport', 'local', 'a', 'b', '--script', 'stub-install.py',
+                             '--remote-dir', str(tmp_path / 'remote'), '--report', str(tmp_path / 'report.json'),
+                             '--', *script_args])
+    succeeded = fleet.main(args)
+    return succeeded, json.loads((tmp_path / 'report.json').read_text())
+
+
+def test_local_fleet_run(fleet, tmp_path, capsys):
+    succeeded, reports = run_fleet(fleet, tmp_path)
+    assert succeeded
+    output = capsys.readouterr().out
+    # Output of every host is prefixed with its name
+    assert "[a] hello from the stub" in output
+    assert "[b] hello from the stub" in output
+    assert "2/2 hosts succeeded" in output
+
+    # The per-host summary comes from the --summary-json the stub wrote on the target
+    assert [(r['host'], r['status'], r['steps'], r['failed']) for r in reports] == [('a', 'done', 2, []),
+                                                                                   ('b', 'done', 2, [])]
+    # Every target's private directory is removed afterwards
+    assert list((tmp_path / 'remote').iterdir()) == []
+
+
+def test_local_fleet_run_with_a_failing_step(fleet, tmp_path, capsys):
+    succeeded, reports = run_fleet(fleet, tmp_path, '--fail')
+    assert not succeeded
+    assert [(r['host'], r['status'], r['failed']) for r in reports] == [('a', 'failed', ['configure']),
+                                                                        ('b', 'failed', ['configure'])]
+    assert "0/2 hosts succeeded" in capsys.readouterr().out
+    assert list((tmp_path / 'remote').iterdir()) == []
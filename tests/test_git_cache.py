@@ -0,0 +1,132 @@
+"""Bare git mirrors and the checkouts borrowing from them, against local bare repositories as upstream"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from provisioning import git_cache
+from provisioning.git_cache import GitCacheError, GitMirrorCache
+
+
+def git(*args, cwd=None):
+    result = subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+class Upstream:
+    """A bare repository standing in for the upstream URL, fed from a scratch working tree"""
+
+    def __init__(self, root):
+        self.path = root / 'upstream.git'
+        self.work = root / 'upstream-work'
+        git('init', '--quiet', '--bare', str(self.path))
+        git('init', '--quiet', '--initial-branch=main', str(self.work))
+
+    @property
+    def url(self):
+        return f"file://{self.path}"
+
+    def commit(self, text):
+        (self.work / 'README').write_text(text)
+        git('add', 'README', cwd=self.work)
+        git('commit', '--quiet', '-m', text, cwd=self.work)
+        git('push', '--quiet', str(self.path), 'HEAD:refs/heads/main', cwd=self.work)
+        return git('rev-parse', 'HEAD', cwd=self.work)
+
+    def tag(self, name):
+        git('tag', name, cwd=self.work)
+        git('push', '--quiet', str(self.path), f"refs/tags/{name}", cwd=self.work)
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    for variable in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+        monkeypatch.setenv(f"{variable}_NAME", 'Test')
+        monkeypatch.setenv(f"{variable}_EMAIL", 'test@example.com')
+    monkeypatch.setenv('GIT_CONFIG_NOSYSTEM', '1')
+    return Upstream(tmp_path)
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """URLs the mirrors fetched from, recorded from every git command the cache runs"""
+    urls = []
+
+    def run(argv, **kwargs):
+        if 'fetch' in argv:
+            urls.extend(arg for arg in argv if arg.startswith('file://'))
+        return git_cache_run(argv, **kwargs)
+
+    git_cache_run = git_cache.run
+    monkeypatch.setattr(git_cache, 'run', run)
+    return urls
+
+
+def head(repo):
+    return git('rev-parse', 'HEAD', cwd=repo)
+
+
+def test_first_checkout_borrows_objects_from_the_mirror(tmp_path, upstream):
+    commit = upstream.commit('one')
+    cache = GitMirrorCache(tmp_path / 'mirrors')
+    dest = cache.checkout(upstream.url, tmp_path / 'checkout', 'refs/heads/main')
+
+    mirror = cache.mirror_path(upstream.url)
+    assert (dest / '.git' / 'objects' / 'info' / 'alternates').read_text().split() == [str(mirror / 'objects')]
+    assert head(dest) == commit
+    assert git('branch', '--show-current', cwd=dest) == 'main'
+    assert git('remote', 'get-url', 'origin', cwd=dest) == upstream.url
+    assert (dest / 'README').read_text() == 'one'
+    # Nothing but refs was copied into the checkout
+    assert git('count-objects', cwd=dest).startswith('0 objects')
+
+
+def test_checkout_is_updated_in_place_when_the_pin_moves(tmp_path, upstream, fetches):
+    upstream.commit('one')
+    dest = GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, tmp_path / 'checkout', 'refs/heads/main')
+    (dest / 'build').mkdir()
+
+    # The next run sees the branch moved upstream
+    commit = upstream.commit('two')
+    GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, dest, 'refs/heads/main')
+    assert head(dest) == commit
+    assert (dest / 'README').read_text() == 'two'
+    assert (dest / 'build').is_dir()
+    assert fetches.count(upstream.url) == 2
+
+
+def test_immutable_tag_is_not_fetched_again(tmp_path, upstream, fetches):
+    commit = upstream.commit('one')
+    upstream.tag('v1')
+    GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, tmp_path / 'first', 'refs/tags/v1',
+                                                  depth=1, immutable=True)
+    assert fetches.count(upstream.url) == 1
+
+    dest = GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, tmp_path / 'second', 'refs/tags/v1',
+                                                         depth=1, immutable=True)
+    assert fetches.count(upstream.url) == 1
+    assert head(dest) == commit
+
+
+def test_rerun_works_offline_once_the_mirror_is_populated(tmp_path, upstream):
+    commit = upstream.commit('one')
+    GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, tmp_path / 'first', 'refs/heads/main')
+    shutil.rmtree(upstream.path)
+
+    offline = GitMirrorCache(tmp_path / 'mirrors', offline=True)
+    dest = offline.checkout(upstream.url, tmp_path / 'second', 'refs/heads/main')
+    assert head(dest) == commit
+    with pytest.raises(GitCacheError):
+        offline.checkout(upstream.url, tmp_path / 'third', 'refs/tags/v2')
+
+
+def test_unreachable_upstream_falls_back_to_the_mirror(tmp_path, upstream):
+    commit = upstream.commit('one')
+    GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, tmp_path / 'checkout', 'refs/heads/main')
+    shutil.rmtree(upstream.path)
+
+    dest = GitMirrorCache(tmp_path / 'mirrors').checkout(upstream.url, tmp_path / 'checkout', 'refs/heads/main')
+    assert head(dest) == commit
+    with pytest.raises(GitCacheError):
+        GitMirrorCache(tmp_path / 'other').update(upstream.url, 'refs/heads/main')
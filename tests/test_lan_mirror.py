@@ -0,0 +1,64 @@
+"""Dependencies of RPMs the mirror keeps as files, resolved against the mirror's repositories"""
+
+import subprocess
+
+import pytest
+
+from provisioning import lan_mirror as module
+from provisioning.lan_mirror import MirrorBuilder, MirrorError, required_capabilities
+
+# rpm --requires output of a 1Password RPM
+REQUIRES = """/bin/sh
+/bin/sh
+libX11-xcb.so.1()(64bit)
+libgtk-3.so.0()(64bit)
+libc.so.6(GLIBC_2.34)(64bit)
+xdg-utils >= 1.1
+rpmlib(CompressedFileNames) <= 3.0.4-1
+rpmlib(PayloadIsZstd) <= 5.4.18-1
+"""
+
+PROVIDERS = {
+    '/bin/sh': 'bash',
+    'libX11-xcb.so.1()(64bit)': 'libX11-xcb',
+    'libgtk-3.so.0()(64bit)': 'gtk3',
+    'libc.so.6(GLIBC_2.34)(64bit)': 'glibc',
+    'xdg-utils': 'xdg-utils',
+}
+
+
+@pytest.fixture
+def builder(tmp_path, monkeypatch):
+    commands = []
+
+    def run(argv, capture=False, **kwargs):
+        commands.append(argv)
+        if argv[0] == 'rpm':
+            return subprocess.CompletedProcess(argv, 0, REQUIRES.encode(), b'')
+        capabilities = next(a for a in argv if a.startswith('--whatprovides=')).split('=', 1)[1].split(',')
+        stdout = ''.join(f"{PROVIDERS[c]}\n" for c in capabilities)
+        return subprocess.CompletedProcess(argv, 0, stdout.encode(), b'')
+
+    monkeypatch.setattr(module, 'run', run)
+    mirror = MirrorBuilder(tmp_path / 'mirror', None, '41', 'x86_64')
+    mirror.commands = commands
+    return mirror
+
+
+def test_required_capabilities():
+    assert required_capabilities(REQUIRES) == ['/bin/sh', 'libX11-xcb.so.1()(64bit)', 'libgtk-3.so.0()(64bit)',
+                                               'libc.so.6(GLIBC_2.34)(64bit)', 'xdg-utils']
+
+
+def test_rpm_requirements(builder, tmp_path):
+    assert builder.rpm_requirements(tmp_path / '1password.rpm', tmp_path / 'repos') == [
+        'bash', 'glibc', 'gtk3', 'libX11-xcb', 'xdg-utils']
+    # Resolved against the private repository copy, not the system's
+    assert f"--setopt=reposdir={tmp_path / 'repos'}" in builder.commands[-1]
+
+
+def test_rpm_requirements_of_an_unreadable_rpm(builder, tmp_path, monkeypatch):
+    monkeypatch.setattr(module, 'run',
+                        lambda argv, **kwargs: subprocess.CompletedProcess(argv, 1, b'', b'not an rpm'))
+    with pytest.raises(MirrorError):
+        builder.rpm_requirements(tmp_path / '1password.rpm', tmp_path / 'repos')
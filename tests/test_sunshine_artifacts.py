@@ -0,0 +1,96 @@
+"""Artifact keys of Sunshine builds, computed from repository versions so a fresh host finds a packaged build"""
+
+import subprocess
+
+import pytest
+
+import install_sunshine
+from provisioning import package_state, rpm_artifacts
+from provisioning.host_facts import host
+from provisioning.repo_metadata import metadata
+from provisioning.rpm_artifacts import RpmArtifactError, RpmArtifacts
+
+# What dnf repoquery resolves every build input to
+REPOSITORY = {name: f"{name}-2.0-1.fc41" for name in install_sunshine.BUILD_INPUT_PACKAGES}
+
+
+@pytest.fixture
+def dnf(monkeypatch):
+    """Stub dnf and rpm database: the repositories offer REPOSITORY, nothing is installed"""
+    class Dnf:
+        installed = {}
+        commands = []
+        available = True
+
+    def run(argv, capture=False, check=False, **kwargs):
+        Dnf.commands.append(argv)
+        stdout = b''
+        if argv[:2] == ['dnf', 'repoquery']:
+            if not Dnf.available:
+                return subprocess.CompletedProcess(argv, 1, b'', b'Cannot download repomd.xml')
+            stdout = ''.join(f"{REPOSITORY[a]}\n" for a in argv if a in REPOSITORY).encode()
+        elif argv[:4] == ['sudo', 'dnf', 'install', '-y']:
+            for target in argv[4:]:
+                name = next((n for n in REPOSITORY if target in (n, REPOSITORY[n])), None)
+                if name:
+                    Dnf.installed[name] = target if target != name else REPOSITORY[name]
+        return subprocess.CompletedProcess(argv, 0, stdout, b'')
+
+    monkeypatch.setattr(install_sunshine, 'run', run)
+    monkeypatch.setattr(rpm_artifacts, 'run', run)
+    monkeypatch.setattr(metadata, 'refresh', lambda: None)
+    monkeypatch.setattr(host, '_facts', {'fedora_release': '41', 'machine': 'x86_64'})
+    monkeypatch.setattr(host, '_loaded', True)
+    monkeypatch.setattr(package_state, 'installed_rpms',
+                        lambda: [(name, 'x86_64', nvr) for name, nvr in Dnf.installed.items()])
+    monkeypatch.setattr(package_state, '_dump_lines', lambda cmd: set())
+    package_state.invalidate_installed_index()
+    yield Dnf
+    package_state.invalidate_installed_index()
+
+
+def packaged_build(tmp_path, key):
+    """An artifact directory holding the RPM a build host packaged under key"""
+    artifacts = RpmArtifacts(tmp_path)
+    (tmp_path / f"sunshine-{install_sunshine.SUNSHINE_VERSION}-1.k{key}.fc41.x86_64.rpm").touch()
+    return artifacts
+
+
+def test_fresh_host_finds_the_artifact(dnf, tmp_path):
+    # The build host had every input installed at the resolved version when it packaged
+    dnf.installed = dict(REPOSITORY)
+    package_state.invalidate_installed_index()
+    built_key = install_sunshine.sunshine_artifact_key(install_sunshine.sunshine_build_inputs())
+    artifacts = packaged_build(tmp_path, built_key)
+
+    # A fresh host has no compiler or -devel packages at all
+    dnf.installed = {}
+    package_state.invalidate_installed_index()
+    assert rpm_artifacts.installed_versions(install_sunshine.BUILD_INPUT_PACKAGES) == []
+    key = install_sunshine.sunshine_artifact_key(install_sunshine.sunshine_build_inputs())
+    assert key == built_key
+    assert install_sunshine.find_sunshine_artifact(artifacts, key) is not None
+
+
+def test_key_changes_with_the_repository(dnf, monkeypatch):
+    key = install_sunshine.sunshine_artifact_key(install_sunshine.sunshine_build_inputs())
+    monkeypatch.setitem(REPOSITORY, 'gcc', 'gcc-2.1-1.fc41')
+    assert install_sunshine.sunshine_artifact_key(install_sunshine.sunshine_build_inputs()) != key
+
+
+def test_resolve_failure(dnf):
+    dnf.available = False
+    with pytest.raises(RpmArtifactError):
+        install_sunshine.sunshine_build_inputs()
+
+
+def test_build_installs_the_resolved_versions(dnf):
+    build_inputs = install_sunshine.sunshine_build_inputs()
+    # Everything is installed, but the compiler is older than what the repositories resolve to
+    dnf.installed = {**REPOSITORY, 'gcc': 'gcc-1.0-1.fc41'}
+    dnf.installed.update({name: name for name in install_sunshine.SUNSHINE_DEPENDENCIES if name not in REPOSITORY})
+    package_state.invalidate_installed_index()
+
+    install_sunshine.install_dependencies(build_inputs=build_inputs)
+    assert dnf.commands[-1][-1:] == ['gcc-2.0-1.fc41']
+    assert rpm_artifacts.installed_versions(install_sunshine.BUILD_INPUT_PACKAGES) == build_inputs
@@ -0,0 +1,153 @@
+"""Workspace manifest parsing and syncing, against local bare repositories as upstream"""
+
+import importlib.util
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from provisioning.workspace import ManifestError, read_manifest, sync_repo
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'workspace'
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def git(*args, cwd=None):
+    result = subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def load_workspace_sync():
+    spec = importlib.util.spec_from_file_location('workspace_sync', REPO_DIR / 'workspace-sync.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def upstreams(tmp_path, monkeypatch):
+    """Make bare repositories with one commit under tmp_path/upstream, returning their file:// URLs"""
+    for variable in ('GIT_AUTHOR', 'GIT_COMMITTER'):
+        monkeypatch.setenv(f"{variable}_NAME", 'Test')
+        monkeypatch.setenv(f"{variable}_EMAIL", 'test@example.com')
+    monkeypatch.setenv('GIT_CONFIG_NOSYSTEM', '1')
+
+    def make(*names):
+        urls = []
+        for name in names:
+            bare, work = tmp_path / 'upstream' / f"{name}.git", tmp_path / 'upstream-work' / name
+            git('init', '--quiet', '--bare', '--initial-branch=main', str(bare))
+            # Partial clones need a server that accepts filters
+            git('config', 'uploadpack.allowFilter', 'true', cwd=bare)
+            git('init', '--quiet', '--initial-branch=main', str(work))
+            commit(work, bare, 'one')
+            urls.append(f"file://{bare}")
+        return urls
+    return make
+
+
+def commit(work, bare, text):
+    (Path(work) / 'README').write_text(text)
+    git('add', 'README', cwd=work)
+    git('commit', '--quiet', '-m', text, cwd=work)
+    git('push', '--quiet', str(bare), 'HEAD:refs/heads/main', cwd=work)
+    return git('rev-parse', 'HEAD', cwd=work)
+
+
+def write_manifest(tmp_path, text):
+    path = tmp_path / 'workspace.toml'
+    path.write_text(text)
+    return path
+
+
+def test_read_sample_manifest():
+    root, specs = read_manifest(FIXTURES / 'workspace.toml')
+    assert root == FIXTURES.resolve() / 'src'
+    sunshine, scripts, tool, plain = specs
+
+    assert sunshine.path == root / 'fw' / 'sunshine'
+    assert sunshine.fork == 'git@github.com:me/Sunshine.git'
+    assert (sunshine.fork_remote, sunshine.push_default) == ('me', 'me')
+
+    # path defaults to the repository name, with or without .git
+    assert scripts.path == root / 'fedora-scripts'
+    assert scripts.fork == 'git@github.com:me/fedora-scripts.git'
+
+    # Keys of a [[repo]] win over [defaults]
+    assert tool.fork == 'https://gitlab.com/me/tool-fork.git'
+    assert (tool.fork_remote, tool.push_default, tool.branch) == ('mine', 'origin', 'stable')
+
+    assert plain.fork is None and plain.push_default is None
+
+
+def test_manifest_errors(tmp_path):
+    with pytest.raises(ManifestError):
+        read_manifest(tmp_path / 'missing.toml')
+    with pytest.raises(ManifestError):
+        read_manifest(write_manifest(tmp_path, '[[repo]]\npath = "x"\n'))
+    with pytest.raises(ManifestError):
+        read_manifest(write_manifest(tmp_path, '[[repo]]\nurl = "a/x.git"\n[[repo]]\nurl = "b/x.git"\n'))
+
+
+def test_clone_missing_repository(tmp_path, upstreams):
+    url, = upstreams('app')
+    fork = str(tmp_path / 'forks' / 'app.git')
+    _, (spec,) = read_manifest(write_manifest(tmp_path, f"""
+root = "{tmp_path}/work"
+[defaults]
+fork = "{tmp_path}/forks/{{name}}.git"
+[[repo]]
+url = "{url}"
+"""))
+    assert sync_repo(spec) == ('cloned', [f"fork -> {fork}", "pushDefault fork"])
+
+    clone = tmp_path / 'work' / 'app'
+    assert (clone / 'README').read_text() == 'one'
+    assert git('config', 'remote.origin.partialclonefilter', cwd=clone) == 'blob:none'
+    assert git('config', 'remote.origin.url', cwd=clone) == url
+    assert git('config', 'remote.fork.url', cwd=clone) == fork
+    assert git('config', 'remote.pushDefault', cwd=clone) == 'fork'
+
+
+def test_fetch_existing_repository(tmp_path, upstreams):
+    url, = upstreams('app')
+    _, (spec,) = read_manifest(write_manifest(tmp_path, f"""
+root = "{tmp_path}/work"
+[[repo]]
+url = "{url}"
+fork = "{tmp_path}/forks/app.git"
+fork_remote = "me"
+"""))
+    sync_repo(spec)
+    head = commit(tmp_path / 'upstream-work' / 'app', tmp_path / 'upstream' / 'app.git', 'two')
+
+    # Remotes that are already configured are left alone
+    assert sync_repo(spec) == ('fetched', [])
+    clone = tmp_path / 'work' / 'app'
+    assert git('rev-parse', 'origin/main', cwd=clone) == head
+    assert git('config', 'remote.me.url', cwd=clone) == f"{tmp_path}/forks/app.git"
+    assert git('config', 'remote.pushDefault', cwd=clone) == 'me'
+
+    # A fork URL changed in the manifest is updated in place
+    spec.fork = f"{tmp_path}/forks/other.git"
+    assert sync_repo(spec) == ('fetched', [f"me -> {spec.fork}"])
+    assert git('config', 'remote.me.url', cwd=clone) == spec.fork
+
+
+def test_workspace_sync_report(tmp_path, upstreams, capsys):
+    urls = upstreams('one', 'two')
+    repos = ''.join(f'[[repo]]\nurl = "{url}"\n' for url in urls)
+    manifest = write_manifest(tmp_path, f'root = "{tmp_path}/work"\n{repos}')
+    workspace_sync = load_workspace_sync()
+    args = workspace_sync.parse_args([str(manifest), '--report', str(tmp_path / 'report.json')])
+
+    assert workspace_sync.main(args)
+    reports = json.loads((tmp_path / 'report.json').read_text())
+    assert [(r['path'], r['status'], r['action']) for r in reports] == [('one', 'done', 'cloned'),
+                                                                         ('two', 'done', 'cloned')]
+
+    assert workspace_sync.main(args)
+    reports = json.loads((tmp_path / 'report.json').read_text())
+    assert [r['action'] for r in reports] == ['fetched', 'fetched']
+    assert "2/2 repositories synced" in capsys.readouterr().out
@@ -1,12 +1,18 @@
 #!/bin/bash
 # Get the project directory name
 project_name=$(basename "$PWD")
+script_dir=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")
 
-# Create a new virtual environment named after the project
-python3 -m venv "$project_name-env"
+# Clone the virtual environment named after the project from a cached template,
+# with the project's requirements preinstalled when it has a requirements.txt
+requirements=()
+if [ -f requirements.txt ]; then
+    requirements=(-r requirements.txt)
+fi
+python3 "$script_dir/new-venv.py" "$project_name-env" "${requirements[@]}" || return 1 2>/dev/null || exit 1
 
-# Activate the environment (optional for automation)
+# Activation only lasts when this script is sourced; otherwise run $project_name-env/bin/python
 source "$project_name-env/bin/activate"
 
 # Output message
-echo "Virtual environment '$project_name-env' created and activated."
+echo "Virtual environment '$project_name-env' created."
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from provisioning.runner import finish_run, tracer
+from provisioning.scheduler import Step, run_steps
+from provisioning.workspace import ManifestError, SyncError, print_report, read_manifest, sync_repo
+
+DEFAULT_MANIFEST = '~/git/workspace.toml'
+DEFAULT_SYNC_JOBS = 8
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Clone or update every repository of a workspace manifest")
+    parser.add_argument('manifest', nargs='?', default=os.path.expanduser(DEFAULT_MANIFEST),
+                        help="TOML manifest of the repositories (default: ~/git/workspace.toml)")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_SYNC_JOBS,
+                        help="maximum number of repositories cloned or fetched at the same time")
+    parser.add_argument('--report', metavar='FILE',
+                        help="write the per-repository report as JSON")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace-event JSON of every repository and git command")
+    return parser.parse_args(argv)
+
+def main(args):
+    """Sync every repository and print the status table"""
+    try:
+        root, specs = read_manifest(args.manifest)
+    except ManifestError as e:
+        print(e)
+        return False
+    outcomes = {}
+
+    def sync_step(spec, name):
+        def sync():
+            try:
+                outcomes[name] = sync_repo(spec)
+            except SyncError as e:
+                print(e)
+                return False
+        return sync
+
+    # Every repository is an independent step, so output is prefixed with its path
+    names = {spec.path: os.path.relpath(spec.path, root) for spec in specs}
+    started = time.time()
+    run_steps([Step(names[spec.path], sync_step(spec, names[spec.path])) for spec in specs], jobs=args.jobs)
+
+    records = {record.name: record for record in tracer.steps if record.start >= started}
+    reports = []
+    for spec in specs:
+        name = names[spec.path]
+        action, notes = outcomes.get(name, (None, []))
+        reports.append({'path': name, 'url': spec.url, 'status': records[name].status, 'action': action,
+                        'duration': records[name].duration, 'notes': notes})
+    print_report(reports)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"Report written to {args.report}")
+    return all(report['status'] == 'done' for report in reports)
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        succeeded = main(args)
+    finally:
+        finish_run(args.trace)
+    sys.exit(0 if succeeded else 1)